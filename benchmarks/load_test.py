@@ -0,0 +1,134 @@
+# Load test for the HTTP prediction service (streamlit/prediction_service.py)
+#
+# Sends --requests single-point requests from --concurrency client threads and reports throughput,
+# latency percentiles and rejected requests. Without --url the service is started in-process on a free
+# port with the fake Earth Engine backend (or, with --backend none, the placeholder index values), so the
+# test runs fully locally; --locations controls how many distinct coordinates the requests cycle through
+# (repeats exercise the shared feature fetches).
+#
+# Usage (from the repository root):
+#   python benchmarks/load_test.py --requests 2000 --concurrency 32
+#   python benchmarks/load_test.py --url http://127.0.0.1:8080 --output load_test.json
+
+import argparse
+import json
+import statistics
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'streamlit'))
+
+import synthetic_data  # noqa: E402
+
+
+def start_local_service(backend, fake_latency, max_wait):
+    # In-process service on a free port; returns (url, server, service)
+    import metrics
+    from batch_predict import load_model, model_encodings
+    from prediction_service import IndexFetcher, PredictionServer, PredictionService, make_backend
+
+    metrics.enable()
+    model = load_model()
+    freq_encoding, mean_encoding = model_encodings(model)
+    service = PredictionService(model, freq_encoding, mean_encoding,
+                                index_fetcher=IndexFetcher(make_backend(backend, fake_latency=fake_latency)),
+                                max_wait=max_wait)
+    server = PredictionServer(('127.0.0.1', 0), service, quiet=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'http://127.0.0.1:{server.server_address[1]}', server, service
+
+
+def make_payloads(n_locations, seed=0):
+    # Feature table rows without the index columns, so the service has to fetch them
+    from batch_predict import load_encodings
+
+    freq_encoding, _ = load_encodings()
+    table = synthetic_data.feature_table(n_locations, freq_encoding.keys(), seed)
+    columns = ['lat', 'long', 'elevation', 'sand', 'silt', 'clay', 'land_cover_type', 'main_vegetation_type']
+    return [json.dumps(record).encode() for record in table[columns].to_dict(orient='records')]
+
+
+def send(url, payload, timeout):
+    request = urllib.request.Request(f'{url}/predict', data=payload, headers={'Content-Type': 'application/json'})
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except (urllib.error.URLError, OSError):
+        status = None
+    return status, time.perf_counter() - start
+
+
+def run(url, payloads, n_requests, concurrency, timeout=60):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda i: send(url, payloads[i % len(payloads)], timeout), range(n_requests)))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency for status, latency in results if status == 200)
+    statuses = {}
+    for status, _ in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+    def percentile(q):
+        return latencies[min(len(latencies) - 1, int(q * len(latencies)))] if latencies else None
+
+    return {
+        'requests': n_requests,
+        'concurrency': concurrency,
+        'seconds': elapsed,
+        'requests_per_s': n_requests / elapsed,
+        'statuses': statuses,
+        'latency_mean_s': statistics.fmean(latencies) if latencies else None,
+        'latency_p50_s': percentile(0.50),
+        'latency_p95_s': percentile(0.95),
+        'latency_p99_s': percentile(0.99),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the SOC prediction service.")
+    parser.add_argument('--url', help="Running service (default: start one in-process with the fake backend)")
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--locations', type=int, default=200, help="Distinct coordinates to cycle through")
+    parser.add_argument('--backend', choices=['fake', 'none'], default='fake',
+                        help="Index source of the in-process service")
+    parser.add_argument('--fake-latency', type=float, default=0.05,
+                        help="Seconds per fake backend request for the in-process service")
+    parser.add_argument('--max-wait', type=float, default=0.005, help="Batching window of the in-process service")
+    parser.add_argument('--output', help="Write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    server = service = None
+    url = args.url
+    if url is None:
+        url, server, service = start_local_service(args.backend, args.fake_latency, args.max_wait)
+    try:
+        results = run(url, make_payloads(args.locations), args.requests, args.concurrency)
+        if service is not None:
+            results['batches'] = service.batcher.batches
+            results['mean_batch_rows'] = service.batcher.rows / max(service.batcher.batches, 1)
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+            service.close()
+
+    for key, value in results.items():
+        print(f"{key:<18} {value:.4f}" if isinstance(value, float) else f"{key:<18} {value}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
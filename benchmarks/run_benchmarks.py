@@ -0,0 +1,261 @@
+# Benchmarks for the inference, feature engineering and data pipeline hot paths
+#
+# All inputs are synthetic (see synthetic_data.py) apart from the exported model and the vegetation
+# encodings, which are the ones the app loads. Every benchmark is timed with time.perf_counter over
+# --repeat rounds of enough calls to fill --min-time, and the per-call min/median/mean plus the
+# throughput (rows per second at the median) are written as JSON.
+#
+# Usage (from the repository root):
+#   python benchmarks/run_benchmarks.py --output benchmarks/results.json
+#   python benchmarks/run_benchmarks.py --compare benchmarks/baseline.json --tolerance 0.15
+#   python benchmarks/run_benchmarks.py --filter predict
+#
+# With --compare, benchmarks whose median time grew by more than --tolerance relative to the baseline
+# are reported as regressions and the exit status is 1, so the run can gate a change. Baselines are
+# only comparable when recorded on the same machine with the same --rows/--locations/--quarters.
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'streamlit'))
+
+import synthetic_data  # noqa: E402
+from batch_predict import MODEL_PATH, build_feature_frame, load_encodings, load_model  # noqa: E402
+from index_aggregation import aggregate_composites, read_composites  # noqa: E402
+from spatial_join import spatial_join  # noqa: E402
+from model_bundle import BUNDLE_PATH, ModelBundle  # noqa: E402
+from tree_engine import ENGINE_PATH  # noqa: E402
+
+DEFAULT_ROWS = 20_000
+DEFAULT_LOCATIONS = 20_000
+DEFAULT_QUARTERS = 20
+DEFAULT_REPEAT = 5
+DEFAULT_MIN_TIME = 0.2
+DEFAULT_TOLERANCE = 0.10
+# Feature table joins match the sample locations against a table that has them with some jitter
+JOIN_JITTER_DEG = 2e-5
+INDEX_COLUMNS = [f'{index}_{stat}' for index in ['NDVI', 'NDMI', 'BSI', 'SOCI'] for stat in ('mean', 'std', 'trend')]
+
+
+def measure(fn, repeat=DEFAULT_REPEAT, min_time=DEFAULT_MIN_TIME):
+    # Calibrate the number of calls per round like timeit.autorange, then time `repeat` rounds
+    fn()
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or number >= 1_000_000:
+            break
+        number *= 10 if elapsed < min_time / 10 else 2
+
+    times = [elapsed / number]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        times.append((time.perf_counter() - start) / number)
+    return {
+        'number': number,
+        'repeat': repeat,
+        'min_s': min(times),
+        'median_s': statistics.median(times),
+        'mean_s': statistics.fmean(times),
+    }
+
+
+def prepare(workdir, rows, locations, n_quarters, seed):
+    # Synthetic tables plus their CSV and Parquet files in workdir
+    freq_encoding, mean_encoding = load_encodings()
+    table = synthetic_data.feature_table(rows, freq_encoding.keys(), seed)
+    comps = synthetic_data.composites(locations, n_quarters, seed=seed + 1)
+
+    rng = np.random.default_rng(seed + 2)
+    aggregates = table[['lat', 'long'] + INDEX_COLUMNS].copy()
+    aggregates['lat'] += rng.uniform(-JOIN_JITTER_DEG, JOIN_JITTER_DEG, rows)
+    aggregates['long'] += rng.uniform(-JOIN_JITTER_DEG, JOIN_JITTER_DEG, rows)
+    aggregates = aggregates.sample(frac=1, random_state=seed).reset_index(drop=True)
+
+    paths = {
+        'feature_table_csv': os.path.join(workdir, 'feature_table.csv'),
+        'composites_dir': os.path.join(workdir, 'composites'),
+    }
+    table.to_csv(paths['feature_table_csv'], index=False)
+    synthetic_data.write_composites(comps, paths['composites_dir'])
+    try:
+        import columnar_store
+    except ImportError:
+        pass
+    else:
+        paths['feature_table_parquet'] = os.path.join(workdir, 'feature_table.parquet')
+        paths['composites_store'] = os.path.join(workdir, 'composites.parquet')
+        columnar_store.convert_table(paths['feature_table_csv'], paths['feature_table_parquet'])
+        columnar_store.convert_composites(paths['composites_dir'], paths['composites_store'])
+
+    return {
+        'freq_encoding': freq_encoding,
+        'mean_encoding': mean_encoding,
+        'feature_table': table,
+        'composites': comps,
+        'aggregates': aggregates,
+        'paths': paths,
+    }
+
+
+def _models():
+    # The exported NumPy engine always, the pickled LightGBM model when lightgbm is installed;
+    # returns name -> (model, predict kwargs)
+    models = {'engine': (load_model(ENGINE_PATH), {})}
+    try:
+        # verbose=-1 silences the parameter warnings LightGBM prints on every predict call
+        models['lightgbm'] = (load_model(MODEL_PATH), {'verbose': -1})
+    except ImportError:
+        pass
+    return models
+
+
+def define_benchmarks(data):
+    # Returns (name, rows processed per call, callable)
+    freq_encoding, mean_encoding = data['freq_encoding'], data['mean_encoding']
+    table, comps, paths = data['feature_table'], data['composites'], data['paths']
+    rows, locations = len(table), comps['.geo'].nunique()
+    single_input = table.iloc[:1].reset_index(drop=True)
+    benchmarks = []
+
+    for name, (model, kwargs) in _models().items():
+        names = list(model.feature_name_)
+        single = build_feature_frame(single_input, freq_encoding, mean_encoding, names)
+        batch = build_feature_frame(table, freq_encoding, mean_encoding, names)
+        benchmarks += [
+            (f'predict_single_{name}', 1, lambda m=model, x=single, k=kwargs: m.predict(x, **k)),
+            (f'predict_batch_{name}', rows, lambda m=model, x=batch, k=kwargs: m.predict(x, **k)),
+        ]
+
+    # The app encodes the form values on every prediction; the bundle's encoder skips the DataFrame
+    bundle = ModelBundle.load(BUNDLE_PATH)
+    single_record = single_input.iloc[0].to_dict()
+    benchmarks += [
+        ('encode_single', 1, lambda: build_feature_frame(single_input, freq_encoding, mean_encoding)),
+        ('encode_batch', rows, lambda: build_feature_frame(table, freq_encoding, mean_encoding)),
+        ('encode_single_bundle', 1, lambda: bundle.encoder.encode_record(single_record)),
+        ('encode_batch_bundle', rows, lambda: bundle.encode(table)),
+        ('load_bundle', 1, lambda: ModelBundle.load(BUNDLE_PATH)),
+        ('aggregate_quarterly', locations, lambda: aggregate_composites(comps)),
+        ('join_feature_table', rows, lambda: spatial_join(table, data['aggregates'], INDEX_COLUMNS)),
+        ('load_feature_table_csv', rows, lambda: pd.read_csv(paths['feature_table_csv'])),
+        ('load_composites_csv', len(comps), lambda: read_composites(paths['composites_dir'])),
+    ]
+    if 'feature_table_parquet' in paths:
+        from columnar_store import load_composites, load_feature_table
+
+        benchmarks += [
+            ('load_feature_table_parquet', rows, lambda: load_feature_table(paths['feature_table_parquet'])),
+            ('load_composites_parquet', len(comps), lambda: load_composites(paths['composites_store'])),
+        ]
+    return benchmarks
+
+
+def run(rows=DEFAULT_ROWS, locations=DEFAULT_LOCATIONS, n_quarters=DEFAULT_QUARTERS, repeat=DEFAULT_REPEAT,
+        min_time=DEFAULT_MIN_TIME, name_filter=None, seed=0, log=print):
+    with tempfile.TemporaryDirectory() as workdir:
+        data = prepare(workdir, rows, locations, n_quarters, seed)
+        results = {}
+        for name, n_rows, fn in define_benchmarks(data):
+            if name_filter and name_filter not in name:
+                continue
+            result = measure(fn, repeat, min_time)
+            result['rows'] = n_rows
+            result['rows_per_s'] = n_rows / result['median_s']
+            results[name] = result
+            log(f"{name:<28} {result['median_s'] * 1e3:>10.3f} ms  {result['rows_per_s']:>14,.0f} rows/s")
+
+    return {
+        'metadata': {
+            'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'rows': rows,
+            'locations': locations,
+            'quarters': n_quarters,
+            'seed': seed,
+        },
+        'benchmarks': results,
+    }
+
+
+def compare(current, baseline, tolerance=DEFAULT_TOLERANCE):
+    # Returns (rows of name/baseline/current/ratio/status, list of regressed names)
+    report, regressions = [], []
+    for name, result in current['benchmarks'].items():
+        reference = baseline['benchmarks'].get(name)
+        if reference is None:
+            report.append((name, None, result['median_s'], None, 'new'))
+            continue
+        ratio = result['median_s'] / reference['median_s']
+        status = 'ok'
+        if ratio > 1 + tolerance:
+            status = 'REGRESSION'
+            regressions.append(name)
+        elif ratio < 1 / (1 + tolerance):
+            status = 'faster'
+        report.append((name, reference['median_s'], result['median_s'], ratio, status))
+    return report, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark inference, feature engineering and data loading.")
+    parser.add_argument('--output', help="Write the results as JSON to this file")
+    parser.add_argument('--compare', metavar='BASELINE', help="Compare against a previous JSON result")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help="Allowed relative slowdown before a benchmark counts as regressed")
+    parser.add_argument('--filter', help="Only run benchmarks whose name contains this string")
+    parser.add_argument('--rows', type=int, default=DEFAULT_ROWS, help="Rows of the synthetic feature table")
+    parser.add_argument('--locations', type=int, default=DEFAULT_LOCATIONS,
+                        help="Locations of the synthetic quarterly composites")
+    parser.add_argument('--quarters', type=int, default=DEFAULT_QUARTERS)
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT)
+    parser.add_argument('--min-time', type=float, default=DEFAULT_MIN_TIME, help="Minimum seconds per round")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    results = run(args.rows, args.locations, args.quarters, args.repeat, args.min_time, args.filter, args.seed)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results saved to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        scale = ('rows', 'locations', 'quarters')
+        if any(baseline['metadata'].get(key) != results['metadata'][key] for key in scale):
+            print("Warning: the baseline was recorded with different --rows/--locations/--quarters")
+        report, regressions = compare(results, baseline, args.tolerance)
+        print()
+        for name, before, after, ratio, status in report:
+            before = f"{before * 1e3:10.3f} ms" if before is not None else f"{'-':>13}"
+            ratio = f"{ratio:6.2f}x" if ratio is not None else f"{'-':>7}"
+            print(f"{name:<28} {before} -> {after * 1e3:10.3f} ms  {ratio}  {status}")
+        if regressions:
+            print(f"{len(regressions)} benchmark(s) slower than the baseline by more than {args.tolerance:.0%}")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,99 @@
+# Synthetic inputs for the benchmarks, following the schemas of the real pipeline data
+#
+#   feature_table()   -> same columns and dtypes as ml_model/feature_table_fixed.csv
+#   composites()      -> quarterly exports as read by index_aggregation.read_composites
+#   write_composites() writes them as output_all_locations_YYYY_MM.csv files like the Earth Engine exports
+#
+# Values are drawn from ranges similar to the real data so that the model and the joins do
+# representative work; they carry no meaning otherwise.
+
+import os
+
+import numpy as np
+import pandas as pd
+
+LAND_COVER_TYPES = ['Cropland', 'Grassland', 'Woodland', 'Bareland', 'Shrubland']
+INDEX_RANGES = {
+    'NDVI': (0.0, 0.6),
+    'NDMI': (-0.2, 0.4),
+    'BSI': (-0.3, 0.2),
+    'SOCI': (0.0, 2e-4),
+}
+# Roughly the extent of the LUCAS 2018 points
+LAT_RANGE = (34.5, 70.0)
+LONG_RANGE = (-10.0, 34.0)
+
+
+def _texture(rng, n):
+    # sand, silt and clay in percent, summing to 100
+    fractions = rng.dirichlet([4, 3, 2], size=n) * 100
+    return fractions[:, 0], fractions[:, 1], fractions[:, 2]
+
+
+def coordinates(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return (np.round(rng.uniform(*LAT_RANGE, n), 5), np.round(rng.uniform(*LONG_RANGE, n), 5))
+
+
+def feature_table(n, vegetation_types=None, seed=0):
+    rng = np.random.default_rng(seed)
+    lat, long = coordinates(n, seed)
+    vegetation_types = list(vegetation_types) if vegetation_types else [f'Crop {i}' for i in range(40)]
+    dates = pd.Timestamp('2018-03-01') + pd.to_timedelta(rng.integers(0, 240, n), unit='D')
+
+    columns = {
+        'sample_date': dates.strftime('%Y-%m-%d'),
+        'lat': lat,
+        'long': long,
+        'depth': '0-20 cm',
+        'elevation': rng.integers(-5, 1500, n),
+    }
+    for index, (low, high) in INDEX_RANGES.items():
+        columns[f'{index}_mean'] = rng.uniform(low, high, n)
+        columns[f'{index}_std'] = rng.uniform(0, (high - low) / 4, n)
+        columns[f'{index}_trend'] = rng.normal(0, (high - low) / 200, n)
+    columns['land_cover_type'] = rng.choice(LAND_COVER_TYPES, n, p=[0.6, 0.3, 0.05, 0.03, 0.02])
+    columns['main_vegetation_type'] = rng.choice(vegetation_types, n)
+    columns['soc_in_percent'] = np.round(rng.lognormal(0.4, 0.6, n), 1)
+    columns['sand'], columns['silt'], columns['clay'] = _texture(rng, n)
+    return pd.DataFrame(columns)
+
+
+def quarters(n_quarters, first_year=2014):
+    # Chronological labels 2014_Q1, 2014_Q2, ...
+    return [f'{first_year + i // 4}_Q{i % 4 + 1}' for i in range(n_quarters)]
+
+
+def composites(n_locations, n_quarters=20, missing_fraction=0.1, seed=0):
+    # One row per location and quarter (a fraction of them missing, like cloudy quarters), with the
+    # GeoJSON .geo string, parsed lat/long and a quarter column as returned by read_composites
+    rng = np.random.default_rng(seed)
+    lat, long = coordinates(n_locations, seed)
+    geo = pd.Series([f'{{"type":"Point","coordinates":[{x:.8f},{y:.8f}]}}' for x, y in zip(long, lat)])
+
+    frames = []
+    for i, quarter in enumerate(quarters(n_quarters)):
+        keep = rng.random(n_locations) >= missing_fraction
+        year, q = quarter.split('_Q')
+        start = pd.Timestamp(f'{year}-{3 * (int(q) - 1) + 1:02d}-01')
+        frame = pd.DataFrame({
+            'system:index': np.arange(keep.sum()).astype(str),
+            **{index: rng.uniform(low, high, keep.sum()) for index, (low, high) in INDEX_RANGES.items()},
+            'sample_date': (start + pd.to_timedelta(rng.integers(0, 90, keep.sum()), unit='D')).strftime('%Y-%m-%d'),
+            '.geo': geo[keep].to_numpy(),
+            'quarter': quarter,
+            'lat': lat[keep],
+            'long': long[keep],
+        })
+        frames.append(frame)
+    return pd.concat(frames, ignore_index=True)
+
+
+def write_composites(df, directory):
+    # One CSV per quarter in the export layout (BSI, NDMI, NDVI, SOCI, sample_date, .geo)
+    os.makedirs(directory, exist_ok=True)
+    for quarter, frame in df.groupby('quarter'):
+        year, q = quarter.split('_Q')
+        path = os.path.join(directory, f'output_all_locations_{year}_{3 * (int(q) - 1) + 1:02d}.csv')
+        frame[['system:index', 'BSI', 'NDMI', 'NDVI', 'SOCI', 'sample_date', '.geo']].to_csv(path, index=False)
+    return directory
@@ -0,0 +1,127 @@
+# Builds the model feature table in-process (replaces data/sql_queries/joining_all_to_feature_table.sql,
+# the PostGIS import scripts and the soc fix in fix_soc_data_bug.ipynb)
+#
+# Steps:
+#   1. agricultural LUCAS 2018 samples with soc_in_percent = OC / 10 (g/kg -> %)
+#   2. elevations corrected by elevation_backfill.py replace the LUCAS ones
+#   3. satellite index aggregates, sand/silt/clay (and optionally the 2017 mean temperature) are
+#      joined to the nearest location within --tolerance metres instead of on rounded coordinates
+# The match rate of every join is printed. Inputs can be CSV or Parquet (see streamlit/columnar_store.py).
+#
+# Usage (from the repository root):
+#   python data/lucas_db/python_scripts/build_feature_table.py ml_model/feature_table_fixed.csv
+
+import argparse
+import sys
+from decimal import ROUND_HALF_UP, Decimal
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[3] / 'streamlit'))
+
+from source_ingestion import LUCAS_CSV, load_source  # noqa: E402
+from spatial_join import DEFAULT_TOLERANCE_M, spatial_join  # noqa: E402
+
+ELEVATION_CSV = 'data/lucas_db/csv_datasets/location_elevation_fixed.csv'
+INDICES_TABLE = 'data/satellite_data/indices/landsat_indices_agged.csv'
+SOIL_TYPES_CSV = 'data/lucas_db/csv_datasets/lucas_soil_types.csv'
+MEAN_TEMP_CSV = 'data/satellite_data/climate/mean_temp_2017.csv'
+
+AGRICULTURE = 'Agriculture (excluding fallow land and kitchen gardens)'
+INDEX_COLUMNS = [f'{index}_{stat}' for index in ['NDVI', 'NDMI', 'BSI', 'SOCI'] for stat in ('mean', 'std', 'trend')]
+# The SQL COPY mapped the soil type file by position (lat, long, sand, silt, clay), so the trained model
+# saw its third column as sand; the same mapping is kept here
+SOIL_TYPE_COLUMNS = ['lat', 'long', 'sand', 'silt', 'clay']
+
+
+def read_table(path, **kwargs):
+    if str(path).endswith('.parquet'):
+        from columnar_store import load_table
+
+        return load_table(path)
+    return pd.read_csv(path, **kwargs)
+
+
+def load_lucas_samples(lucas_path=LUCAS_CSV):
+    # Typed and cached by source_ingestion.py; OC values below the detection limit are NaN as in the SQL import
+    columns = ['SURVEY_DATE', 'TH_LAT', 'TH_LONG', 'Depth', 'Elev', 'LC0_Desc', 'LC1_Desc', 'LU1_Desc', 'OC']
+    lucas = load_source('lucas_2018', lucas_path, columns=columns)
+    lucas = lucas[lucas['LU1_Desc'] == AGRICULTURE]
+    return pd.DataFrame({
+        'sample_date': lucas['SURVEY_DATE'].dt.strftime('%Y-%m-%d'),
+        'lat': lucas['TH_LAT'],
+        'long': lucas['TH_LONG'],
+        'depth': lucas['Depth'].astype(str),
+        'elevation': lucas['Elev'],
+        'land_cover_type': lucas['LC0_Desc'].astype(str),
+        'main_vegetation_type': lucas['LC1_Desc'].astype(str),
+        'soc_in_percent': lucas['OC'] / 10,
+    }).reset_index(drop=True)
+
+
+def round_coordinate(values, decimals=5):
+    # ROUND(x::NUMERIC, 5) as in PostgreSQL: the 15 significant digits of the double, halves rounded away
+    # from zero (pandas rounds the binary value, which differs for values such as 41.834295)
+    step = Decimal(1).scaleb(-decimals)
+    return values.map(lambda v: float(Decimal(f'{v:.15g}').quantize(step, rounding=ROUND_HALF_UP)))
+
+
+def build_feature_table(tolerance_m=DEFAULT_TOLERANCE_M, lucas_path=LUCAS_CSV, elevation_path=ELEVATION_CSV,
+                        indices_path=INDICES_TABLE, soil_types_path=SOIL_TYPES_CSV, mean_temp_path=None,
+                        log=print):
+    samples = load_lucas_samples(lucas_path)
+    reports = {}
+
+    elevation = read_table(elevation_path)
+    samples, reports['elevation'] = spatial_join(
+        samples, elevation.rename(columns={'elevation': 'elevation_fixed'}), ['elevation_fixed'], tolerance_m
+    )
+    samples['elevation'] = samples['elevation_fixed'].fillna(samples['elevation']).astype('int64')
+    samples = samples.drop(columns='elevation_fixed')
+
+    if mean_temp_path:
+        samples, reports['mean_temp_2017'] = spatial_join(
+            samples, read_table(mean_temp_path), ['mean_temp_2017'], tolerance_m
+        )
+    samples, reports['satellite_indices'] = spatial_join(samples, read_table(indices_path), INDEX_COLUMNS,
+                                                         tolerance_m)
+    soil_types = read_table(soil_types_path)
+    soil_types.columns = SOIL_TYPE_COLUMNS
+    samples, reports['soil_types'] = spatial_join(samples, soil_types, ['sand', 'silt', 'clay'], tolerance_m)
+
+    for source, report in reports.items():
+        log(f"{source}: {report['matched']}/{report['rows']} rows matched ({report['match_rate']:.1%}), "
+            f"{report['ambiguous']} ambiguous, max distance {report['max_distance_m']} m")
+
+    # Same layout as feature_table_fixed.csv: coordinates rounded to 5 decimals, sorted by location
+    samples['lat'] = round_coordinate(samples['lat'])
+    samples['long'] = round_coordinate(samples['long'])
+    columns = (['sample_date', 'lat', 'long', 'depth', 'elevation']
+               + (['mean_temp_2017'] if mean_temp_path else [])
+               + INDEX_COLUMNS + ['land_cover_type', 'main_vegetation_type', 'soc_in_percent', 'sand', 'silt', 'clay'])
+    feature_table = samples[columns].sort_values(['lat', 'long'], kind='stable').reset_index(drop=True)
+    return feature_table, reports
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the model feature table from the LUCAS and satellite data.")
+    parser.add_argument('output', help="Output CSV")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE_M,
+                        help="Maximum distance in m between joined locations")
+    parser.add_argument('--lucas', default=LUCAS_CSV)
+    parser.add_argument('--elevation', default=ELEVATION_CSV)
+    parser.add_argument('--indices', default=INDICES_TABLE, help="Aggregated satellite indices (CSV or Parquet)")
+    parser.add_argument('--soil-types', default=SOIL_TYPES_CSV)
+    parser.add_argument('--mean-temp', nargs='?', const=MEAN_TEMP_CSV,
+                        help="Also join the 2017 mean temperature (not part of the current model)")
+    args = parser.parse_args()
+
+    feature_table, _ = build_feature_table(args.tolerance, args.lucas, args.elevation, args.indices,
+                                           args.soil_types, args.mean_temp)
+    feature_table.to_csv(args.output, index=False)
+    print(f"Feature table with {len(feature_table)} rows saved to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
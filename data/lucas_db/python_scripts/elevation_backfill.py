@@ -0,0 +1,119 @@
+# Elevation backfill for the LUCAS locations (replaces update_elevation.py, second_update_elevation.py
+# and elev_convert_to_int.py)
+#
+# Stages:
+#   1. SRTM: sample all rows without elevation at the point in batched FeatureCollection chunks (one
+#      request per chunk), like update_elevation.py
+#   2. SRTM again with a 100 m buffer for the rows the point sample left empty, then
+#   3. ALOS (100 m buffer, median DSM) for the rest, the two fallbacks of second_update_elevation.py
+#   4. convert the elevation column to integers
+# Every finished chunk is appended to a checkpoint file, so a crashed run resumes where it stopped.
+#
+# Usage (from the repository root):
+#   python data/lucas_db/python_scripts/elevation_backfill.py \
+#       data/lucas_db/csv_datasets/location_elevation.csv data/lucas_db/csv_datasets/location_elevation_fixed.csv
+# --record/--replay record the Earth Engine requests into a cassette or serve them from one offline
+# (see streamlit/cassette_backend.py).
+
+import argparse
+import os
+import sys
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[3] / 'streamlit'))
+
+from cassette_backend import add_cassette_arguments, cassette_backend  # noqa: E402
+from gee_backend import ALOS_DATASET, SRTM_DATASET, EarthEngineBackend  # noqa: E402
+
+SERVICE_ACCOUNT = 'soil-project@ee-maxsonntag4.iam.gserviceaccount.com'
+KEY_PATH = '/Users/maxsonntag/Desktop/jsonkey_soil_project.json'
+
+# Backfill passes in order: (stage name, dataset, band, is image collection, buffer in m)
+STAGES = [
+    ('srtm', SRTM_DATASET, 'elevation', False, 0),
+    ('srtm_100m', SRTM_DATASET, 'elevation', False, 100),
+    ('alos', ALOS_DATASET, 'DSM', True, 100),
+]
+CHECKPOINT_COLUMNS = ['row', 'stage', 'elevation']
+
+
+def load_checkpoint(checkpoint_path):
+    if checkpoint_path and os.path.exists(checkpoint_path):
+        return pd.read_csv(checkpoint_path)
+    return pd.DataFrame(columns=CHECKPOINT_COLUMNS)
+
+
+def append_checkpoint(checkpoint_path, rows, stage, elevations):
+    chunk = pd.DataFrame({'row': rows, 'stage': stage, 'elevation': elevations}, columns=CHECKPOINT_COLUMNS)
+    write_header = not os.path.exists(checkpoint_path)
+    chunk.to_csv(checkpoint_path, mode='a', header=write_header, index=False)
+
+
+def backfill_elevation(data, backend, checkpoint_path=None, chunk_size=500, scale=30, log=print):
+    # data needs lat/long columns; rows that already have an elevation are never requested
+    data = data.reset_index(drop=True).copy()
+    if 'elevation' not in data.columns:
+        data['elevation'] = float('nan')
+    data['elevation'] = pd.to_numeric(data['elevation'], errors='coerce')
+
+    # Re-apply finished chunks from an earlier, interrupted run
+    checkpoint = load_checkpoint(checkpoint_path)
+    attempted = {stage: set(checkpoint.loc[checkpoint['stage'] == stage, 'row']) for stage, *_ in STAGES}
+    found = checkpoint.dropna(subset=['elevation'])
+    data.loc[found['row'].astype(int).to_numpy(), 'elevation'] = found['elevation'].to_numpy()
+    if len(checkpoint):
+        log(f"Resumed from checkpoint with {len(checkpoint)} sampled rows")
+
+    for stage, dataset, band, is_collection, buffer in STAGES:
+        todo = data.index[data['elevation'].isna() & ~data.index.isin(list(attempted[stage]))]
+        log(f"{stage}: {len(todo)} rows without elevation")
+        for start in range(0, len(todo), chunk_size):
+            rows = todo[start:start + chunk_size]
+            elevations = backend.sample_elevation(
+                data.loc[rows, 'lat'].tolist(), data.loc[rows, 'long'].tolist(), dataset=dataset, band=band,
+                is_collection=is_collection, buffer=buffer, scale=scale
+            )
+            elevations = pd.to_numeric(pd.Series(elevations, index=rows, dtype='object'), errors='coerce')
+            data.loc[rows, 'elevation'] = elevations
+            if checkpoint_path:
+                append_checkpoint(checkpoint_path, rows, stage, elevations.to_numpy())
+            log(f"{stage}: {min(start + chunk_size, len(todo))}/{len(todo)} rows sampled")
+
+    # Integer conversion (nullable, rows that are still missing stay empty)
+    data['elevation'] = data['elevation'].round().astype('Int64')
+    log(f"Rows still without elevation: {data['elevation'].isna().sum()}")
+    return data
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill missing elevations from SRTM with ALOS fallback.")
+    parser.add_argument('input', help="CSV with lat/long (and optionally elevation) columns")
+    parser.add_argument('output', help="Output CSV")
+    parser.add_argument('--sep', default=',', help="Input delimiter")
+    parser.add_argument('--chunk-size', type=int, default=500, help="Points per Earth Engine request")
+    parser.add_argument('--checkpoint', help="Checkpoint file (default: <output>.checkpoint.csv)")
+    parser.add_argument('--service-account', default=SERVICE_ACCOUNT)
+    parser.add_argument('--key-path', default=KEY_PATH)
+    add_cassette_arguments(parser)
+    args = parser.parse_args()
+
+    def earth_engine():
+        import ee
+
+        ee.Initialize(ee.ServiceAccountCredentials(args.service_account, args.key_path))
+        return EarthEngineBackend()
+
+    checkpoint_path = args.checkpoint or f"{args.output}.checkpoint.csv"
+    data = pd.read_csv(args.input, sep=args.sep)
+    data = backfill_elevation(data, cassette_backend(args, earth_engine), checkpoint_path, args.chunk_size)
+    data.to_csv(args.output, index=False)
+    # The run is complete, so the checkpoint is no longer needed
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    print(f"Updated CSV saved to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+# Quarterly Landsat index exports to Google Drive (replaces the manual batching in gee_api_call_*.py)
+#
+# One Export.table.toDrive task per quarter. The scheduler keeps up to --max-in-flight tasks running,
+# polls their status and starts the next quarter as soon as a slot frees up. Failed tasks are retried
+# up to --max-attempts times. Progress is written to a JSON manifest after every change, so a restarted
+# run skips finished quarters and keeps polling the tasks that were still running.
+#
+# Usage (from the repository root):
+#   python data/satellite_data/indices/export_scheduler.py data/date_location_lucas.csv \
+#       --cloud-mask clouds_and_shadows --cloud-threshold 80 --buffer 50 --scale 50
+# --record/--replay record the Earth Engine requests into a cassette or serve them from one offline
+# (see streamlit/cassette_backend.py); use a separate --manifest and --poll-interval 0 when replaying.
+
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[3] / 'streamlit'))
+
+from cassette_backend import add_cassette_arguments, cassette_backend  # noqa: E402
+from gee_backend import LANDSAT_CLOUD_MASKS, TASK_COMPLETED, TASK_FAILED_STATES, EarthEngineBackend  # noqa: E402
+
+SERVICE_ACCOUNT = 'soil-project@ee-maxsonntag4.iam.gserviceaccount.com'
+KEY_PATH = '/Users/maxsonntag/Desktop/jsonkey_soil_project.json'
+
+MAX_IN_FLIGHT = 2
+MAX_ATTEMPTS = 3
+POLL_INTERVAL = 60
+
+# Quarter states in the manifest
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+def quarter_starts(start_date, end_date):
+    return pd.date_range(start=start_date, end=end_date, freq='QS')
+
+
+def export_description(start):
+    # The exported file is output_all_locations_YYYY_MM.csv, which the aggregation notebook parses
+    return f"export_all_locations_{start.strftime('%Y_%m')}"
+
+
+class ExportScheduler:
+    def __init__(self, backend, points, quarters, manifest_path, export_params=None, max_in_flight=MAX_IN_FLIGHT,
+                 max_attempts=MAX_ATTEMPTS, poll_interval=POLL_INTERVAL, sleep=time.sleep, log=print):
+        self.backend = backend
+        self.points = points
+        self.manifest_path = manifest_path
+        self.export_params = export_params or {}
+        self.max_in_flight = max_in_flight
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.sleep = sleep
+        self.log = log
+        self.manifest = self._load_manifest(quarters)
+
+    def _load_manifest(self, quarters):
+        manifest = {'params': self.export_params, 'quarters': {}}
+        if self.manifest_path and os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+            if manifest['params'] != self.export_params:
+                raise ValueError(
+                    f"Manifest {self.manifest_path} was written with different export parameters "
+                    f"({manifest['params']}), use another manifest file"
+                )
+            done = sum(q['state'] == DONE for q in manifest['quarters'].values())
+            self.log(f"Resumed from manifest: {done}/{len(manifest['quarters'])} quarters done")
+        for start in quarters:
+            manifest['quarters'].setdefault(
+                start.strftime('%Y-%m-%d'), {'state': PENDING, 'task_id': None, 'attempts': 0}
+            )
+        return manifest
+
+    def _save_manifest(self):
+        if not self.manifest_path:
+            return
+        # Write to a temporary file first so an interrupted run never leaves a truncated manifest
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.manifest, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.manifest_path)
+
+    def _quarters_in(self, state):
+        return [start for start, q in sorted(self.manifest['quarters'].items()) if q['state'] == state]
+
+    def _submit(self, start):
+        quarter = self.manifest['quarters'][start]
+        begin = pd.Timestamp(start)
+        quarter['task_id'] = self.backend.start_quarterly_export(
+            self.points, begin, begin + pd.DateOffset(months=3), export_description(begin), **self.export_params
+        )
+        quarter['state'] = RUNNING
+        quarter['attempts'] += 1
+        self._save_manifest()
+        self.log(f"Started export for period starting {start} (attempt {quarter['attempts']})")
+
+    def _poll(self, start):
+        quarter = self.manifest['quarters'][start]
+        state = self.backend.task_state(quarter['task_id'])
+        if state == TASK_COMPLETED:
+            quarter['state'] = DONE
+            self.log(f"Export for period starting {start} completed")
+        elif state in TASK_FAILED_STATES:
+            # Failed quarters go back into the queue until they run out of attempts
+            quarter['state'] = PENDING if quarter['attempts'] < self.max_attempts else FAILED
+            self.log(f"Export for period starting {start} ended with {state} (attempt {quarter['attempts']})")
+        else:
+            return
+        self._save_manifest()
+
+    def run(self):
+        while True:
+            for start in self._quarters_in(RUNNING):
+                self._poll(start)
+            pending = self._quarters_in(PENDING)
+            free_slots = self.max_in_flight - len(self._quarters_in(RUNNING))
+            for start in pending[:max(0, free_slots)]:
+                self._submit(start)
+            if not self._quarters_in(RUNNING) and not self._quarters_in(PENDING):
+                break
+            self.sleep(self.poll_interval)
+
+        failed = self._quarters_in(FAILED)
+        self.log(f"{len(self._quarters_in(DONE))} quarters exported, {len(failed)} failed")
+        return failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export quarterly Landsat index composites to Google Drive.")
+    parser.add_argument('input', help="CSV with lat, long and sample_date columns")
+    parser.add_argument('--cloud-mask', choices=sorted(LANDSAT_CLOUD_MASKS), default='clouds_and_shadows')
+    parser.add_argument('--cloud-threshold', type=float, default=80, help="Maximum CLOUD_COVER_LAND in percent")
+    parser.add_argument('--buffer', type=float, default=30, help="Buffer around each location in m")
+    parser.add_argument('--scale', type=float, default=30, help="Reduction scale in m")
+    parser.add_argument('--with-coordinates', action='store_true', help="Add lat/long columns to the export")
+    parser.add_argument('--start', default='2015-01-01', help="First quarter (default: 2015-01-01)")
+    parser.add_argument('--end', help="Last quarter (default: latest sample date)")
+    parser.add_argument('--years-before-end', type=float,
+                        help="Start this many years before the end date instead of --start")
+    parser.add_argument('--folder', default='EarthEngineExports', help="Google Drive folder")
+    parser.add_argument('--max-in-flight', type=int, default=MAX_IN_FLIGHT, help="Concurrent export tasks")
+    parser.add_argument('--max-attempts', type=int, default=MAX_ATTEMPTS, help="Attempts per quarter")
+    parser.add_argument('--poll-interval', type=float, default=POLL_INTERVAL, help="Seconds between status checks")
+    parser.add_argument('--manifest', help="Manifest file (default: <input>.exports.json)")
+    parser.add_argument('--service-account', default=SERVICE_ACCOUNT)
+    parser.add_argument('--key-path', default=KEY_PATH)
+    add_cassette_arguments(parser)
+    args = parser.parse_args(argv)
+
+    data = pd.read_csv(args.input)
+    end_date = pd.Timestamp(args.end) if args.end else pd.Timestamp(data['sample_date'].max())
+    if args.years_before_end is not None:
+        start_date = end_date - pd.Timedelta(days=args.years_before_end * 365)
+    else:
+        start_date = pd.Timestamp(args.start)
+
+    def earth_engine():
+        import ee
+
+        ee.Initialize(ee.ServiceAccountCredentials(args.service_account, args.key_path))
+        return EarthEngineBackend()
+
+    export_params = {
+        'cloud_mask': args.cloud_mask,
+        'cloud_threshold': args.cloud_threshold,
+        'buffer': args.buffer,
+        'scale': args.scale,
+        'with_coordinates': args.with_coordinates,
+        'folder': args.folder,
+    }
+    scheduler = ExportScheduler(
+        cassette_backend(args, earth_engine), data, quarter_starts(start_date, end_date), args.manifest or f"{args.input}.exports.json",
+        export_params, max_in_flight=args.max_in_flight, max_attempts=args.max_attempts,
+        poll_interval=args.poll_interval
+    )
+    print(f"Exporting {len(scheduler.manifest['quarters'])} quarters, started {datetime.now():%Y-%m-%d %H:%M}")
+    failed = scheduler.run()
+    if failed:
+        sys.exit(f"Exports failed for: {', '.join(failed)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,311 @@
+# Evaluation matrix: every model on every soil dataset with k-fold cross-validation
+#
+# Datasets (preprocessed once into a cached feature matrix each):
+#   lucas      the model feature table, preprocessed exactly as train_model.py does
+#   bze        BZE laboratory layers averaged over 0-30 cm (weighted by overlap), TOC in g/kg -> %, with
+#              sand/silt/clay and the site's land use; coordinates from UTM 32N
+#   soilgrids  one sample per SoilGrids polygon at its vertex centroid, soc_0_30cm in dg/kg -> %, with the
+#              polygon's 0-30 cm texture, bulk density, pH and CEC
+# Models are the notebook's experiments (LightGBM, RandomForest, XGBoost if installed, PCA + RandomForest),
+# each fitted inside the folds. All (model, dataset, fold) cells run in a process pool; the cached matrices
+# are loaded once per worker. Cell results are cached too, keyed by the model's parameters and the
+# dataset's cache key, so adding a model only costs its own fits and a changed dataset only its cells.
+#
+# The report has one row per model and dataset with the fold mean and std of MSE and R^2, the fit time
+# and the prediction latency (per row in batch, and a single-row call).
+#
+# Usage (from the repository root):
+#   python ml_model/evaluate_models.py
+#   python ml_model/evaluate_models.py --models lightgbm random_forest --datasets lucas bze --workers 4
+
+import argparse
+import hashlib
+import importlib
+import json
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from sklearn.metrics import mean_squared_error, r2_score
+from sklearn.model_selection import KFold
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'streamlit'))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from source_ingestion import SOURCES, file_hash, load_source  # noqa: E402
+from soil_lookup import GKG_PER_PERCENT, SOILGRIDS_CSV, PolygonLayer, utm_to_latlon  # noqa: E402
+from train_model import FEATURE_TABLE, MAX_SOC, N_FOLDS, RANDOM_STATE, load_feature_table, preprocess  # noqa: E402
+
+DEFAULT_CACHE_DIR = '.cache/evaluation'
+DEFAULT_REPORT = 'ml_model/evaluation_report.csv'
+# Bump when a dataset builder changes, so cached matrices are rebuilt
+DATASET_VERSION = 1
+SINGLE_ROW_REPEATS = 20
+
+# name -> estimator class path, constructor parameters and an optional PCA variance share
+MODELS = {
+    'lightgbm': {
+        'estimator': 'lightgbm.LGBMRegressor',
+        'params': {'n_estimators': 300, 'learning_rate': 0.05, 'max_depth': -1, 'min_child_samples': 10,
+                   'random_state': RANDOM_STATE, 'n_jobs': 1, 'verbose': -1},
+    },
+    'random_forest': {
+        'estimator': 'sklearn.ensemble.RandomForestRegressor',
+        'params': {'n_estimators': 100, 'random_state': RANDOM_STATE, 'n_jobs': 1},
+    },
+    'xgboost': {
+        'estimator': 'xgboost.XGBRegressor',
+        'params': {'n_estimators': 100, 'learning_rate': 0.1, 'max_depth': 6, 'random_state': RANDOM_STATE,
+                   'n_jobs': 1},
+    },
+    'pca_random_forest': {
+        'estimator': 'sklearn.ensemble.RandomForestRegressor',
+        'params': {'n_estimators': 100, 'random_state': RANDOM_STATE, 'n_jobs': 1},
+        'pca_variance': 0.95,
+    },
+}
+
+BZE_DEPTH_CM = 30
+BZE_LAND_USE = ['A', 'G', 'SO']
+SOILGRIDS_FEATURES = ['sand_0_30cm', 'silt_0_30cm', 'clay_0_30cm', 'bdod_0_30cm', 'phh2o_0_30cm', 'cec_0_30cm']
+# SoilGrids stores SOC in dg/kg
+DGKG_PER_PERCENT = 100
+
+
+def lucas_dataset(cache_dir):
+    X, y, _, _ = preprocess(load_feature_table(FEATURE_TABLE))
+    return X, y
+
+
+def bze_dataset(cache_dir):
+    # The parsed source tables are cached in <cache dir>/ingestion
+    ingestion_dir = os.path.join(cache_dir, 'ingestion')
+    lab = load_source('bze_laboratory', columns=['PointID', 'Layer upper limit', 'Layer lower limit', 'TOC', 'Sand',
+                                                 'Silt', 'Clay'], cache_dir=ingestion_dir)
+    site = load_source('bze_site', columns=['PointID', 'xcoord', 'ycoord', 'Land use'], cache_dir=ingestion_dir)
+
+    # Thickness of each layer inside 0-30 cm as the weight of its values
+    overlap = (lab['Layer lower limit'].clip(upper=BZE_DEPTH_CM) - lab['Layer upper limit']).clip(lower=0)
+    lab = lab[overlap > 0].assign(weight=overlap[overlap > 0])
+    columns = ['TOC', 'Sand', 'Silt', 'Clay']
+    weighted = lab[columns].mul(lab['weight'], axis=0).where(lab[columns].notna())
+    weights = lab[columns].notna().mul(lab['weight'], axis=0)
+    sums = weighted.groupby(lab['PointID']).sum(min_count=1)
+    profiles = sums / weights.groupby(lab['PointID']).sum().replace(0, np.nan)
+
+    df = profiles.join(site.set_index('PointID'), how='inner')
+    lat, long = utm_to_latlon(df['xcoord'].to_numpy(), df['ycoord'].to_numpy(), zone=32)
+    X = pd.DataFrame({'lat': lat, 'long': long, 'sand': df['Sand'].to_numpy(), 'silt': df['Silt'].to_numpy(),
+                      'clay': df['Clay'].to_numpy()})
+    for land_use in BZE_LAND_USE:
+        X[f'land_use_{land_use}'] = (df['Land use'].astype(str) == land_use).to_numpy().astype(int)
+    y = pd.Series(df['TOC'].to_numpy() / 10, name='soc_in_percent')
+    keep = (y.notna() & (y < MAX_SOC)).to_numpy() & X.notna().all(axis=1).to_numpy()
+    return X[keep].reset_index(drop=True), y[keep].reset_index(drop=True)
+
+
+def soilgrids_dataset(cache_dir):
+    polygons = PolygonLayer.from_csv(SOILGRIDS_CSV)
+    counts = np.diff(polygons.edge_offsets)
+    x = np.add.reduceat(polygons.edges[:, 0], polygons.edge_offsets[:-1]) / counts
+    y = np.add.reduceat(polygons.edges[:, 1], polygons.edge_offsets[:-1]) / counts
+    lat, long = utm_to_latlon(x, y, zone=polygons.utm_zone)
+    properties = polygons.properties
+    X = pd.DataFrame({'lat': lat, 'long': long})
+    for column in SOILGRIDS_FEATURES:
+        X[column] = properties[column].to_numpy(dtype=np.float64)
+    X[['sand_0_30cm', 'silt_0_30cm', 'clay_0_30cm']] /= GKG_PER_PERCENT
+    target = pd.Series(properties['soc_0_30cm'].to_numpy(dtype=np.float64) / DGKG_PER_PERCENT, name='soc_in_percent')
+    keep = (target.notna() & (target < MAX_SOC)).to_numpy()
+    return X[keep].reset_index(drop=True), target[keep].reset_index(drop=True)
+
+
+# name -> (builder(cache_dir), input files whose content keys the cache)
+DATASETS = {
+    'lucas': (lucas_dataset, [FEATURE_TABLE]),
+    'bze': (bze_dataset, [SOURCES['bze_laboratory']['path'], SOURCES['bze_site']['path']]),
+    'soilgrids': (soilgrids_dataset, [SOILGRIDS_CSV]),
+}
+
+
+def _hash(value):
+    return hashlib.sha256(json.dumps(value, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def dataset_key(name):
+    _, inputs = DATASETS[name]
+    return f"{name}-{_hash([DATASET_VERSION, MAX_SOC, [file_hash(path) for path in inputs]])}"
+
+
+def model_key(name):
+    return f"{name}-{_hash(MODELS[name])}"
+
+
+def prepare_dataset(name, cache_dir=DEFAULT_CACHE_DIR, log=print):
+    # Cached (X, y, feature names) as an .npz keyed by the input files; returns its path
+    path = os.path.join(cache_dir, f'{dataset_key(name)}.npz')
+    if os.path.exists(path):
+        return path
+    start = time.perf_counter()
+    X, y = DATASETS[name][0](cache_dir)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f'{path}.tmp.npz'
+    np.savez(tmp_path, X=X.to_numpy(dtype=np.float64), y=y.to_numpy(dtype=np.float64),
+             features=np.array(X.columns, dtype=str))
+    os.replace(tmp_path, path)
+    log(f"Prepared {name}: {X.shape[0]} rows x {X.shape[1]} features ({time.perf_counter() - start:.1f} s)")
+    return path
+
+
+def build_model(name):
+    spec = MODELS[name]
+    module, cls = spec['estimator'].rsplit('.', 1)
+    estimator = getattr(importlib.import_module(module), cls)(**spec['params'])
+    if spec.get('pca_variance'):
+        from sklearn.decomposition import PCA
+        from sklearn.pipeline import make_pipeline
+        from sklearn.preprocessing import StandardScaler
+
+        return make_pipeline(StandardScaler(), PCA(n_components=spec['pca_variance']), estimator)
+    return estimator
+
+
+def model_available(name):
+    try:
+        importlib.import_module(MODELS[name]['estimator'].rsplit('.', 1)[0])
+    except ImportError:
+        return False
+    return True
+
+
+# Datasets loaded by this worker process, by cache path
+_worker = {}
+
+
+def _load(path):
+    if path not in _worker:
+        with np.load(path, allow_pickle=False) as data:
+            _worker[path] = (data['X'], data['y'])
+    return _worker[path]
+
+
+def run_cell(model_name, dataset_path, fold, n_folds):
+    X, y = _load(dataset_path)
+    train_idx, test_idx = list(KFold(n_folds, shuffle=True, random_state=RANDOM_STATE).split(X))[fold]
+    model = build_model(model_name)
+
+    start = time.perf_counter()
+    model.fit(X[train_idx], y[train_idx])
+    fit_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    y_pred = model.predict(X[test_idx])
+    batch_seconds = time.perf_counter() - start
+
+    single = X[test_idx[:1]]
+    single_times = []
+    for _ in range(SINGLE_ROW_REPEATS):
+        start = time.perf_counter()
+        model.predict(single)
+        single_times.append(time.perf_counter() - start)
+
+    return {
+        'train_rows': len(train_idx),
+        'test_rows': len(test_idx),
+        'mse': float(mean_squared_error(y[test_idx], y_pred)),
+        'r2': float(r2_score(y[test_idx], y_pred)),
+        'fit_s': fit_seconds,
+        'predict_us_per_row': batch_seconds / len(test_idx) * 1e6,
+        'single_row_ms': statistics.median(single_times) * 1e3,
+    }
+
+
+def evaluate(models, datasets, n_folds=N_FOLDS, workers=None, cache_dir=DEFAULT_CACHE_DIR, force=False, log=print):
+    # Returns one row per (model, dataset, fold); only cells without a cached result are fitted
+    results_dir = os.path.join(cache_dir, 'results')
+    os.makedirs(results_dir, exist_ok=True)
+    dataset_paths = {name: prepare_dataset(name, cache_dir, log) for name in datasets}
+
+    cells, todo = [], []
+    for model_name in models:
+        for dataset in datasets:
+            for fold in range(n_folds):
+                key = f"{model_key(model_name)}-{os.path.basename(dataset_paths[dataset])[:-4]}-{fold}of{n_folds}"
+                cell = {'model': model_name, 'dataset': dataset, 'fold': fold,
+                        'path': os.path.join(results_dir, f'{key}.json')}
+                cells.append(cell)
+                if force or not os.path.exists(cell['path']):
+                    todo.append(cell)
+    log(f"{len(cells)} cells, {len(cells) - len(todo)} cached, {len(todo)} to run")
+
+    if todo:
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+            futures = {pool.submit(run_cell, cell['model'], dataset_paths[cell['dataset']], cell['fold'], n_folds): cell
+                       for cell in todo}
+            for i, future in enumerate(as_completed(futures), 1):
+                cell = futures[future]
+                result = future.result()
+                tmp_path = f"{cell['path']}.tmp"
+                with open(tmp_path, 'w') as f:
+                    json.dump(result, f)
+                os.replace(tmp_path, cell['path'])
+                log(f"[{i}/{len(todo)}] {cell['model']} on {cell['dataset']} fold {cell['fold']}: "
+                    f"R^2 {result['r2']:.3f}")
+
+    rows = []
+    for cell in cells:
+        with open(cell['path']) as f:
+            rows.append({'model': cell['model'], 'dataset': cell['dataset'], 'fold': cell['fold'], **json.load(f)})
+    return pd.DataFrame(rows)
+
+
+def summarize(cells):
+    # Fold mean and std per model and dataset
+    grouped = cells.groupby(['model', 'dataset'], sort=False)
+    # Every row is in exactly one test fold
+    report = grouped[['test_rows']].sum().rename(columns={'test_rows': 'rows'})
+    for metric in ('mse', 'r2'):
+        report[f'{metric}_mean'] = grouped[metric].mean()
+        report[f'{metric}_std'] = grouped[metric].std()
+    for metric in ('fit_s', 'predict_us_per_row', 'single_row_ms'):
+        report[metric] = grouped[metric].mean()
+    return report.reset_index()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Cross-validate several models on several soil datasets.")
+    parser.add_argument('--models', nargs='+', choices=list(MODELS), help="Default: all installed models")
+    parser.add_argument('--datasets', nargs='+', choices=list(DATASETS), default=list(DATASETS))
+    parser.add_argument('--folds', type=int, default=N_FOLDS)
+    parser.add_argument('--workers', type=int, help="Processes (default: all cores)")
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR)
+    parser.add_argument('--force', action='store_true', help="Refit cells that have cached results")
+    parser.add_argument('--output', default=DEFAULT_REPORT, help="Report CSV (one row per model and dataset)")
+    parser.add_argument('--cells', help="Also write the per-fold results to this CSV")
+    args = parser.parse_args(argv)
+
+    models = args.models or [name for name in MODELS if model_available(name)]
+    missing = [name for name in models if not model_available(name)]
+    if missing:
+        parser.error(f"models not installed: {missing}")
+    skipped = [name for name in MODELS if name not in models and not model_available(name)]
+    if skipped:
+        print(f"Skipping models that are not installed: {skipped}")
+
+    cells = evaluate(models, args.datasets, args.folds, args.workers, args.cache_dir, args.force)
+    report = summarize(cells)
+    report.to_csv(args.output, index=False)
+    if args.cells:
+        cells.to_csv(args.cells, index=False)
+    with pd.option_context('display.width', 200, 'display.max_columns', None):
+        print(report.round(4).to_string(index=False))
+    print(f"Report saved to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
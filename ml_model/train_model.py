@@ -0,0 +1,299 @@
+# Model training (scripted version of model_training.ipynb)
+#
+# Preprocessing follows the notebook: drop missing SOC, keep SOC < 15 %, drop sample_date/depth and
+# 'Artificial land', one-hot encode land_cover_type, drop vegetation types with fewer than 10 samples,
+# frequency and target encode main_vegetation_type and drop the index std/trend columns.
+#
+# Instead of RandomizedSearchCV (50 candidates x 5 folds, each trained to the end) the LightGBM search
+# uses successive halving over boosting rounds: all sampled candidates get a small round budget, the
+# best third moves on with three times the budget, and so on. Every evaluation is 5-fold CV with early
+# stopping on the mean validation curve, which also picks n_estimators. Candidates run in a process pool
+# on all cores, and every worker bins the fold datasets once and reuses them for all its candidates.
+# A wall-clock budget is a hard limit: at the deadline no further evaluations start, queued ones are
+# cancelled and running ones stop after their current boosting round; the best candidate evaluated with
+# the largest round budget is used. The model is saved as the pickle, the flattened engine, the .npy
+# encodings and the model bundle the app loads (see model_bundle.py).
+#
+# Usage (from the repository root):
+#   python ml_model/train_model.py --budget 600
+#   python ml_model/train_model.py --output-dir /tmp/candidate_model   # keep the current model
+
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+
+import lightgbm as lgb
+import numpy as np
+import pandas as pd
+from sklearn.metrics import mean_squared_error, r2_score
+from sklearn.model_selection import KFold, ParameterSampler, train_test_split
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'streamlit'))
+
+from batch_predict import (  # noqa: E402
+    BUNDLE_PATH, DEFAULT_INDEX_STATS, FREQ_ENCODING_PATH, LAND_COVER_TYPES, MEAN_ENCODING_PATH, MODEL_PATH,
+)
+from model_bundle import LAND_COVER_PREFIX, export_bundle  # noqa: E402
+from tree_engine import ENGINE_PATH, export_model, flatten_booster  # noqa: E402
+
+FEATURE_TABLE = 'ml_model/feature_table_fixed.csv'
+TARGET = 'soc_in_percent'
+MAX_SOC = 15
+MIN_CATEGORY_COUNT = 10
+DROPPED_COLUMNS = ['sample_date', 'depth'] + [
+    f'{index}_{stat}' for index in ['NDVI', 'NDMI', 'BSI', 'SOCI'] for stat in ('std', 'trend')
+]
+RANDOM_STATE = 42
+
+# Notebook grid without n_estimators, which is the successive halving resource
+LGB_PARAM_GRID = {
+    'learning_rate': [0.01, 0.05, 0.1, 0.2],
+    'max_depth': [-1, 10, 20, 30],
+    'num_leaves': [20, 31, 50, 100],
+    'min_data_in_leaf': [10, 20, 30, 50],
+    'feature_fraction': [0.6, 0.8, 1.0],
+}
+N_CANDIDATES = 54
+N_FOLDS = 5
+MIN_ROUNDS = 50
+MAX_ROUNDS = 1000
+HALVING_FACTOR = 3
+EARLY_STOPPING_ROUNDS = 50
+# Binning is fixed per dataset, so candidates must not change it; feature_pre_filter=False lets
+# min_data_in_leaf vary on the same binned data
+DATASET_PARAMS = {'max_bin': 255, 'feature_pre_filter': False, 'verbose': -1}
+
+
+def load_feature_table(path=FEATURE_TABLE):
+    if str(path).endswith('.parquet'):
+        from columnar_store import load_feature_table as load_store
+
+        df = load_store(path)
+        return df.astype({column: str for column in df.select_dtypes('category').columns})
+    return pd.read_csv(path)
+
+
+def preprocess(df, max_soc=MAX_SOC, min_category_count=MIN_CATEGORY_COUNT, target=TARGET):
+    # Returns (X, y, freq_encoding, mean_encoding) with the columns in the trained model's order. Other
+    # targets (see train_properties.py) keep the SOC filter, so every model covers the same soils.
+    df = df.dropna(subset=[target])
+    df = df[df[TARGET] < max_soc]
+    df = df.drop(columns=DROPPED_COLUMNS)
+    df = df[df['land_cover_type'] != 'Artificial land']
+    df = pd.get_dummies(df, columns=['land_cover_type'], dtype=int)
+
+    counts = df['main_vegetation_type'].value_counts()
+    df = df[df['main_vegetation_type'].isin(counts[counts >= min_category_count].index)]
+
+    # Encodings are computed on all remaining rows before the split, as in the notebook
+    freq_encoding = df['main_vegetation_type'].value_counts()
+    mean_encoding = df.groupby('main_vegetation_type')[target].mean()
+    df['main_vegetation_type_freq_encoded'] = df['main_vegetation_type'].map(freq_encoding)
+    df['main_vegetation_type_target_encoded'] = df['main_vegetation_type'].map(mean_encoding)
+    df = df.drop(columns=['main_vegetation_type'])
+
+    X = df.drop(columns=list(dict.fromkeys([TARGET, target])))
+    return X, df[target], freq_encoding.to_dict(), mean_encoding.to_dict()
+
+
+# Per-process state of the search workers: training data, fold indices and the binned fold datasets
+_worker = {}
+
+
+def _init_worker(X, y, folds):
+    _worker.update(X=X, y=y, folds=folds, datasets={})
+
+
+def _fold_datasets(fold):
+    # Built on first use and reused by every later candidate in this process
+    if fold not in _worker['datasets']:
+        train_idx, valid_idx = _worker['folds'][fold]
+        train = lgb.Dataset(_worker['X'][train_idx], _worker['y'][train_idx], params=DATASET_PARAMS,
+                            free_raw_data=False).construct()
+        valid = lgb.Dataset(_worker['X'][valid_idx], _worker['y'][valid_idx], reference=train,
+                            params=DATASET_PARAMS, free_raw_data=False).construct()
+        _worker['datasets'][fold] = (train, valid)
+    return _worker['datasets'][fold]
+
+
+class _BudgetExceeded(Exception):
+    pass
+
+
+def _stop_at(deadline):
+    # LightGBM callback that aborts training once the deadline (time.time(), shared by all processes) passed
+    def callback(env):
+        if time.time() >= deadline:
+            raise _BudgetExceeded()
+    return callback
+
+
+def evaluate_candidate(params, num_rounds, early_stopping_rounds=EARLY_STOPPING_ROUNDS, deadline=None):
+    # K-fold CV with a shared stopping point: returns (mean validation MSE, best number of rounds), or None
+    # if the deadline passed before all folds finished
+    train_params = {'objective': 'regression', 'metric': 'l2', 'seed': RANDOM_STATE, 'deterministic': True,
+                    'num_threads': 1, 'verbose': -1, **params}
+    callbacks = [] if deadline is None else [_stop_at(deadline)]
+    curves = []
+    for fold in range(len(_worker['folds'])):
+        if deadline is not None and time.time() >= deadline:
+            return None
+        train, valid = _fold_datasets(fold)
+        history = {}
+        try:
+            lgb.train(train_params, train, num_boost_round=num_rounds, valid_sets=[valid], valid_names=['valid'],
+                      callbacks=[lgb.record_evaluation(history),
+                                 lgb.early_stopping(early_stopping_rounds, verbose=False), *callbacks])
+        except _BudgetExceeded:
+            return None
+        curves.append(history['valid']['l2'])
+
+    # Folds may stop at different rounds; the mean curve only covers rounds every fold reached
+    length = min(len(curve) for curve in curves)
+    mean_curve = np.mean([curve[:length] for curve in curves], axis=0)
+    best = int(np.argmin(mean_curve))
+    return float(mean_curve[best]), best + 1
+
+
+def successive_halving(X, y, param_grid=LGB_PARAM_GRID, n_candidates=N_CANDIDATES, n_folds=N_FOLDS,
+                       min_rounds=MIN_ROUNDS, max_rounds=MAX_ROUNDS, factor=HALVING_FACTOR, budget_seconds=None,
+                       workers=None, log=print):
+    # Wall-clock time, since the workers check the same deadline in other processes
+    deadline = time.time() + budget_seconds if budget_seconds else None
+    candidates = list(ParameterSampler(param_grid, n_candidates, random_state=RANDOM_STATE))
+    folds = list(KFold(n_folds, shuffle=True, random_state=RANDOM_STATE).split(X))
+    X, y = np.asarray(X, dtype=np.float64), np.asarray(y, dtype=np.float64)
+
+    results = []
+    alive = list(range(len(candidates)))
+    rounds = min_rounds
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count(), initializer=_init_worker,
+                             initargs=(X, y, folds)) as pool:
+        while alive:
+            futures = {pool.submit(evaluate_candidate, candidates[i], rounds, deadline=deadline): i for i in alive}
+            rung = {}
+            pending = set(futures)
+            while pending:
+                timeout = None if deadline is None else max(0.0, deadline - time.time())
+                done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    result = future.result()
+                    if result is not None:
+                        rung[futures[future]] = result
+                if deadline is not None and time.time() >= deadline and pending:
+                    # Queued evaluations never start; running ones return None after their current round,
+                    # so leaving the pool does not wait for them to finish
+                    for future in pending:
+                        future.cancel()
+                    break
+
+            for i, (score, best_rounds) in rung.items():
+                results.append({'candidate': i, 'rounds_budget': rounds, 'cv_mse': score,
+                                'n_estimators': best_rounds, **candidates[i]})
+            log(f"Rung with {rounds} rounds: {len(rung)}/{len(alive)} candidates evaluated, "
+                f"best CV MSE {min((s for s, _ in rung.values()), default=float('nan')):.4f}")
+
+            if len(rung) < len(alive) or (deadline is not None and time.time() >= deadline):
+                log("Time budget reached")
+                break
+            if len(alive) == 1 or rounds >= max_rounds:
+                break
+            # Promote the best 1/factor candidates with factor times the round budget
+            ranked = sorted(rung, key=lambda i: rung[i][0])
+            alive = ranked[:max(1, len(ranked) // factor)]
+            rounds = min(rounds * factor, max_rounds)
+
+    if not results:
+        raise RuntimeError("No candidate finished within the time budget")
+    # Best candidate of the most advanced rung that finished evaluating it
+    results = pd.DataFrame(results)
+    top_rung = results[results['rounds_budget'] == results['rounds_budget'].max()]
+    best = top_rung.loc[top_rung['cv_mse'].idxmin()]
+    return candidates[int(best['candidate'])], int(best['n_estimators']), float(best['cv_mse']), results
+
+
+def bundle_land_cover_types(columns):
+    # The one-hot categories of a training run, in the app's display order
+    trained_types = [column[len(LAND_COVER_PREFIX):] for column in columns if column.startswith(LAND_COVER_PREFIX)]
+    land_cover_types = [t for t in LAND_COVER_TYPES if t in trained_types]
+    return land_cover_types + [t for t in trained_types if t not in land_cover_types]
+
+
+def _file_hash(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def train(feature_table=FEATURE_TABLE, output_dir=None, budget_seconds=None, workers=None, n_candidates=N_CANDIDATES,
+          log=print):
+    X, y, freq_encoding, mean_encoding = preprocess(load_feature_table(feature_table))
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=RANDOM_STATE)
+    log(f"Training on {len(X_train)} rows, testing on {len(X_test)} rows")
+
+    start = time.monotonic()
+    best_params, n_estimators, cv_mse, results = successive_halving(
+        X_train, y_train, n_candidates=n_candidates, budget_seconds=budget_seconds, workers=workers, log=log
+    )
+    search_seconds = time.monotonic() - start
+    log(f"Best parameters: {best_params}, n_estimators={n_estimators} ({search_seconds:.1f} s)")
+
+    model = lgb.LGBMRegressor(n_estimators=n_estimators, random_state=RANDOM_STATE, verbose=-1, **best_params)
+    model.fit(X_train, y_train)
+    y_pred = model.predict(X_test)
+    metrics = {'test_mse': float(mean_squared_error(y_test, y_pred)), 'test_r2': float(r2_score(y_test, y_pred))}
+    log(f"LightGBM Mean Squared Error (MSE): {metrics['test_mse']}")
+    log(f"LightGBM R^2 Score: {metrics['test_r2']}")
+
+    # Artifacts go to their usual places unless an output directory is given
+    paths = {'model': MODEL_PATH, 'engine': ENGINE_PATH, 'freq_encoding': FREQ_ENCODING_PATH,
+             'mean_encoding': MEAN_ENCODING_PATH, 'bundle': BUNDLE_PATH}
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+        paths = {name: os.path.join(output_dir, os.path.basename(path)) for name, path in paths.items()}
+    with open(paths['model'], 'wb') as f:
+        pickle.dump(model, f)
+    export_model(model, paths['engine'])
+    np.save(paths['freq_encoding'], freq_encoding)
+    np.save(paths['mean_encoding'], mean_encoding)
+
+    metadata = {
+        'feature_table': feature_table,
+        'feature_table_sha256': _file_hash(feature_table),
+        'features': list(X.columns),
+        'params': {**best_params, 'n_estimators': n_estimators, 'random_state': RANDOM_STATE},
+        'cv_mse': cv_mse,
+        'search_seconds': round(search_seconds, 1),
+        'candidates_evaluated': int(results['candidate'].nunique()),
+        **metrics,
+    }
+    metadata_path = os.path.join(os.path.dirname(paths['model']), 'training_metadata.json')
+    with open(metadata_path, 'w') as f:
+        json.dump(metadata, f, indent=2)
+
+    # The bundle carries the one-hot categories of this training run
+    export_bundle(flatten_booster(model.booster_), freq_encoding, mean_encoding, bundle_land_cover_types(X.columns),
+                  DEFAULT_INDEX_STATS, paths['bundle'], metadata=metadata)
+    log(f"Saved {', '.join(paths.values())} and {metadata_path}")
+    return model, metadata
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the SOC model with a successive halving search.")
+    parser.add_argument('--feature-table', default=FEATURE_TABLE, help="Feature table (CSV or Parquet store)")
+    parser.add_argument('--output-dir', help="Write the artifacts here instead of replacing the current model")
+    parser.add_argument('--budget', type=float, help="Wall-clock budget for the search in seconds")
+    parser.add_argument('--workers', type=int, help="Search processes (default: all cores)")
+    parser.add_argument('--candidates', type=int, default=N_CANDIDATES, help="Sampled parameter sets")
+    args = parser.parse_args()
+
+    train(args.feature_table, args.output_dir, args.budget, args.workers, args.candidates)
+
+
+if __name__ == '__main__':
+    main()
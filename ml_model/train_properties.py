@@ -0,0 +1,123 @@
+# Training of the additional soil property models scored by streamlit/multi_target.py
+#
+# Every property is a LUCAS 2018 laboratory measurement of the same samples the SOC model is trained on.
+# The values are joined onto the feature table by location (the feature table keeps the LUCAS
+# coordinates, so every row matches within a metre), after which the property goes through the SOC
+# pipeline of train_model.py: the same preprocessing with the property as target (its own vegetation
+# target encoding, the SOC filter kept so all models cover the same soils), the successive halving
+# search and a model bundle in ml_model/property_bundles/<property>/. All bundles share the SOC model's
+# feature columns, so the multi-target predictor builds a location's feature row once for all of them.
+#
+# SoilGrids also has bulk density and CEC, but its polygons hardly overlap the LUCAS locations
+# (1 of about 11,000), so they cannot be used as targets for the feature table.
+#
+# Usage (from the repository root):
+#   python ml_model/train_properties.py --budget 300
+#   python ml_model/train_properties.py ph_h2o --output-dir /tmp/candidate_bundles
+
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+import lightgbm as lgb
+from sklearn.metrics import mean_squared_error, r2_score
+from sklearn.model_selection import train_test_split
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'streamlit'))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from batch_predict import DEFAULT_INDEX_STATS  # noqa: E402
+from model_bundle import export_bundle  # noqa: E402
+from multi_target import PROPERTIES, PROPERTY_BUNDLE_DIR  # noqa: E402
+from source_ingestion import load_source  # noqa: E402
+from spatial_join import spatial_join  # noqa: E402
+from train_model import (  # noqa: E402
+    FEATURE_TABLE, N_CANDIDATES, RANDOM_STATE, _file_hash, bundle_land_cover_types, load_feature_table, preprocess,
+    successive_halving,
+)
+from tree_engine import flatten_booster  # noqa: E402
+
+# LUCAS 2018 column of every trained property (censored values are NaN and dropped)
+LUCAS_COLUMNS = {
+    'ph_h2o': 'pH_H2O',
+    'nitrogen_g_per_kg': 'N',
+}
+JOIN_TOLERANCE_M = 1.0
+
+
+def join_property(features, name, lucas=None):
+    # Feature table with the property's LUCAS values as column `name`
+    column = LUCAS_COLUMNS[name]
+    if lucas is None:
+        lucas = load_source('lucas_2018', columns=['TH_LAT', 'TH_LONG', column])
+    joined, report = spatial_join(features, lucas.rename(columns={column: name}), [name], JOIN_TOLERANCE_M,
+                                  right_lat='TH_LAT', right_lon='TH_LONG')
+    if report['ambiguous']:
+        raise ValueError(f"{report['ambiguous']} feature table rows match more than one LUCAS sample")
+    return joined, report
+
+
+def train_property(name, feature_table=FEATURE_TABLE, lucas=None, output_dir=PROPERTY_BUNDLE_DIR, budget_seconds=None,
+                   workers=None, n_candidates=N_CANDIDATES, log=print):
+    df, report = join_property(load_feature_table(feature_table), name, lucas)
+    log(f"{name}: matched {report['matched']}/{report['rows']} feature table rows")
+    X, y, freq_encoding, mean_encoding = preprocess(df, target=name)
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=RANDOM_STATE)
+    log(f"{name}: training on {len(X_train)} rows, testing on {len(X_test)} rows")
+
+    start = time.monotonic()
+    best_params, n_estimators, cv_mse, results = successive_halving(
+        X_train, y_train, n_candidates=n_candidates, budget_seconds=budget_seconds, workers=workers, log=log
+    )
+    search_seconds = time.monotonic() - start
+    model = lgb.LGBMRegressor(n_estimators=n_estimators, random_state=RANDOM_STATE, verbose=-1, **best_params)
+    model.fit(X_train, y_train)
+    y_pred = model.predict(X_test)
+    metrics = {'test_mse': float(mean_squared_error(y_test, y_pred)), 'test_r2': float(r2_score(y_test, y_pred))}
+    log(f"{name}: best parameters {best_params}, n_estimators={n_estimators}, test MSE {metrics['test_mse']:.4f}, "
+        f"R^2 {metrics['test_r2']:.4f} ({search_seconds:.1f} s)")
+
+    metadata = {
+        'target': name,
+        'lucas_column': LUCAS_COLUMNS[name],
+        'unit': PROPERTIES[name]['unit'],
+        'feature_table': feature_table,
+        'feature_table_sha256': _file_hash(feature_table),
+        'features': list(X.columns),
+        'params': {**best_params, 'n_estimators': n_estimators, 'random_state': RANDOM_STATE},
+        'cv_mse': cv_mse,
+        'search_seconds': round(search_seconds, 1),
+        'candidates_evaluated': int(results['candidate'].nunique()),
+        **metrics,
+    }
+    path = export_bundle(flatten_booster(model.booster_), freq_encoding, mean_encoding,
+                         bundle_land_cover_types(X.columns), DEFAULT_INDEX_STATS, os.path.join(output_dir, name),
+                         metadata=metadata)
+    log(f"{name}: saved {path}")
+    return metadata
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the additional soil property models.")
+    parser.add_argument('properties', nargs='*', help=f"Properties to train (default: {', '.join(LUCAS_COLUMNS)})")
+    parser.add_argument('--feature-table', default=FEATURE_TABLE, help="Feature table (CSV or Parquet store)")
+    parser.add_argument('--output-dir', default=PROPERTY_BUNDLE_DIR, help="Directory of the property bundles")
+    parser.add_argument('--budget', type=float, help="Wall-clock budget for each property's search in seconds")
+    parser.add_argument('--workers', type=int, help="Search processes (default: all cores)")
+    parser.add_argument('--candidates', type=int, default=N_CANDIDATES, help="Sampled parameter sets")
+    args = parser.parse_args()
+
+    unknown = [name for name in args.properties if name not in LUCAS_COLUMNS]
+    if unknown:
+        parser.error(f"unknown properties {unknown}, choose from {list(LUCAS_COLUMNS)}")
+    names = args.properties or list(LUCAS_COLUMNS)
+
+    lucas = load_source('lucas_2018', columns=['TH_LAT', 'TH_LONG'] + [LUCAS_COLUMNS[name] for name in names])
+    for name in names:
+        train_property(name, args.feature_table, lucas, args.output_dir, args.budget, args.workers, args.candidates)
+
+
+if __name__ == '__main__':
+    main()
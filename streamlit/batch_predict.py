@@ -0,0 +1,260 @@
+# Batch SOC prediction for tables of field locations (CSV or Parquet in, predictions out)
+#
+# Usage (from the repository root):
+#   python streamlit/batch_predict.py locations.csv predictions.csv
+#   python streamlit/batch_predict.py locations.parquet predictions.parquet --chunk-size 20000
+#
+# Input columns: lat, long, elevation, sand, silt, clay, land_cover_type, main_vegetation_type
+# and optionally NDVI_mean, NDMI_mean, BSI_mean, SOCI_mean (placeholders are used if missing).
+# sand/silt/clay are the model's texture inputs as named in the training table, where "sand" is silt %,
+# "silt" is clay % and "clay" is sand % (see soil_lookup.MODEL_TEXTURE_FRACTIONS).
+# With --soil-lookup, missing sand/silt/clay columns or values are filled from the SoilGrids polygons.
+# With --properties, every registered soil property (see multi_target.py) is predicted from the same
+# features and gets its own <property>_predicted column.
+
+import argparse
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+
+import metrics
+from model_bundle import BUNDLE_PATH, INDEX_COLUMNS, NUMERIC_COLUMNS, ModelBundle
+from multi_target import PRIMARY_PROPERTY, PROPERTIES, MultiTargetPredictor
+from soil_lookup import SOILGRIDS_CSV, SoilLookup, fill_soil_texture
+from tree_engine import TreeEnsemble
+
+MODEL_PATH = "ml_model/tuned_lightgbm_model.pkl"
+FREQ_ENCODING_PATH = "streamlit/main_vegetation_type_freq_encoding.npy"
+MEAN_ENCODING_PATH = "streamlit/main_vegetation_type_mean_encoding.npy"
+
+# Only used to export the model bundle, which carries the categories the model was trained on
+LAND_COVER_TYPES = ["Cropland", "Grassland", "Woodland", "Bareland", "Shrubland"]
+
+# Placeholder index values, used where no fetched or precomputed index means are available
+DEFAULT_INDEX_STATS = {"NDVI_mean": 0.5, "NDMI_mean": 0.3, "BSI_mean": -0.2, "SOCI_mean": 0.1}
+
+DEFAULT_CHUNK_SIZE = 50_000
+
+# Columns read as numbers and as categories; for a Parquet output every other column of a CSV input is
+# kept as text, since pandas types each CSV chunk on its own
+NUMBER_COLUMNS = NUMERIC_COLUMNS + ["lon"] + INDEX_COLUMNS
+CATEGORY_COLUMNS = ["land_cover_type", "main_vegetation_type"]
+
+
+def load_model(path=BUNDLE_PATH):
+    # Bundle directories load as ModelBundle, flattened .npz exports into the NumPy tree engine and
+    # anything else is the pickled LightGBM model
+    if os.path.isdir(path):
+        return ModelBundle.load(path)
+    if str(path).endswith(".npz"):
+        return TreeEnsemble.load(path)
+    with open(path, "rb") as model_file:
+        return pickle.load(model_file)
+
+
+def load_encodings(freq_path=FREQ_ENCODING_PATH, mean_path=MEAN_ENCODING_PATH):
+    freq_encoding = np.load(freq_path, allow_pickle=True).item()
+    mean_encoding = np.load(mean_path, allow_pickle=True).item()
+    return freq_encoding, mean_encoding
+
+
+def model_encodings(model):
+    # The vegetation encodings that belong to the model: from the bundle, otherwise the .npy files
+    if isinstance(model, (ModelBundle, MultiTargetPredictor)):
+        return model.freq_encoding, model.mean_encoding
+    return load_encodings()
+
+
+def build_feature_frame(df, freq_encoding, mean_encoding, feature_names=None):
+    # Accept the app's 'lon' spelling as well as the feature table's 'long'
+    if "long" not in df.columns and "lon" in df.columns:
+        df = df.rename(columns={"lon": "long"})
+
+    missing = [col for col in NUMERIC_COLUMNS + ["land_cover_type", "main_vegetation_type"] if col not in df.columns]
+    if missing:
+        raise ValueError(f"Input is missing required columns: {missing}")
+
+    # Columns are collected first and the frame is built once; inserting them one at a time costs
+    # about a millisecond per column, which dominates single-row predictions
+    features = {}
+    for col in NUMERIC_COLUMNS:
+        features[col] = pd.to_numeric(df[col], errors="coerce").astype("float64")
+
+    # Use indices from the input where present, otherwise fall back to the placeholder stats
+    for col in INDEX_COLUMNS:
+        if col in df.columns:
+            features[col] = pd.to_numeric(df[col], errors="coerce").astype("float64")
+        else:
+            features[col] = np.full(len(df), DEFAULT_INDEX_STATS[col])
+
+    # Frequency and target encoding for vegetation type (unknown types map to 0 like the app)
+    vegetation = df["main_vegetation_type"].astype(str)
+    features["main_vegetation_type_freq_encoded"] = vegetation.map(freq_encoding).fillna(0).astype("float64")
+    features["main_vegetation_type_target_encoded"] = vegetation.map(mean_encoding).fillna(0).astype("float64")
+
+    # One-hot encode land cover type
+    land_cover = df["land_cover_type"].astype(str).to_numpy()
+    for cover_type in LAND_COVER_TYPES:
+        features[f"land_cover_type_{cover_type}"] = (land_cover == cover_type).astype("int64")
+    features = pd.DataFrame(features, index=df.index)
+
+    # LightGBM matches features by position, not by name, so align to the training column order
+    if feature_names is not None:
+        features = features[list(feature_names)]
+    return features
+
+
+def predict_frame(model, df, freq_encoding, mean_encoding):
+    # A model bundle encodes with its own categories and encodings straight into the feature matrix; a
+    # multi-target predictor does the same once for all its models and returns a DataFrame of properties
+    with metrics.span("encode"):
+        if isinstance(model, (ModelBundle, MultiTargetPredictor)):
+            features = model.encode(df)
+        else:
+            features = build_feature_frame(df, freq_encoding, mean_encoding, getattr(model, "feature_name_", None))
+    with metrics.span("predict"):
+        return model.predict(features)
+
+
+def _is_parquet(path):
+    return str(getattr(path, "name", path)).lower().endswith((".parquet", ".pq"))
+
+
+def iter_input_chunks(source, chunk_size=DEFAULT_CHUNK_SIZE, dtype=None):
+    # Stream the input in fixed-size chunks so memory stays flat regardless of file size; dtype is passed
+    # to read_csv for CSV input
+    if _is_parquet(source):
+        import pyarrow.parquet as pq
+
+        parquet_file = pq.ParquetFile(source)
+        for batch in parquet_file.iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(source, chunksize=chunk_size, dtype=dtype)
+
+
+def iter_predictions(source, model, freq_encoding, mean_encoding, chunk_size=DEFAULT_CHUNK_SIZE, soil_lookup=None,
+                     dtype=None):
+    # One model.predict call per chunk, yielding the input rows with a prediction column added (one per
+    # property for a multi-target predictor)
+    for chunk in iter_input_chunks(source, chunk_size, dtype):
+        if soil_lookup is None:
+            chunk = chunk.copy()
+        else:
+            with metrics.span("soil_lookup"):
+                chunk = fill_soil_texture(chunk, soil_lookup)
+        predictions = predict_frame(model, chunk, freq_encoding, mean_encoding)
+        if isinstance(predictions, pd.DataFrame):
+            for name in predictions.columns:
+                chunk[f"{name}_predicted"] = predictions[name].to_numpy()
+        else:
+            chunk[f"{PRIMARY_PROPERTY}_predicted"] = predictions
+        yield chunk
+
+
+def _is_number_column(column):
+    return column in NUMBER_COLUMNS or column.endswith("_predicted")
+
+
+def _output_schema(chunk, input_schema=None):
+    # Arrow schema of a Parquet output, fixed before the first chunk is written so that a later chunk
+    # with an all-empty or differently parsed column still fits: the model's numeric inputs and the
+    # predictions are float64, the categories strings and the other columns keep the type of the Parquet
+    # input. Other columns of a CSV input are read as text (see predict_file).
+    import pyarrow as pa
+
+    fields = []
+    for column in chunk.columns:
+        if _is_number_column(column):
+            arrow_type = pa.float64()
+        elif input_schema is not None and column in input_schema.names and column not in CATEGORY_COLUMNS:
+            arrow_type = input_schema.field(column).type
+        else:
+            arrow_type = pa.string()
+        fields.append(pa.field(str(column), arrow_type))
+    return pa.schema(fields)
+
+
+def _arrow_table(chunk, schema):
+    # The chunk cast to the output schema; numeric inputs that are not numbers are null, as for the model
+    import pyarrow as pa
+
+    columns = {}
+    for field in schema:
+        values = chunk[field.name]
+        if _is_number_column(field.name):
+            values = pd.to_numeric(values, errors="coerce").astype("float64")
+        elif pa.types.is_string(field.type):
+            values = values.astype("string")
+        columns[field.name] = values
+    return pa.Table.from_pandas(pd.DataFrame(columns), schema=schema, preserve_index=False)
+
+
+def predict_file(input_path, output_path, model=None, freq_encoding=None, mean_encoding=None,
+                 chunk_size=DEFAULT_CHUNK_SIZE, soil_lookup=None):
+    if model is None:
+        model = load_model()
+    if freq_encoding is None or mean_encoding is None:
+        freq_encoding, mean_encoding = model_encodings(model)
+
+    dtype = None
+    if _is_parquet(output_path) and not _is_parquet(input_path):
+        header = pd.read_csv(input_path, nrows=0).columns
+        dtype = {column: "string" for column in header if not _is_number_column(column)}
+
+    n_rows = 0
+    writer = None
+    try:
+        for i, chunk in enumerate(iter_predictions(input_path, model, freq_encoding, mean_encoding, chunk_size,
+                                                       soil_lookup, dtype)):
+            if _is_parquet(output_path):
+                import pyarrow.parquet as pq
+
+                if writer is None:
+                    input_schema = pq.read_schema(input_path) if _is_parquet(input_path) else None
+                    writer = pq.ParquetWriter(output_path, _output_schema(chunk, input_schema))
+                writer.write_table(_arrow_table(chunk, writer.schema))
+            else:
+                chunk.to_csv(output_path, mode="w" if i == 0 else "a", header=i == 0, index=False)
+            n_rows += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+    return n_rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Predict SOC for a table of locations.")
+    parser.add_argument("input", help="Input CSV or Parquet file")
+    parser.add_argument("output", help="Output CSV or Parquet file")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="Rows per prediction chunk")
+    parser.add_argument("--model", default=BUNDLE_PATH,
+                        help="Model bundle directory, exported .npz model or pickled model")
+    parser.add_argument("--soil-lookup", nargs="?", const=SOILGRIDS_CSV,
+                        help="Fill missing sand/silt/clay from SoilGrids polygons (default: %(const)s)")
+    parser.add_argument("--properties", nargs="*", metavar="PROPERTY",
+                        help="Predict these soil properties, or every one with a trained bundle if none are "
+                             f"named ({', '.join(PROPERTIES)}); --model is used for {PRIMARY_PROPERTY}")
+    args = parser.parse_args()
+
+    if os.path.abspath(args.input) == os.path.abspath(args.output):
+        parser.error("input and output must be different files")
+    unknown = [name for name in args.properties or [] if name not in PROPERTIES]
+    if unknown:
+        parser.error(f"unknown properties {unknown}, choose from {list(PROPERTIES)}")
+
+    if args.properties is None:
+        model = load_model(args.model)
+    elif os.path.isdir(args.model):
+        model = MultiTargetPredictor.load(args.properties or None, paths={PRIMARY_PROPERTY: args.model})
+    else:
+        parser.error("--properties needs --model to be a model bundle directory")
+    soil_lookup = SoilLookup.from_files(args.soil_lookup) if args.soil_lookup else None
+    n_rows = predict_file(args.input, args.output, model=model, chunk_size=args.chunk_size, soil_lookup=soil_lookup)
+    print(f"Predicted {n_rows} rows, saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+# Record/replay Earth Engine backend for offline, deterministic runs
+#
+# RecordingBackend wraps any backend (usually EarthEngineBackend) and stores every request with its
+# response, or the error it raised, and its duration in a cassette. ReplayBackend serves the same
+# requests from the cassette without credentials or network, optionally sleeping the recorded or a
+# fixed latency per request, so fetch code, exports, benchmarks and the app run unchanged against
+# recorded Earth Engine data.
+#
+# A cassette is one SQLite file with one row per request. Requests are keyed by the backend method and
+# its arguments bound to the method signature, so positional, keyword and default arguments give the
+# same key; dates are stored as ISO strings and export point tables by their content hash. The request
+# timeout is not part of the key. Requests that are repeated and get different answers (task_state while
+# an export runs) are numbered, replay serves them in the recorded order and repeats the last one after
+# that. Request and response are stored as zlib-compressed JSON.
+#
+# Usage (from the repository root):
+#   python streamlit/feature_grid.py build --bbox 9 50 10 51 --backend earthengine --credentials key.json \
+#       --record .cache/cassettes/grid.sqlite
+#   python streamlit/feature_grid.py --store /tmp/grid build --bbox 9 50 10 51 --replay .cache/cassettes/grid.sqlite
+#   python streamlit/cassette_backend.py .cache/cassettes/grid.sqlite    # summary of a cassette
+# The Streamlit apps record or replay when SOC_GEE_RECORD or SOC_GEE_REPLAY is set to a cassette path.
+# The apps and the feature grid fetch the last five years up to the last full month, so their cassettes
+# only replay within the month they were recorded in; scripts with explicit dates replay indefinitely.
+
+import argparse
+import hashlib
+import inspect
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+
+from gee_backend import GeeBackend, RateLimitError
+
+BACKEND_METHODS = ['climate_series', 'quarter_indices', 'sample_elevation', 'start_quarterly_export', 'task_state']
+# Parameters that do not change the response
+UNKEYED_PARAMS = {'timeout'}
+# Errors that are raised again as the same type on replay, anything else as RuntimeError
+REPLAYED_ERRORS = {error.__name__: error for error in (RateLimitError, TimeoutError, RuntimeError, ValueError)}
+_SIGNATURES = {name: inspect.signature(getattr(GeeBackend, name)) for name in BACKEND_METHODS}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS interactions (
+    key TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    method TEXT NOT NULL,
+    request BLOB NOT NULL,
+    response BLOB,
+    error TEXT,
+    duration REAL NOT NULL,
+    recorded_at REAL NOT NULL,
+    PRIMARY KEY (key, seq)
+);
+"""
+
+
+class CassetteMiss(LookupError):
+    pass
+
+
+def _normalize(value):
+    # JSON-compatible form of a request argument that is identical for identical requests
+    if isinstance(value, pd.DataFrame):
+        content = pd.util.hash_pandas_object(value, index=False).to_numpy().tobytes()
+        return {'columns': [str(c) for c in value.columns], 'rows': len(value),
+                'sha256': hashlib.sha256(content).hexdigest()}
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, dict):
+        return {str(k): _normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple, np.ndarray, pd.Series)):
+        return [_normalize(v) for v in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def request_params(method, args, kwargs):
+    # All arguments of a backend call by name, defaults filled in
+    bound = _SIGNATURES[method].bind(None, *args, **kwargs)
+    bound.apply_defaults()
+    return {name: _normalize(value) for name, value in list(bound.arguments.items())[1:]
+            if name not in UNKEYED_PARAMS}
+
+
+def request_key(method, params):
+    return hashlib.sha256(json.dumps([method, params], sort_keys=True).encode()).hexdigest()
+
+
+def _pack(value):
+    return zlib.compress(json.dumps(value).encode(), 6)
+
+
+def _unpack(blob):
+    return json.loads(zlib.decompress(blob))
+
+
+class CassetteStore:
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connect().executescript(_SCHEMA)
+
+    def _connect(self):
+        # sqlite3 connections cannot be shared between threads, so every thread gets its own
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def replace(self, key):
+        self._connect().execute("DELETE FROM interactions WHERE key = ?", (key,))
+
+    def add(self, key, seq, method, params, response, error, duration):
+        self._connect().execute(
+            "INSERT OR REPLACE INTO interactions VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (key, seq, method, _pack(params), None if error else _pack(response), error, duration, time.time()),
+        )
+
+    def interactions(self):
+        # (method, params, response, error, duration) per request, in recorded order per key
+        rows = self._connect().execute(
+            "SELECT method, request, response, error, duration FROM interactions ORDER BY key, seq")
+        for method, request, response, error, duration in rows:
+            yield method, _unpack(request), None if response is None else _unpack(response), error, duration
+
+    def summary(self):
+        rows = self._connect().execute(
+            "SELECT method, COUNT(*), COUNT(error), AVG(duration), SUM(LENGTH(request) + COALESCE(LENGTH(response), 0)) "
+            "FROM interactions GROUP BY method ORDER BY method").fetchall()
+        return pd.DataFrame(rows, columns=['method', 'requests', 'errors', 'mean_seconds', 'bytes'])
+
+
+class _CassetteBackend(GeeBackend):
+    # The backend methods as thin wrappers around _request()
+
+    def climate_series(self, *args, **kwargs):
+        return self._request('climate_series', args, kwargs)
+
+    def quarter_indices(self, *args, **kwargs):
+        return self._request('quarter_indices', args, kwargs)
+
+    def sample_elevation(self, *args, **kwargs):
+        return self._request('sample_elevation', args, kwargs)
+
+    def start_quarterly_export(self, *args, **kwargs):
+        return self._request('start_quarterly_export', args, kwargs)
+
+    def task_state(self, *args, **kwargs):
+        return self._request('task_state', args, kwargs)
+
+
+class RecordingBackend(_CassetteBackend):
+    # Requests go to the wrapped backend; a key recorded by an earlier run is replaced the first time
+    # this run sends it, so re-recording never mixes old and new responses
+
+    def __init__(self, backend, store):
+        super().__init__()
+        self.backend = backend
+        self.store = store if isinstance(store, CassetteStore) else CassetteStore(store)
+        self._seq = {}
+        self._seq_lock = threading.Lock()
+
+    def _request(self, method, args, kwargs):
+        self._count_request()
+        params = request_params(method, args, kwargs)
+        key = request_key(method, params)
+        start = time.perf_counter()
+        try:
+            response = getattr(self.backend, method)(*args, **kwargs)
+        except Exception as e:
+            self._record(key, method, params, None, f"{type(e).__name__}: {e}", time.perf_counter() - start)
+            raise
+        self._record(key, method, params, _normalize(response), None, time.perf_counter() - start)
+        return response
+
+    def _record(self, key, method, params, response, error, duration):
+        with self._seq_lock:
+            seq = self._seq.get(key, 0)
+            self._seq[key] = seq + 1
+            if seq == 0:
+                self.store.replace(key)
+            self.store.add(key, seq, method, params, response, error, duration)
+
+
+class ReplayBackend(_CassetteBackend):
+    # latency: None to answer immediately, 'recorded' to sleep each request's recorded duration, or
+    # seconds per request. Requests that did not occur while recording raise CassetteMiss.
+
+    def __init__(self, store, latency=None):
+        super().__init__()
+        self.store = store if isinstance(store, CassetteStore) else CassetteStore(store)
+        self.latency = latency
+        # The cassette is read once; requests are then served from memory
+        self._recorded = {}
+        for method, params, response, error, duration in self.store.interactions():
+            self._recorded.setdefault(request_key(method, params), []).append((response, error, duration))
+        self._served = {}
+        self._served_lock = threading.Lock()
+
+    def _request(self, method, args, kwargs):
+        self._count_request()
+        params = request_params(method, args, kwargs)
+        key = request_key(method, params)
+        recorded = self._recorded.get(key)
+        if recorded is None:
+            raise CassetteMiss(f"No recorded {method} request for {params} in {self.store.path}")
+        with self._served_lock:
+            served = self._served.get(key, 0)
+            self._served[key] = served + 1
+        response, error, duration = recorded[min(served, len(recorded) - 1)]
+
+        delay = duration if self.latency == 'recorded' else (self.latency or 0.0)
+        timeout = _SIGNATURES[method].bind(None, *args, **kwargs).arguments.get('timeout')
+        if delay:
+            if timeout is not None and delay > timeout:
+                time.sleep(timeout)
+                raise TimeoutError(f"Request exceeded {timeout}s")
+            time.sleep(delay)
+        if error is not None:
+            name, _, message = error.partition(': ')
+            raise REPLAYED_ERRORS.get(name, RuntimeError)(message if name in REPLAYED_ERRORS else error)
+        return response
+
+
+def replay_latency(value):
+    # argparse type for --replay-latency
+    return value if value == 'recorded' else float(value)
+
+
+def add_cassette_arguments(parser):
+    parser.add_argument('--record', metavar='CASSETTE', help="Record every backend request into this cassette")
+    parser.add_argument('--replay', metavar='CASSETTE',
+                        help="Serve backend requests from this cassette instead of Earth Engine")
+    parser.add_argument('--replay-latency', type=replay_latency, default=None,
+                        help="Seconds slept per replayed request, or 'recorded' for the recorded durations")
+
+
+def cassette_backend(args, make_live_backend):
+    # The replayed backend if --replay is given (make_live_backend is not called), otherwise the live
+    # backend, recorded if --record is given
+    if args.replay:
+        return ReplayBackend(args.replay, latency=args.replay_latency)
+    backend = make_live_backend()
+    if args.record:
+        return RecordingBackend(backend, args.record)
+    return backend
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Summarize a recorded Earth Engine cassette.")
+    parser.add_argument('cassette')
+    args = parser.parse_args(argv)
+    if not os.path.exists(args.cassette):
+        parser.error(f"{args.cassette} does not exist")
+    print(CassetteStore(args.cassette).summary().to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
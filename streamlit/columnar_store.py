@@ -0,0 +1,112 @@
+# Typed Parquet copies of the pipeline CSVs
+#
+#   quarterly composites  -> data/satellite_data/indices/quarterly_comps_indices.parquet/quarter=YYYY_QN/*.parquet
+#   aggregated indices    -> data/satellite_data/indices/landsat_indices_agged.parquet
+#   feature table         -> ml_model/feature_table_fixed.parquet
+#
+# The composites are partitioned by quarter and store the parsed lat/long plus an integer location_id
+# (position of the .geo string in sorted order) instead of the GeoJSON text. Satellite indices and soil
+# fractions are float32, text columns are categorical; coordinates and the SOC target stay float64 since
+# they are used as join keys and labels. The loaders read only the requested columns (and quarters)
+# and memory-map the files instead of copying them into buffers first.
+#
+# Usage (from the repository root):
+#   python streamlit/columnar_store.py
+
+import argparse
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from gee_backend import INDEX_BANDS
+from index_aggregation import read_composites
+
+COMPOSITES_CSV_DIR = 'data/satellite_data/indices/quarterly_comps_indices_filtered'
+COMPOSITES_STORE = 'data/satellite_data/indices/quarterly_comps_indices.parquet'
+AGGREGATES_CSV = 'data/satellite_data/indices/landsat_indices_agged.csv'
+AGGREGATES_STORE = 'data/satellite_data/indices/landsat_indices_agged.parquet'
+FEATURE_TABLE_CSV = 'ml_model/feature_table_fixed.csv'
+FEATURE_TABLE_STORE = 'ml_model/feature_table_fixed.parquet'
+
+FLOAT32_COLUMNS = INDEX_BANDS + [
+    f'{index}_{stat}' for index in INDEX_BANDS for stat in ('mean', 'std', 'trend')
+] + ['sand', 'silt', 'clay']
+CATEGORICAL_COLUMNS = ['depth', 'land_cover_type', 'main_vegetation_type']
+DATE_COLUMNS = ['sample_date']
+
+
+def _typed(df):
+    # Apply the storage dtypes to whichever of the known columns the frame has
+    df = df.copy()
+    for column in df.columns:
+        if column in FLOAT32_COLUMNS:
+            df[column] = df[column].astype('float32')
+        elif column in CATEGORICAL_COLUMNS:
+            df[column] = df[column].astype('category')
+        elif column in DATE_COLUMNS:
+            df[column] = pd.to_datetime(df[column])
+        elif column == 'elevation':
+            df[column] = df[column].astype('Int32')
+    return df
+
+
+def convert_composites(csv_dir=COMPOSITES_CSV_DIR, store_path=COMPOSITES_STORE):
+    df = read_composites(csv_dir)
+    locations = np.sort(df['.geo'].unique())
+    df['location_id'] = pd.Index(locations).get_indexer(df['.geo']).astype('int32')
+    df = _typed(df[['quarter', 'location_id', 'lat', 'long', 'sample_date'] + INDEX_BANDS])
+
+    # Rewrite the whole dataset so a re-run never leaves stale partitions behind
+    if os.path.exists(store_path):
+        shutil.rmtree(store_path)
+    pq.write_to_dataset(pa.Table.from_pandas(df, preserve_index=False), store_path, partition_cols=['quarter'])
+    return len(df)
+
+
+def convert_table(csv_path, store_path):
+    df = _typed(pd.read_csv(csv_path))
+    pq.write_table(pa.Table.from_pandas(df, preserve_index=False), store_path)
+    return len(df)
+
+
+def load_composites(store_path=COMPOSITES_STORE, columns=None, quarters=None, memory_map=True):
+    # columns=None reads everything; the quarter column is always included
+    if columns is not None:
+        columns = [column for column in columns if column != 'quarter'] + ['quarter']
+    filters = [('quarter', 'in', list(quarters))] if quarters is not None else None
+    table = pq.read_table(store_path, columns=columns, filters=filters, memory_map=memory_map)
+    df = table.to_pandas()
+    df['quarter'] = df['quarter'].astype(str)
+    return df
+
+
+def load_table(store_path, columns=None, memory_map=True):
+    return pq.read_table(store_path, columns=columns, memory_map=memory_map).to_pandas()
+
+
+def load_feature_table(store_path=FEATURE_TABLE_STORE, columns=None, memory_map=True):
+    return load_table(store_path, columns, memory_map)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert the pipeline CSVs to typed Parquet stores.")
+    parser.add_argument('--composites', default=COMPOSITES_CSV_DIR, help="Directory with the quarterly CSV exports")
+    parser.add_argument('--composites-store', default=COMPOSITES_STORE)
+    parser.add_argument('--aggregates', default=AGGREGATES_CSV)
+    parser.add_argument('--aggregates-store', default=AGGREGATES_STORE)
+    parser.add_argument('--feature-table', default=FEATURE_TABLE_CSV)
+    parser.add_argument('--feature-table-store', default=FEATURE_TABLE_STORE)
+    args = parser.parse_args()
+
+    print(f"Composites: {convert_composites(args.composites, args.composites_store)} rows -> {args.composites_store}")
+    print(f"Aggregates: {convert_table(args.aggregates, args.aggregates_store)} rows -> {args.aggregates_store}")
+    print(f"Feature table: {convert_table(args.feature_table, args.feature_table_store)} rows "
+          f"-> {args.feature_table_store}")
+
+
+if __name__ == '__main__':
+    main()
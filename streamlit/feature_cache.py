@@ -0,0 +1,150 @@
+# Disk-backed cache for remote geospatial lookups (satellite indices, climate data)
+#
+# Entries are keyed by the kind of lookup, the location snapped to a grid, and the parameters that
+# change the result (time window, collection, cloud threshold, buffer, scale). Repeat and nearby
+# queries therefore read from a local SQLite file instead of going back to Earth Engine.
+# The cache is bounded in size (least recently used entries are evicted first), entries expire after
+# a time-to-live, and SQLite's write-ahead log keeps it safe for concurrent readers and writers in
+# several threads or processes.
+
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+import metrics
+
+DEFAULT_CACHE_PATH = ".cache/feature_cache.sqlite"
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_TTL_SECONDS = 30 * 24 * 3600
+# Grid step used to snap coordinates: 0.0003 degrees is about 30 m, the buffer used for index sampling
+DEFAULT_RESOLUTION_DEG = 0.0003
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access);
+"""
+
+
+class FeatureCache:
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_bytes=DEFAULT_MAX_BYTES, ttl_seconds=DEFAULT_TTL_SECONDS,
+                 resolution_deg=DEFAULT_RESOLUTION_DEG):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.resolution_deg = resolution_deg
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connect(self):
+        # sqlite3 connections cannot be shared between threads, so every thread gets its own
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def make_key(self, kind, lat, lon, **params):
+        # Snap the location to the cache grid so nearby queries share an entry
+        cell = (round(lat / self.resolution_deg), round(lon / self.resolution_deg))
+        return json.dumps([kind, self.resolution_deg, cell, params], sort_keys=True, default=str)
+
+    def get(self, key, default=None):
+        conn = self._connect()
+        now = time.time()
+        row = conn.execute("SELECT value, created_at FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is not None and now - row[1] > self.ttl_seconds:
+            conn.execute("DELETE FROM entries WHERE key = ? AND created_at = ?", (key, row[1]))
+            row = None
+        metrics.record_cache_lookup("feature_cache", row is not None)
+        if row is None:
+            self._count(misses=1)
+            return default
+        conn.execute("UPDATE entries SET last_access = ? WHERE key = ?", (now, key))
+        self._count(hits=1)
+        return pickle.loads(row[0])
+
+    def set(self, key, value):
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        now = time.time()
+        conn = self._connect()
+        conn.execute(
+            "INSERT OR REPLACE INTO entries (key, value, size, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+            (key, blob, len(blob), now, now),
+        )
+        self._evict(conn, now)
+
+    def get_or_fetch(self, key, fetch, cache_if=None):
+        # Concurrent misses for the same key may both fetch; the last write wins, which is harmless here.
+        # A fetched value is only stored if cache_if(value) is true (always without cache_if).
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            value = fetch()
+            if cache_if is None or cache_if(value):
+                self.set(key, value)
+        return value
+
+    def _evict(self, conn, now):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            expired = conn.execute("DELETE FROM entries WHERE created_at < ?", (now - self.ttl_seconds,)).rowcount
+            # Drop least recently used entries until the total size is back under the limit
+            evicted = conn.execute(
+                """
+                DELETE FROM entries WHERE key IN (
+                    SELECT key FROM (
+                        SELECT key, SUM(size) OVER (ORDER BY last_access DESC, key) AS running_size FROM entries
+                    ) WHERE running_size > ?
+                )
+                """,
+                (self.max_bytes,),
+            ).rowcount
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        self._count(evictions=expired + evicted)
+
+    def _count(self, hits=0, misses=0, evictions=0):
+        with self._stats_lock:
+            self._hits += hits
+            self._misses += misses
+            self._evictions += evictions
+
+    def stats(self):
+        # Hit/miss counters are per process; entries and bytes describe the shared cache file
+        entries, total_bytes = self._connect().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        with self._stats_lock:
+            hits, misses, evictions = self._hits, self._misses, self._evictions
+        lookups = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": hits / lookups if lookups else 0.0,
+            "evictions": evictions,
+            "entries": entries,
+            "bytes": total_bytes,
+        }
+
+    def clear(self):
+        self._connect().execute("DELETE FROM entries")
@@ -0,0 +1,290 @@
+# Precomputed location features on a fixed lat/lon grid over Europe, read through memory maps
+#
+# The satellite index statistics (NDVI/NDMI/BSI/SOCI mean, std and trend over the last five years) and
+# the climate features only depend on the location and the time window, so they can be computed offline
+# for every grid cell and looked up instead of fetched. The store is a directory with
+#   features.npy     float32 (rows, cols, features), NaN where a cell was not computed
+#   window_end.npy   int32 (rows, cols), end of each cell's five-year window in days since 1970, 0 if unset
+#   grid.json        grid origin, resolution and shape, feature names
+# Cells are indexed arithmetically, so a lookup is O(1): the nearest cell, or a bilinear blend of the four
+# surrounding cell centres that skips uncomputed and stale neighbours. A cell is stale once its window
+# ended more than max_staleness_days before the current one; lookups outside coverage return None so the
+# caller can fall back to a live fetch.
+#
+# Usage (from the repository root):
+#   python streamlit/feature_grid.py build --bbox 5.8 47.2 15.1 55.1 --backend fake
+#   python streamlit/feature_grid.py build --bbox 5.8 47.2 15.1 55.1 --backend earthengine --credentials key.json
+#   python streamlit/feature_grid.py build --bbox 5.8 47.2 15.1 55.1 --replay .cache/cassettes/grid.sqlite
+#   python streamlit/feature_grid.py query 52.1 10.5 --bilinear
+
+import argparse
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+
+import numpy as np
+
+from cassette_backend import add_cassette_arguments, cassette_backend
+from gee_backend import INDEX_BANDS
+from remote_features import (call_with_backoff, fetch_climate_data, fetch_quarterly_simple_indices,
+                             has_transient_failures, last_five_years)
+
+DEFAULT_STORE = 'data/feature_grid'
+# Europe from the Canary Islands to the North Cape and from Iceland to the Urals
+EUROPE_BOUNDS = (-25.0, 34.0, 45.0, 72.0)
+DEFAULT_RESOLUTION_DEG = 0.05
+DEFAULT_MAX_STALENESS_DAYS = 92
+DEFAULT_MAX_CONCURRENT_CELLS = 8
+FLUSH_EVERY = 256
+INDEX_FEATURES = [f'{index}_{stat}' for index in INDEX_BANDS for stat in ('mean', 'std', 'trend')]
+CLIMATE_FEATURES = ['mean_precip', 'std_precip', 'mean_temp']
+FEATURES = INDEX_FEATURES + CLIMATE_FEATURES
+
+
+def _days(date):
+    return int((date - datetime(1970, 1, 1)).days)
+
+
+def current_window_end():
+    return _days(last_five_years()[1])
+
+
+class FeatureGrid:
+    def __init__(self, path, features, window_end, grid):
+        self.path = path
+        self.features = features
+        self.window_end = window_end
+        self.min_lon, self.min_lat = grid['min_lon'], grid['min_lat']
+        self.resolution = grid['resolution']
+        self.rows, self.cols = grid['rows'], grid['cols']
+        self.feature_names = grid['features']
+        self.grid = grid
+
+    @classmethod
+    def create(cls, path=DEFAULT_STORE, bounds=EUROPE_BOUNDS, resolution=DEFAULT_RESOLUTION_DEG):
+        min_lon, min_lat, max_lon, max_lat = bounds
+        grid = {
+            'min_lon': min_lon,
+            'min_lat': min_lat,
+            'resolution': resolution,
+            'rows': int(np.ceil(round((max_lat - min_lat) / resolution, 9))),
+            'cols': int(np.ceil(round((max_lon - min_lon) / resolution, 9))),
+            'features': FEATURES,
+        }
+        os.makedirs(path, exist_ok=True)
+        features = np.lib.format.open_memmap(os.path.join(path, 'features.npy'), mode='w+', dtype=np.float32,
+                                             shape=(grid['rows'], grid['cols'], len(FEATURES)))
+        features[:] = np.nan
+        window_end = np.lib.format.open_memmap(os.path.join(path, 'window_end.npy'), mode='w+', dtype=np.int32,
+                                               shape=(grid['rows'], grid['cols']))
+        features.flush()
+        window_end.flush()
+        with open(os.path.join(path, 'grid.json'), 'w') as f:
+            json.dump(grid, f, indent=2)
+        return cls(path, features, window_end, grid)
+
+    @classmethod
+    def open(cls, path=DEFAULT_STORE, writable=False):
+        # Memory-mapped: opening is instant and only the pages of the cells that are read get loaded
+        mode = 'r+' if writable else 'r'
+        with open(os.path.join(path, 'grid.json')) as f:
+            grid = json.load(f)
+        return cls(path, np.load(os.path.join(path, 'features.npy'), mmap_mode=mode),
+                   np.load(os.path.join(path, 'window_end.npy'), mmap_mode=mode), grid)
+
+    def cell(self, lat, lon):
+        # (row, col) of the cell containing the point, None outside the grid
+        row = int(np.floor((lat - self.min_lat) / self.resolution))
+        col = int(np.floor((lon - self.min_lon) / self.resolution))
+        if 0 <= row < self.rows and 0 <= col < self.cols:
+            return row, col
+        return None
+
+    def cell_center(self, row, col):
+        return self.min_lat + (row + 0.5) * self.resolution, self.min_lon + (col + 0.5) * self.resolution
+
+    def is_fresh(self, row, col, min_window_end):
+        # Uncomputed cells have window_end 0
+        return self.window_end[row, col] >= min_window_end
+
+    def lookup(self, lat, lon, bilinear=False, max_staleness_days=DEFAULT_MAX_STALENESS_DAYS, window_end=None):
+        # Feature dict for the point, or None if no fresh cell covers it
+        min_window_end = (window_end or current_window_end()) - max_staleness_days
+        if not bilinear:
+            cell = self.cell(lat, lon)
+            if cell is None or not self.is_fresh(*cell, min_window_end):
+                return None
+            values = self.features[cell].astype(np.float64)
+        else:
+            # Position relative to the cell centres; the four surrounding centres are blended
+            y = (lat - self.min_lat) / self.resolution - 0.5
+            x = (lon - self.min_lon) / self.resolution - 0.5
+            row0, col0 = int(np.floor(y)), int(np.floor(x))
+            dy, dx = y - row0, x - col0
+            total, weight_sum = np.zeros(len(self.feature_names)), np.zeros(len(self.feature_names))
+            for row, col, weight in ((row0, col0, (1 - dy) * (1 - dx)), (row0, col0 + 1, (1 - dy) * dx),
+                                     (row0 + 1, col0, dy * (1 - dx)), (row0 + 1, col0 + 1, dy * dx)):
+                if weight == 0 or not (0 <= row < self.rows and 0 <= col < self.cols):
+                    continue
+                if not self.is_fresh(row, col, min_window_end):
+                    continue
+                values = self.features[row, col].astype(np.float64)
+                known = ~np.isnan(values)
+                total[known] += weight * values[known]
+                weight_sum[known] += weight
+            if not weight_sum.any():
+                return None
+            with np.errstate(invalid='ignore'):
+                values = total / weight_sum
+        return {name: (None if np.isnan(value) else float(value)) for name, value in zip(self.feature_names, values)}
+
+    def lookup_points(self, lat, lon, names=None, bilinear=False, max_staleness_days=DEFAULT_MAX_STALENESS_DAYS,
+                      window_end=None):
+        # lookup() for arrays of points: (points, features) array of the named features (default: all), NaN
+        # where no fresh cell covers a point
+        names = list(names or self.feature_names)
+        index = [self.feature_names.index(name) for name in names]
+        lat, lon = np.asarray(lat, dtype=np.float64), np.asarray(lon, dtype=np.float64)
+        min_window_end = (window_end or current_window_end()) - max_staleness_days
+        y = (lat - self.min_lat) / self.resolution
+        x = (lon - self.min_lon) / self.resolution
+        if not bilinear:
+            neighbours = [(np.floor(y), np.floor(x), np.ones(lat.shape))]
+        else:
+            y, x = y - 0.5, x - 0.5
+            row0, col0 = np.floor(y), np.floor(x)
+            dy, dx = y - row0, x - col0
+            neighbours = [(row0, col0, (1 - dy) * (1 - dx)), (row0, col0 + 1, (1 - dy) * dx),
+                          (row0 + 1, col0, dy * (1 - dx)), (row0 + 1, col0 + 1, dy * dx)]
+
+        total = np.zeros((lat.size, len(names)))
+        weight_sum = np.zeros((lat.size, len(names)))
+        for rows, cols, weight in neighbours:
+            rows, cols, weight = rows.ravel().astype(np.int64), cols.ravel().astype(np.int64), weight.ravel()
+            usable = (weight > 0) & (rows >= 0) & (rows < self.rows) & (cols >= 0) & (cols < self.cols)
+            points = np.flatnonzero(usable)
+            fresh = self.window_end[rows[points], cols[points]] >= min_window_end
+            points = points[fresh]
+            values = self.features[rows[points], cols[points]][:, index].astype(np.float64)
+            known = ~np.isnan(values)
+            total[points] += np.where(known, values, 0.0) * weight[points, None]
+            weight_sum[points] += known * weight[points, None]
+        with np.errstate(invalid='ignore'):
+            return total / weight_sum
+
+    def cells_in(self, bounds):
+        min_lon, min_lat, max_lon, max_lat = bounds
+        first = self.cell(max(min_lat, self.min_lat), max(min_lon, self.min_lon))
+        last = self.cell(min(max_lat, self.min_lat + self.rows * self.resolution) - 1e-9,
+                         min(max_lon, self.min_lon + self.cols * self.resolution) - 1e-9)
+        if first is None or last is None:
+            return []
+        return [(row, col) for row in range(first[0], last[0] + 1) for col in range(first[1], last[1] + 1)]
+
+    def flush(self):
+        self.features.flush()
+        self.window_end.flush()
+
+
+def compute_cell_features(lat, lon, backend, start_date, end_date):
+    # Returns (features, complete); complete is False when quarters failed transiently (rate limit,
+    # timeout, error), so the statistics were computed from fewer quarters than a retry may return, or
+    # when the climate request failed (rate limits and timeouts are retried first, like the quarters)
+    quarters, index_stats = fetch_quarterly_simple_indices(lat, lon, backend, start_date=start_date,
+                                                           end_date=end_date)
+    complete = not has_transient_failures(quarters)
+    try:
+        climate = call_with_backoff(lambda: fetch_climate_data(lat, lon, backend, start_date, end_date))
+    except Exception:
+        climate, complete = [np.nan] * len(CLIMATE_FEATURES), False
+    values = [index_stats[name] for name in INDEX_FEATURES] + list(climate)
+    features = np.array([np.nan if value is None else value for value in values], dtype=np.float32)
+    return features, complete
+
+
+def materialize(grid, bounds, backend, max_concurrent=DEFAULT_MAX_CONCURRENT_CELLS,
+                max_staleness_days=DEFAULT_MAX_STALENESS_DAYS, log=print):
+    # Compute every cell in bounds that is missing or stale. Progress is flushed regularly, so an
+    # interrupted build loses at most FLUSH_EVERY cells and a re-run continues with the rest. Cells with
+    # transiently failed quarters are not written, so their window end stays unset (or stale) and a
+    # re-run retries them.
+    start_date, end_date = last_five_years()
+    window_end = _days(end_date)
+    todo = [cell for cell in grid.cells_in(bounds) if not grid.is_fresh(*cell, window_end - max_staleness_days)]
+    log(f"{len(todo)} cells to compute")
+    started = time.time()
+    done = failed = 0
+    with ThreadPoolExecutor(max_workers=max_concurrent) as pool:
+        pending = {}
+        remaining = iter(todo)
+        while True:
+            for cell in remaining:
+                future = pool.submit(compute_cell_features, *grid.cell_center(*cell), backend, start_date, end_date)
+                pending[future] = cell
+                if len(pending) >= 2 * max_concurrent:
+                    break
+            if not pending:
+                break
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                row, col = pending.pop(future)
+                features, complete = future.result()
+                if complete:
+                    grid.features[row, col] = features
+                    grid.window_end[row, col] = window_end
+                else:
+                    failed += 1
+                done += 1
+                if done % FLUSH_EVERY == 0:
+                    grid.flush()
+                    log(f"{done}/{len(todo)} cells ({time.time() - started:.1f} s)")
+    grid.flush()
+    if failed:
+        log(f"{failed} cells had failed requests and are left for the next run")
+    return done
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or query the precomputed location feature grid.")
+    parser.add_argument('--store', default=DEFAULT_STORE)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build = commands.add_parser('build', help="Compute missing or stale cells")
+    build.add_argument('--bbox', nargs=4, type=float, default=EUROPE_BOUNDS,
+                       metavar=('MIN_LON', 'MIN_LAT', 'MAX_LON', 'MAX_LAT'), help="Cells to compute")
+    build.add_argument('--resolution', type=float, default=DEFAULT_RESOLUTION_DEG,
+                       help="Cell size in degrees when the store is created")
+    build.add_argument('--backend', choices=['fake', 'earthengine'], default='earthengine')
+    build.add_argument('--credentials', help="Service account key JSON for --backend earthengine")
+    build.add_argument('--max-concurrent', type=int, default=DEFAULT_MAX_CONCURRENT_CELLS,
+                       help="Cells fetched in parallel")
+    build.add_argument('--max-staleness-days', type=int, default=DEFAULT_MAX_STALENESS_DAYS)
+    add_cassette_arguments(build)
+
+    query = commands.add_parser('query', help="Look up the features at a point")
+    query.add_argument('lat', type=float)
+    query.add_argument('lon', type=float)
+    query.add_argument('--bilinear', action='store_true')
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        if args.backend == 'earthengine' and not args.credentials and not args.replay:
+            parser.error("--backend earthengine needs --credentials")
+        from prediction_service import make_backend
+
+        if os.path.exists(os.path.join(args.store, 'grid.json')):
+            grid = FeatureGrid.open(args.store, writable=True)
+        else:
+            grid = FeatureGrid.create(args.store, resolution=args.resolution)
+        backend = cassette_backend(args, lambda: make_backend(args.backend, args.credentials))
+        done = materialize(grid, args.bbox, backend, args.max_concurrent, args.max_staleness_days)
+        print(f"Computed {done} cells, {backend.request_count} backend requests, store: {args.store}")
+    else:
+        features = FeatureGrid.open(args.store).lookup(args.lat, args.lon, bilinear=args.bilinear)
+        print(json.dumps(features, indent=2) if features else "Not covered (or stale)")
+
+
+if __name__ == '__main__':
+    main()
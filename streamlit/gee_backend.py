@@ -0,0 +1,374 @@
+# Earth Engine backends used by the feature fetch code
+#
+# Fetch functions never call ee directly; they ask a backend for data, and every backend method is
+# exactly one remote request. EarthEngineBackend talks to the live API. FakeBackend returns
+# deterministic synthetic data without credentials or network, with optional injected latency and
+# failures, so the fetch code can be tested and benchmarked offline. Both count the requests they serve.
+# cassette_backend.py records the requests of any backend and replays them offline.
+# local_indices.py applies the same cloud masks and index formulas with NumPy to imagery on disk.
+#
+# Backends raise RateLimitError for quota/rate-limit errors and TimeoutError when a request runs past
+# its timeout (EarthEngineBackend: its deadline); callers may retry both.
+
+import random
+import threading
+import time
+import zlib
+
+import numpy as np
+import pandas as pd
+
+CLIMATE_COLLECTION = 'IDAHO_EPSCOR/TERRACLIMATE'
+CLIMATE_BANDS = ['pr', 'tmmn', 'tmmx']
+SENTINEL2_COLLECTION = 'COPERNICUS/S2_SR'
+INDEX_BANDS = ['NDVI', 'NDMI', 'BSI', 'SOCI']
+LANDSAT_COLLECTION = 'LANDSAT/LC08/C02/T1_L2'
+SRTM_DATASET = 'CGIAR/SRTM90_V4'
+ALOS_DATASET = 'JAXA/ALOS/AW3D30/V3_2'
+
+
+class RateLimitError(Exception):
+    pass
+
+
+def mask_clouds_sentinel2(image):
+    # Use the SCL band for cloud masking: 3 = clear, 4 = vegetation, 5 = not water, 6 = non-cloud shadow
+    scl = image.select('SCL')
+    cloud_mask = scl.eq(3).Or(scl.eq(4)).Or(scl.eq(5)).Or(scl.eq(6))
+    return image.updateMask(cloud_mask)
+
+
+def calculate_indices_sentinel2(image):
+    # Calculate NDVI, NDMI, BSI, and SOCI (Soil Organic Carbon Index)
+    ndvi = image.normalizedDifference(['B8', 'B4']).rename('NDVI')
+    ndmi = image.normalizedDifference(['B8', 'B11']).rename('NDMI')
+    bsi = image.expression(
+        '((SWIR + RED) - (NIR + BLUE)) / ((SWIR + RED) + (NIR + BLUE))', {
+            'SWIR': image.select('B11'),
+            'RED': image.select('B4'),
+            'NIR': image.select('B8'),
+            'BLUE': image.select('B2')
+        }).rename('BSI')
+    soci = image.expression('BLUE / (GREEN * RED)', {
+        'BLUE': image.select('B2'),
+        'GREEN': image.select('B3'),
+        'RED': image.select('B4')
+    }).rename('SOCI')
+    return image.addBands([ndvi, ndmi, bsi, soci])
+
+
+# Cloud masking function for Landsat (cloud masking only, no shadow masking)
+def mask_clouds_landsat(image):
+    qa = image.select('QA_PIXEL')
+    cloud_mask = qa.bitwiseAnd(1 << 4).eq(0)  # Masking clouds only, not shadows
+    return image.updateMask(cloud_mask)
+
+
+# Cloud and shadow masking function for Landsat
+def mask_clouds_and_shadows_landsat(image):
+    # Mask based on QA_PIXEL band for both clouds and shadows
+    qa = image.select('QA_PIXEL')
+    cloud_shadow_mask = qa.bitwiseAnd(1 << 4).eq(0).And(qa.bitwiseAnd(1 << 5).eq(0))  # Mask clouds and shadows
+    return image.updateMask(cloud_shadow_mask)
+
+
+# Indices calculation function adapted for Landsat 8
+def calculate_indices_landsat(image):
+    ndvi = image.normalizedDifference(['SR_B5', 'SR_B4']).rename('NDVI')
+    ndmi = image.normalizedDifference(['SR_B5', 'SR_B6']).rename('NDMI')
+    bsi = image.expression(
+        '((SWIR + RED) - (NIR + BLUE)) / ((SWIR + RED) + (NIR + BLUE))', {
+            'SWIR': image.select('SR_B6'),
+            'RED': image.select('SR_B4'),
+            'NIR': image.select('SR_B5'),
+            'BLUE': image.select('SR_B2')
+        }).rename('BSI')
+    soci = image.select('SR_B2').divide(image.select('SR_B3').multiply(image.select('SR_B4'))).rename('SOCI')
+    return image.addBands([ndvi, ndmi, bsi, soci])
+
+
+LANDSAT_CLOUD_MASKS = {
+    'clouds': mask_clouds_landsat,
+    'clouds_and_shadows': mask_clouds_and_shadows_landsat,
+}
+
+# Export task states (as reported by ee.batch.Task.status())
+TASK_COMPLETED = 'COMPLETED'
+TASK_FAILED_STATES = ('FAILED', 'CANCELLED', 'CANCEL_REQUESTED')
+# Earth Engine request deadline of EarthEngineBackend in seconds
+DEFAULT_DEADLINE = 60
+
+
+class GeeBackend:
+    def __init__(self):
+        self._count_lock = threading.Lock()
+        self.request_count = 0
+
+    def _count_request(self):
+        with self._count_lock:
+            self.request_count += 1
+
+    def climate_series(self, lat, lon, start_date, end_date, collection=CLIMATE_COLLECTION, scale=4000):
+        # Monthly climate time series at a point: {'time': [...ms], 'pr': [...], 'tmmn': [...], 'tmmx': [...]}
+        raise NotImplementedError
+
+    def quarter_indices(self, lat, lon, start_date, end_date, collection=SENTINEL2_COLLECTION, cloud_threshold=80,
+                        buffer=30, scale=30, timeout=None):
+        # Mean NDVI/NDMI/BSI/SOCI around a point from the first suitable image in the window,
+        # or None if there is no such image
+        raise NotImplementedError
+
+    def sample_elevation(self, lats, lons, dataset=SRTM_DATASET, band='elevation', is_collection=False, buffer=0,
+                         scale=30):
+        # Mean elevation around each point (None where the dataset has no data), one request per call.
+        # Image collections such as ALOS are reduced to their median image first.
+        raise NotImplementedError
+
+    def start_quarterly_export(self, points, start_date, end_date, description, cloud_mask='clouds',
+                               cloud_threshold=80, buffer=30, scale=30, with_coordinates=False,
+                               folder='EarthEngineExports'):
+        # Start a Drive export of the mean quarterly Landsat index composite sampled at every point
+        # (DataFrame with lat, long and sample_date), returns the task id
+        raise NotImplementedError
+
+    def task_state(self, task_id):
+        # Current state of an export task: READY, RUNNING, COMPLETED, FAILED, CANCELLED, ...
+        raise NotImplementedError
+
+
+class EarthEngineBackend(GeeBackend):
+    # Expects ee.Initialize() to have been called already. The Earth Engine client only has a process-wide
+    # request deadline, so it is set once here (deadline in seconds, None leaves it as it is) and the
+    # per-request timeout arguments are not applied to live requests; concurrent requests with their own
+    # deadlines would overwrite each other's.
+
+    def __init__(self, deadline=DEFAULT_DEADLINE):
+        super().__init__()
+        import ee
+
+        self.ee = ee
+        if deadline is not None:
+            ee.data.setDeadline(int(deadline * 1000))
+
+    def _get_info(self, computed_object):
+        self._count_request()
+        try:
+            return computed_object.getInfo()
+        except self.ee.EEException as e:
+            message = str(e).lower()
+            if any(marker in message for marker in ('too many', 'quota', 'rate limit', '429')):
+                raise RateLimitError(str(e)) from e
+            if 'deadline' in message or 'timed out' in message:
+                raise TimeoutError(str(e)) from e
+            raise
+
+    def climate_series(self, lat, lon, start_date, end_date, collection=CLIMATE_COLLECTION, scale=4000):
+        ee = self.ee
+        point = ee.Geometry.Point(lon, lat)
+        images = ee.ImageCollection(collection) \
+                   .select(CLIMATE_BANDS) \
+                   .filterDate(start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d')) \
+                   .filterBounds(point)
+
+        # getRegion samples every image of the collection at the point in a single request
+        rows = self._get_info(images.getRegion(point, scale))
+        header, rows = rows[0], rows[1:]
+        columns = {name: [row[i] for row in rows] for i, name in enumerate(header)}
+        return {name: columns[name] for name in ['time'] + CLIMATE_BANDS}
+
+    def quarter_indices(self, lat, lon, start_date, end_date, collection=SENTINEL2_COLLECTION, cloud_threshold=80,
+                        buffer=30, scale=30, timeout=None):
+        ee = self.ee
+        point = ee.Geometry.Point(lon, lat)
+        images = ee.ImageCollection(collection) \
+                   .filterDate(start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d')) \
+                   .filterBounds(point) \
+                   .filter(ee.Filter.lte('CLOUDY_PIXEL_PERCENTAGE', cloud_threshold)) \
+                   .select(['B2', 'B3', 'B4', 'B8', 'B11', 'SCL']) \
+                   .map(mask_clouds_sentinel2) \
+                   .map(calculate_indices_sentinel2) \
+                   .select(INDEX_BANDS)
+
+        # The emptiness check happens server side, so this stays a single request
+        image = ee.Image(ee.Algorithms.If(images.size().gt(0), images.first(), ee.Image()))
+        result = self._get_info(image.reduceRegion(
+            reducer=ee.Reducer.mean(),
+            geometry=point.buffer(buffer),
+            scale=scale
+        ))
+        if not result or all(result.get(band) is None for band in INDEX_BANDS):
+            return None
+        return {band: result.get(band) for band in INDEX_BANDS}
+
+    def sample_elevation(self, lats, lons, dataset=SRTM_DATASET, band='elevation', is_collection=False, buffer=0,
+                         scale=30):
+        ee = self.ee
+        features = []
+        for i, (lat, lon) in enumerate(zip(lats, lons)):
+            geometry = ee.Geometry.Point(lon, lat)
+            features.append(ee.Feature(geometry.buffer(buffer) if buffer else geometry, {'i': i}))
+        if is_collection:
+            image = ee.ImageCollection(dataset).select(band).median()
+        else:
+            image = ee.Image(dataset).select(band)
+
+        # One reduceRegions call for the whole chunk; geometries are dropped to keep the response small
+        sampled = image.reduceRegions(collection=ee.FeatureCollection(features), reducer=ee.Reducer.mean(), scale=scale)
+        result = self._get_info(sampled.select(['i', 'mean'], None, False))
+        elevations = [None] * len(features)
+        for feature in result['features']:
+            properties = feature['properties']
+            elevations[int(properties['i'])] = properties.get('mean')
+        return elevations
+
+    def start_quarterly_export(self, points, start_date, end_date, description, cloud_mask='clouds',
+                               cloud_threshold=80, buffer=30, scale=30, with_coordinates=False,
+                               folder='EarthEngineExports'):
+        ee = self.ee
+        features = ee.FeatureCollection([
+            ee.Feature(ee.Geometry.Point(row.long, row.lat), {'sample_date': row.sample_date})
+            for row in points.itertuples(index=False)
+        ])
+
+        # Filter Landsat collection, apply cloud threshold and masking
+        landsat = (ee.ImageCollection(LANDSAT_COLLECTION)
+                   .filterDate(start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'))
+                   .filterBounds(features.geometry())
+                   .filter(ee.Filter.lt('CLOUD_COVER_LAND', cloud_threshold))
+                   .map(LANDSAT_CLOUD_MASKS[cloud_mask])
+                   .map(calculate_indices_landsat))
+
+        # Quarterly mean composite for calculated indices only
+        quarterly_composite = landsat.select(INDEX_BANDS).mean()
+
+        def sample(feature):
+            values = quarterly_composite.reduceRegion(
+                reducer=ee.Reducer.mean(),
+                geometry=feature.geometry().buffer(buffer),
+                scale=scale
+            )
+            if with_coordinates:
+                values = values.combine({
+                    'lat': feature.geometry().coordinates().get(1),
+                    'long': feature.geometry().coordinates().get(0)
+                }, overwrite=True)
+            return feature.set(values)
+
+        task = ee.batch.Export.table.toDrive(
+            collection=features.map(sample),
+            description=description,
+            folder=folder,
+            fileNamePrefix=description.replace('export_', 'output_', 1),
+            fileFormat='CSV'
+        )
+        self._count_request()
+        task.start()
+        return task.id
+
+    def task_state(self, task_id):
+        self._count_request()
+        return self.ee.data.getTaskStatus([task_id])[0]['state']
+
+
+class FakeBackend(GeeBackend):
+    # Deterministic stand-in for Earth Engine: values depend only on location and date.
+    # latency (seconds) is slept per request; rate_limit_rate, error_rate and missing_rate are the
+    # probabilities of a RateLimitError, a RuntimeError and a window without images per index request.
+
+    # Export tasks finish task_duration seconds after they start and fail with probability task_failure_rate.
+
+    def __init__(self, latency=0.0, rate_limit_rate=0.0, error_rate=0.0, missing_rate=0.0, task_duration=0.0,
+                 task_failure_rate=0.0, seed=42):
+        super().__init__()
+        self.latency = latency
+        self.rate_limit_rate = rate_limit_rate
+        self.error_rate = error_rate
+        self.missing_rate = missing_rate
+        self.task_duration = task_duration
+        self.task_failure_rate = task_failure_rate
+        self.tasks = {}
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+
+    def _random(self):
+        with self._rng_lock:
+            return self._rng.random()
+
+    def _simulate_request(self, timeout=None):
+        self._count_request()
+        if self.latency:
+            if timeout is not None and self.latency > timeout:
+                time.sleep(timeout)
+                raise TimeoutError(f"Request exceeded {timeout}s")
+            time.sleep(self.latency)
+        draw = self._random()
+        if draw < self.rate_limit_rate:
+            raise RateLimitError("Too many concurrent aggregations")
+        if draw < self.rate_limit_rate + self.error_rate:
+            raise RuntimeError("Simulated Earth Engine error")
+
+    def climate_series(self, lat, lon, start_date, end_date, collection=CLIMATE_COLLECTION, scale=4000):
+        self._simulate_request()
+        months = pd.date_range(start=start_date, end=end_date, freq='MS')
+        phase = 2 * np.pi * (months.month.to_numpy() - 1) / 12
+        base_temp = 150 - 10 * (abs(lat) - 45)
+        return {
+            'time': [int(ts.value // 10**6) for ts in months],
+            'pr': (60 + 20 * np.sin(phase + lon / 10)).tolist(),
+            'tmmn': (base_temp - 40 - 80 * np.cos(phase)).tolist(),
+            'tmmx': (base_temp + 40 - 80 * np.cos(phase)).tolist(),
+        }
+
+    def quarter_indices(self, lat, lon, start_date, end_date, collection=SENTINEL2_COLLECTION, cloud_threshold=80,
+                        buffer=30, scale=30, timeout=None):
+        self._simulate_request(timeout)
+        if self._random() < self.missing_rate:
+            return None
+        # Seasonal signal plus a small location-dependent offset
+        phase = 2 * np.pi * (pd.Timestamp(start_date).month - 1) / 12
+        offset = (zlib.crc32(f"{lat:.4f},{lon:.4f}".encode()) % 1000) / 10000
+        return {
+            'NDVI': 0.45 + offset + 0.25 * np.sin(phase),
+            'NDMI': 0.2 + offset + 0.1 * np.sin(phase),
+            'BSI': -0.1 - offset - 0.1 * np.sin(phase),
+            'SOCI': 7e-5 * (1 + offset),
+        }
+
+    def sample_elevation(self, lats, lons, dataset=SRTM_DATASET, band='elevation', is_collection=False, buffer=0,
+                         scale=30):
+        self._simulate_request()
+        elevations = []
+        for lat, lon in zip(lats, lons):
+            # Whether a dataset has data at a point is fixed per point, so fallbacks can fill the gaps
+            draw = zlib.crc32(f"{dataset},{lat:.6f},{lon:.6f}".encode()) / 2**32
+            if draw < self.missing_rate:
+                elevations.append(None)
+            else:
+                elevations.append(max(0.0, 200 + 150 * np.sin(lat / 3) * np.cos(lon / 4)))
+        return elevations
+
+    def start_quarterly_export(self, points, start_date, end_date, description, cloud_mask='clouds',
+                               cloud_threshold=80, buffer=30, scale=30, with_coordinates=False,
+                               folder='EarthEngineExports'):
+        if cloud_mask not in LANDSAT_CLOUD_MASKS:
+            raise ValueError(f"Unknown cloud mask: {cloud_mask}")
+        self._count_request()
+        task_id = f"FAKE_{len(self.tasks):06d}"
+        final_state = 'FAILED' if self._random() < self.task_failure_rate else TASK_COMPLETED
+        self.tasks[task_id] = {
+            'description': description,
+            'started': time.monotonic(),
+            'final_state': final_state,
+        }
+        return task_id
+
+    def task_state(self, task_id):
+        self._count_request()
+        task = self.tasks[task_id]
+        if time.monotonic() - task['started'] < self.task_duration:
+            return 'RUNNING'
+        return task['final_state']
+
+    def running_tasks(self):
+        now = time.monotonic()
+        return sum(now - task['started'] < self.task_duration for task in self.tasks.values())
@@ -0,0 +1,194 @@
+# Per-location index statistics that are updated one quarter at a time instead of recomputed
+#
+# index_aggregation.py derives mean, std and trend from all quarterly composites at once. This module
+# keeps the sufficient statistics of every (location, index) pair in a small store instead, so ingesting
+# the newest output_all_locations_YYYY_MM.csv is a single O(locations) update:
+#   count  - number of available quarters n
+#   mean   - running mean (Welford)
+#   m2     - sum of squared deviations from the mean (Welford), std = sqrt(m2 / (n - 1))
+#   cxy    - co-moment of x and the values, trend = cxy / (n(n^2-1)/12)
+# As in aggregate_cube, x is the position of a value among the available quarters, so a new value gets
+# x = n and the mean of x before the update is (n-1)/2; no other regression sums need to be stored.
+#
+# The positions only stay valid if quarters arrive in chronological order, so a quarter older than (or
+# equal to) the last ingested one is rejected; rebuild the store from the directory in that case. The
+# results match `index_aggregation.py` without --legacy-order to floating point precision.
+#
+# The store is one .npz file (location keys, coordinates and the statistics arrays) plus the ingested
+# quarters, written atomically after every ingest.
+#
+# Usage (from the repository root):
+#   python streamlit/incremental_stats.py build data/satellite_data/indices/quarterly_comps_indices_filtered
+#   python streamlit/incremental_stats.py ingest path/to/output_all_locations_2019_01.csv
+#   python streamlit/incremental_stats.py export data/satellite_data/indices/landsat_indices_agged_incremental.csv
+
+import argparse
+import glob
+import os
+
+import numpy as np
+import pandas as pd
+
+from gee_backend import INDEX_BANDS
+from index_aggregation import COMPOSITE_PATTERN, REFERENCE_QUARTER, parse_geo, quarter_label
+
+DEFAULT_STORE = 'data/satellite_data/indices/index_stats.npz'
+
+
+class IndexStatsStore:
+    def __init__(self, locations, lat, long, in_reference, count, mean, m2, cxy, quarters, reference_quarter):
+        self.locations = locations
+        self.lat = lat
+        self.long = long
+        self.in_reference = in_reference
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+        self.cxy = cxy
+        self.quarters = list(quarters)
+        self.reference_quarter = reference_quarter
+
+    @classmethod
+    def empty(cls, reference_quarter=REFERENCE_QUARTER):
+        shape = (0, len(INDEX_BANDS))
+        return cls(np.array([], dtype=str), np.zeros(0), np.zeros(0), np.zeros(0, dtype=bool),
+                   np.zeros(shape, dtype=np.int64), np.zeros(shape), np.zeros(shape), np.zeros(shape),
+                   [], reference_quarter)
+
+    @classmethod
+    def load(cls, path=DEFAULT_STORE):
+        with np.load(path) as data:
+            return cls(data['locations'], data['lat'], data['long'], data['in_reference'], data['count'],
+                       data['mean'], data['m2'], data['cxy'], data['quarters'].tolist(),
+                       str(data['reference_quarter']))
+
+    def save(self, path=DEFAULT_STORE):
+        tmp_path = f'{path}.tmp.npz'
+        np.savez(tmp_path, locations=self.locations, lat=self.lat, long=self.long, in_reference=self.in_reference,
+                 count=self.count, mean=self.mean, m2=self.m2, cxy=self.cxy,
+                 quarters=np.array(self.quarters, dtype=str), reference_quarter=np.array(self.reference_quarter))
+        os.replace(tmp_path, path)
+
+    def _positions(self, keys):
+        # Row of each key, appending rows for locations not seen before
+        positions = pd.Index(self.locations).get_indexer(keys)
+        new = positions < 0
+        if new.any():
+            new_keys = np.asarray(keys)[new]
+            positions[new] = len(self.locations) + np.arange(len(new_keys))
+            lat, long = parse_geo(new_keys)
+            shape = (len(new_keys), len(INDEX_BANDS))
+            self.locations = np.concatenate([self.locations, new_keys.astype(str)])
+            self.lat = np.concatenate([self.lat, lat])
+            self.long = np.concatenate([self.long, long])
+            self.in_reference = np.concatenate([self.in_reference, np.zeros(len(new_keys), dtype=bool)])
+            self.count = np.concatenate([self.count, np.zeros(shape, dtype=np.int64)])
+            self.mean = np.concatenate([self.mean, np.zeros(shape)])
+            self.m2 = np.concatenate([self.m2, np.zeros(shape)])
+            self.cxy = np.concatenate([self.cxy, np.zeros(shape)])
+        return positions
+
+    def ingest(self, df, quarter):
+        # Add one quarter of composites (.geo and index columns); must be newer than every ingested quarter
+        if self.quarters and quarter <= self.quarters[-1]:
+            raise ValueError(f"Quarter {quarter} is not newer than the last ingested quarter {self.quarters[-1]}; "
+                             f"rebuild the store to add older quarters")
+        keys = df['.geo'].astype(str).str.strip().to_numpy()
+        if pd.Index(keys).has_duplicates:
+            raise ValueError("Composites contain more than one row per location and quarter")
+
+        rows = self._positions(keys)
+        values = df[INDEX_BANDS].to_numpy(dtype=np.float64)
+        valid = ~np.isnan(values)
+        n_old = self.count[rows]
+        n = n_old + valid
+        mean_old = self.mean[rows]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            delta = np.where(valid, values - mean_old, 0.0)
+            mean = mean_old + np.where(valid, delta / n, 0.0)
+        residual = np.where(valid, values - mean, 0.0)
+        # The new value's x is n_old and the previous x mean (n_old-1)/2
+        self.cxy[rows] += (n_old + 1) / 2 * residual
+        self.m2[rows] += delta * residual
+        self.mean[rows] = mean
+        self.count[rows] = n
+        if quarter == self.reference_quarter:
+            self.in_reference[rows] = True
+        self.quarters.append(quarter)
+        return len(keys)
+
+    def ingest_file(self, path):
+        df = pd.read_csv(path, usecols=INDEX_BANDS + ['.geo'])
+        return self.ingest(df, quarter_label(path))
+
+    def statistics(self):
+        # Mean, std and trend as three (locations, indices) arrays, NaN like aggregate_cube
+        n = self.count
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(n > 0, self.mean, np.nan)
+            std = np.where(n > 1, np.sqrt(self.m2 / (n - 1)), np.nan)
+            trend = np.where(n > 1, self.cxy / (n * (n ** 2 - 1) / 12), np.nan)
+        return mean, std, trend
+
+    def to_frame(self, reference_only=True):
+        # Same layout and row order (sorted .geo) as index_aggregation.aggregate_composites
+        mean, std, trend = self.statistics()
+        rows = np.argsort(self.locations, kind='stable')
+        if reference_only and self.reference_quarter in self.quarters:
+            rows = rows[self.in_reference[rows]]
+        columns = {'lat': self.lat[rows], 'long': self.long[rows]}
+        for i, index in enumerate(INDEX_BANDS):
+            columns[f'{index}_mean'] = mean[rows, i]
+            columns[f'{index}_std'] = std[rows, i]
+            columns[f'{index}_trend'] = trend[rows, i]
+        return pd.DataFrame(columns)
+
+
+def build(csv_dir, reference_quarter=REFERENCE_QUARTER, pattern=COMPOSITE_PATTERN):
+    # Fresh store from every quarterly export in the directory, ingested in chronological order
+    paths = sorted(glob.glob(os.path.join(csv_dir, pattern)), key=quarter_label)
+    if not paths:
+        raise FileNotFoundError(f"No files matching {pattern} in {csv_dir}")
+    store = IndexStatsStore.empty(reference_quarter)
+    for path in paths:
+        store.ingest_file(path)
+    return store
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Maintain per-location index statistics incrementally.")
+    parser.add_argument('--store', default=DEFAULT_STORE)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = commands.add_parser('build', help="Create the store from a directory of quarterly exports")
+    build_parser.add_argument('input_dir')
+    build_parser.add_argument('--reference-quarter', default=REFERENCE_QUARTER,
+                              help="Exports keep only the locations of this quarter (empty string keeps all)")
+
+    ingest = commands.add_parser('ingest', help="Add newer quarterly exports to the store")
+    ingest.add_argument('files', nargs='+')
+
+    export = commands.add_parser('export', help="Write mean/std/trend per location as CSV")
+    export.add_argument('output')
+    export.add_argument('--all-locations', action='store_true',
+                        help="Include locations missing from the reference quarter")
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        store = build(args.input_dir, args.reference_quarter)
+        store.save(args.store)
+        print(f"Ingested {len(store.quarters)} quarters for {len(store.locations)} locations into {args.store}")
+    elif args.command == 'ingest':
+        store = IndexStatsStore.load(args.store)
+        for path in sorted(args.files, key=quarter_label):
+            rows = store.ingest_file(path)
+            print(f"{quarter_label(path)}: {rows} locations")
+        store.save(args.store)
+    else:
+        df = IndexStatsStore.load(args.store).to_frame(reference_only=not args.all_locations)
+        df.to_csv(args.output, index=False)
+        print(f"Exported {len(df)} locations to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+# Per-location mean, std and trend of the quarterly index composites (replaces the groupby/linregress
+# aggregation in data/satellite_data/indices/indices_csv_join_aggregate.ipynb)
+#
+# The exported composites are pivoted into a locations x quarters x indices array and all statistics
+# are computed in closed form over the whole array at once:
+#   mean  - mean of the available quarters
+#   std   - sample standard deviation (ddof=1, as pandas), NaN with fewer than 2 quarters
+#   trend - least-squares slope against 0..n-1 over the available quarters in chronological order
+#           (as scipy.stats.linregress on series.dropna()), NaN with fewer than 2 quarters
+#
+# The notebook concatenated the files in directory listing order, so the trends in the committed
+# landsat_indices_agged.csv follow LEGACY_QUARTER_ORDER instead of time; --legacy-order reproduces them.
+#
+# Usage (from the repository root):
+#   python streamlit/index_aggregation.py data/satellite_data/indices/quarterly_comps_indices_filtered \
+#       data/satellite_data/indices/landsat_indices_agged.csv
+
+import argparse
+import glob
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+from gee_backend import INDEX_BANDS
+
+COMPOSITE_PATTERN = 'output_all_locations_*.csv'
+# Locations exported for every quarter; the other files are filtered to these
+REFERENCE_QUARTER = '2018_Q1'
+# File order of the notebook run that produced landsat_indices_agged.csv
+LEGACY_QUARTER_ORDER = [
+    '2018_Q1', '2016_Q4', '2016_Q2', '2014_Q1', '2016_Q3', '2018_Q3', '2014_Q3', '2016_Q1', '2018_Q2', '2018_Q4',
+    '2014_Q4', '2014_Q2', '2017_Q3', '2017_Q2', '2017_Q4', '2015_Q1', '2017_Q1', '2015_Q2', '2015_Q4', '2015_Q3',
+]
+_FILENAME_RE = re.compile(r'(\d{4})_(\d{2})$')
+
+
+def quarter_label(path):
+    # output_all_locations_2018_04.csv -> 2018_Q2
+    year, month = _FILENAME_RE.search(os.path.splitext(os.path.basename(path))[0]).groups()
+    return f"{year}_Q{(int(month) - 1) // 3 + 1}"
+
+
+def parse_geo(geo):
+    # .geo is a GeoJSON point {"type":"Point","coordinates":[longitude, latitude]}
+    coordinates = pd.Series(geo).str.extract(r'"coordinates"\s*:\s*\[\s*([^,\]]+)\s*,\s*([^\]]+?)\s*\]')
+    return coordinates[1].astype(float).to_numpy(), coordinates[0].astype(float).to_numpy()
+
+
+def read_composites(csv_dir, pattern=COMPOSITE_PATTERN):
+    # All quarterly exports in one frame with a quarter column, the stripped .geo string and lat/long
+    frames = []
+    for path in glob.glob(os.path.join(csv_dir, pattern)):
+        df = pd.read_csv(path, usecols=INDEX_BANDS + ['sample_date', '.geo'])
+        df['.geo'] = df['.geo'].astype(str).str.strip()
+        df['quarter'] = quarter_label(path)
+        frames.append(df)
+    if not frames:
+        raise FileNotFoundError(f"No files matching {pattern} in {csv_dir}")
+    df = pd.concat(frames, ignore_index=True)
+    df['lat'], df['long'] = parse_geo(df['.geo'])
+    return df
+
+
+def pivot_composites(df, locations=None, quarters=None, key='.geo'):
+    # Returns (locations, quarters, cube) with cube[location, quarter, index]; locations are the
+    # sorted values of the key column unless given, quarters are sorted chronologically unless given
+    # and missing (location, quarter) pairs are NaN
+    if locations is None:
+        locations = np.sort(df[key].unique())
+    if quarters is None:
+        quarters = np.sort(df['quarter'].unique())
+    df = df[df[key].isin(locations) & df['quarter'].isin(quarters)]
+    if df.duplicated(subset=[key, 'quarter']).any():
+        raise ValueError("Composites contain more than one row per location and quarter")
+
+    location_idx = pd.Index(locations).get_indexer(df[key])
+    quarter_idx = pd.Index(quarters).get_indexer(df['quarter'])
+    cube = np.full((len(locations), len(quarters), len(INDEX_BANDS)), np.nan)
+    cube[location_idx, quarter_idx] = df[INDEX_BANDS].to_numpy(dtype=np.float64)
+    return locations, quarters, cube
+
+
+def aggregate_cube(cube):
+    # Mean, std and trend along axis 1 (quarters), ignoring NaN; returns three (locations, indices) arrays
+    valid = ~np.isnan(cube)
+    values = np.where(valid, cube, 0.0)
+    n = valid.sum(axis=1)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = values.sum(axis=1) / n
+        residuals = np.where(valid, cube - mean[:, None, :], 0.0)
+        std = np.sqrt((residuals ** 2).sum(axis=1) / (n - 1))
+
+        # x is the position of each value among the available quarters (0..n-1), so its mean is
+        # (n-1)/2 and its sum of squared deviations n(n^2-1)/12
+        x = np.cumsum(valid, axis=1) - 1.0
+        x_dev = np.where(valid, x - (n[:, None, :] - 1) / 2, 0.0)
+        trend = (x_dev * residuals).sum(axis=1) / (n * (n ** 2 - 1) / 12)
+
+    std[n < 2] = np.nan
+    trend[n < 2] = np.nan
+    return mean, std, trend
+
+
+def aggregate_composites(df, locations=None, quarters=None, key='.geo'):
+    # Output matches landsat_indices_agged.csv: lat, long, then <index>_mean/_std/_trend per index
+    locations, _, cube = pivot_composites(df, locations, quarters, key)
+    mean, std, trend = aggregate_cube(cube)
+    coordinates = df.drop_duplicates(key).set_index(key)[['lat', 'long']].reindex(locations)
+    columns = {'lat': coordinates['lat'].to_numpy(), 'long': coordinates['long'].to_numpy()}
+    for i, index in enumerate(INDEX_BANDS):
+        columns[f'{index}_mean'] = mean[:, i]
+        columns[f'{index}_std'] = std[:, i]
+        columns[f'{index}_trend'] = trend[:, i]
+    return pd.DataFrame(columns)
+
+
+def aggregate_directory(csv_dir, reference_quarter=REFERENCE_QUARTER, quarters=None):
+    # csv_dir is a directory of exported CSVs or a composites store written by columnar_store.py
+    if csv_dir.rstrip('/').endswith('.parquet'):
+        from columnar_store import load_composites
+
+        df, key = load_composites(csv_dir, columns=['location_id', 'lat', 'long'] + INDEX_BANDS), 'location_id'
+    else:
+        df, key = read_composites(csv_dir), '.geo'
+    locations = None
+    if reference_quarter:
+        locations = np.sort(df.loc[df['quarter'] == reference_quarter, key].unique())
+    return aggregate_composites(df, locations, quarters, key)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Aggregate quarterly index composites per location.")
+    parser.add_argument('input_dir', help="Directory with output_all_locations_YYYY_MM.csv files or a "
+                                          "composites store (.parquet directory)")
+    parser.add_argument('output', help="Output CSV")
+    parser.add_argument('--reference-quarter', default=REFERENCE_QUARTER,
+                        help="Keep only the locations of this quarter (empty string keeps all)")
+    parser.add_argument('--legacy-order', action='store_true',
+                        help="Compute trends in the notebook's file order to reproduce landsat_indices_agged.csv")
+    args = parser.parse_args()
+
+    quarters = LEGACY_QUARTER_ORDER if args.legacy_order else None
+    agg_df = aggregate_directory(args.input_dir, args.reference_quarter, quarters)
+    agg_df.to_csv(args.output, index=False)
+    print(f"Aggregated {len(agg_df)} locations to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+# Cloud masking and spectral indices computed locally with NumPy, for imagery that is already on disk
+#
+# Same masks and formulas as the Earth Engine functions in gee_backend.py:
+#   Landsat 8 QA_PIXEL   bit 4 (cloud) must be 0, with 'clouds_and_shadows' bit 5 as well
+#   Sentinel-2 SCL       classes 3, 4, 5 and 6 are kept
+#   NDVI = (NIR - RED) / (NIR + RED)             normalizedDifference
+#   NDMI = (NIR - SWIR) / (NIR + SWIR)           normalizedDifference
+#   BSI  = ((SWIR + RED) - (NIR + BLUE)) / ((SWIR + RED) + (NIR + BLUE))
+#   SOCI = BLUE / (GREEN * RED)
+# and Earth Engine's numeric rules: normalizedDifference masks pixels where either band is negative,
+# division by zero gives 0, and masked pixels (cloud mask, or NaN nodata in the input) come out as NaN.
+# Band values are used as they are (no scale factors), like the server-side code. Sums and products are
+# evaluated in float64, where they are exact for 16-bit bands as Earth Engine's integer arithmetic is,
+# and the results are rounded to float32.
+#
+# A scene is processed in blocks of rows: the bands can be memory-mapped .npy files of any size, the
+# output is a preallocated (4, rows, cols) float32 array (or memmap) and the float64 scratch buffers are
+# allocated once for one block, so memory stays bounded by the block size.
+#
+# Usage (from the repository root):
+#   python streamlit/local_indices.py scene_dir indices.npy --sensor landsat --cloud-mask clouds_and_shadows
+# scene_dir holds one <band>.npy per band with the Earth Engine band names (SR_B2 ... SR_B6 and QA_PIXEL
+# for Landsat, B2, B3, B4, B8, B11 and SCL for Sentinel-2); indices.npy gets NDVI, NDMI, BSI and SOCI.
+
+import argparse
+import os
+
+import numpy as np
+
+from gee_backend import INDEX_BANDS
+
+# Spectral bands used by the index formulas, and the mask band, per sensor
+SENSOR_BANDS = {
+    'landsat': {'blue': 'SR_B2', 'green': 'SR_B3', 'red': 'SR_B4', 'nir': 'SR_B5', 'swir': 'SR_B6'},
+    'sentinel2': {'blue': 'B2', 'green': 'B3', 'red': 'B4', 'nir': 'B8', 'swir': 'B11'},
+}
+MASK_BANDS = {'landsat': 'QA_PIXEL', 'sentinel2': 'SCL'}
+LANDSAT_CLOUD_BIT = 1 << 4
+LANDSAT_SHADOW_BIT = 1 << 5
+SENTINEL2_CLEAR_CLASSES = (3, 4, 5, 6)
+DEFAULT_BLOCK_ROWS = 256
+
+
+def landsat_clear_mask(qa, cloud_mask='clouds', out=None):
+    # True where the QA_PIXEL bits of mask_clouds_landsat / mask_clouds_and_shadows_landsat are 0
+    if cloud_mask not in ('clouds', 'clouds_and_shadows'):
+        raise ValueError(f"Unknown cloud mask: {cloud_mask}")
+    bits = LANDSAT_CLOUD_BIT | (LANDSAT_SHADOW_BIT if cloud_mask == 'clouds_and_shadows' else 0)
+    qa = np.asarray(qa)
+    if qa.dtype.kind not in 'iu':
+        qa = qa.astype(np.int64)
+    return np.equal(qa & bits, 0, out=out)
+
+
+def sentinel2_clear_mask(scl, out=None):
+    # True where the scene classification is one of the classes mask_clouds_sentinel2 keeps
+    out = np.zeros(np.shape(scl), dtype=bool) if out is None else out
+    out[...] = False
+    for value in SENTINEL2_CLEAR_CLASSES:
+        out |= scl == value
+    return out
+
+
+def _scratch(shape):
+    # float64 and boolean work buffers for one block, reused for every block of a scene. The band
+    # arithmetic passes dtype=np.float64, otherwise float32 bands would be summed in float32.
+    return {'a': np.empty(shape), 'b': np.empty(shape), 'c': np.empty(shape),
+            'flag': np.empty(shape, dtype=bool), 'flag2': np.empty(shape, dtype=bool)}
+
+
+def _divide(numerator, denominator, out, scratch):
+    # Earth Engine division: x / 0 is 0, result rounded into the float32 output
+    zero, nonzero = scratch['flag2'], scratch['flag']
+    np.equal(denominator, 0, out=zero)
+    np.logical_not(zero, out=nonzero)
+    np.divide(numerator, denominator, out=numerator, where=nonzero)
+    np.copyto(numerator, 0.0, where=zero)
+    out[...] = numerator
+
+
+def _normalized_difference(first, second, out, scratch):
+    # ee.Image.normalizedDifference: masked where either input is negative
+    np.subtract(first, second, out=scratch['a'], dtype=np.float64)
+    np.add(first, second, out=scratch['b'], dtype=np.float64)
+    _divide(scratch['a'], scratch['b'], out, scratch)
+    np.less(first, 0, out=scratch['flag'])
+    np.less(second, 0, out=scratch['flag2'])
+    scratch['flag'] |= scratch['flag2']
+    out[scratch['flag']] = np.nan
+
+
+def compute_indices(blue, green, red, nir, swir, out=None, scratch=None):
+    # NDVI, NDMI, BSI and SOCI of one block of band values (any numeric dtype) into out[0:4]
+    shape = np.shape(blue)
+    out = np.empty((len(INDEX_BANDS),) + shape, dtype=np.float32) if out is None else out
+    scratch = _scratch(shape) if scratch is None else scratch
+    ndvi, ndmi, bsi, soci = out
+
+    _normalized_difference(nir, red, ndvi, scratch)
+    _normalized_difference(nir, swir, ndmi, scratch)
+
+    # BSI with c = SWIR + RED and b = NIR + BLUE
+    np.add(swir, red, out=scratch['c'], dtype=np.float64)
+    np.add(nir, blue, out=scratch['b'], dtype=np.float64)
+    np.subtract(scratch['c'], scratch['b'], out=scratch['a'])
+    scratch['c'] += scratch['b']
+    _divide(scratch['a'], scratch['c'], bsi, scratch)
+
+    np.multiply(green, red, out=scratch['b'], dtype=np.float64)
+    np.copyto(scratch['a'], blue)
+    _divide(scratch['a'], scratch['b'], soci, scratch)
+    return out
+
+
+def process_scene(bands, sensor='landsat', cloud_mask='clouds', out=None, block_rows=DEFAULT_BLOCK_ROWS):
+    # bands: Earth Engine band name -> 2D array (memmaps are read one block at a time). Returns the
+    # (4, rows, cols) float32 indices with cloud-masked pixels set to NaN; cloud_mask=None skips masking.
+    names = SENSOR_BANDS[sensor]
+    first = bands[names['blue']]
+    rows, cols = first.shape
+    if out is None:
+        out = np.empty((len(INDEX_BANDS), rows, cols), dtype=np.float32)
+    elif out.shape != (len(INDEX_BANDS), rows, cols) or out.dtype != np.float32:
+        raise ValueError(f"Output must be float32 with shape {(len(INDEX_BANDS), rows, cols)}, "
+                         f"got {out.dtype} {out.shape}")
+
+    buffers = _scratch((min(block_rows, rows), cols))
+    clear = np.empty((min(block_rows, rows), cols), dtype=bool)
+    for start in range(0, rows, block_rows):
+        block = slice(start, min(start + block_rows, rows))
+        n = block.stop - block.start
+        block_out = out[:, block]
+        # The last block may be shorter and uses the leading rows of the buffers
+        compute_indices(*(bands[names[band]][block] for band in ('blue', 'green', 'red', 'nir', 'swir')),
+                        out=block_out, scratch={name: buffer[:n] for name, buffer in buffers.items()})
+        if cloud_mask is not None:
+            mask_values = bands[MASK_BANDS[sensor]][block]
+            if sensor == 'landsat':
+                landsat_clear_mask(mask_values, cloud_mask, out=clear[:n])
+            else:
+                sentinel2_clear_mask(mask_values, out=clear[:n])
+            block_out[:, ~clear[:n]] = np.nan
+    return out
+
+
+class IndexComposite:
+    # Per-pixel mean of the unmasked index values of several scenes, like ImageCollection.mean() on the
+    # quarterly collection; sums in float64, the mean as float32 with NaN where no scene had a value
+
+    def __init__(self, rows, cols):
+        self.sum = np.zeros((len(INDEX_BANDS), rows, cols))
+        self.count = np.zeros((len(INDEX_BANDS), rows, cols), dtype=np.int32)
+
+    def add(self, indices):
+        valid = ~np.isnan(indices)
+        np.add(self.sum, indices, out=self.sum, where=valid)
+        self.count += valid
+
+    def mean(self, out=None):
+        out = np.empty(self.sum.shape, dtype=np.float32) if out is None else out
+        with np.errstate(invalid='ignore', divide='ignore'):
+            np.divide(self.sum, self.count, out=out, casting='same_kind')
+        out[self.count == 0] = np.nan
+        return out
+
+
+def load_scene(directory, sensor='landsat'):
+    # Memory-mapped <band>.npy files of a scene directory
+    names = list(SENSOR_BANDS[sensor].values()) + [MASK_BANDS[sensor]]
+    missing = [name for name in names if not os.path.exists(os.path.join(directory, f'{name}.npy'))]
+    if missing:
+        raise FileNotFoundError(f"Scene {directory} is missing bands {missing}")
+    return {name: np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r') for name in names}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Cloud-mask a scene and compute NDVI, NDMI, BSI and SOCI locally.")
+    parser.add_argument('scene', help="Directory with one <band>.npy per Earth Engine band")
+    parser.add_argument('output', help="Output .npy (float32, 4 x rows x cols, written block by block)")
+    parser.add_argument('--sensor', choices=list(SENSOR_BANDS), default='landsat')
+    parser.add_argument('--cloud-mask', choices=['clouds', 'clouds_and_shadows', 'none'], default='clouds',
+                        help="Landsat QA_PIXEL mask (Sentinel-2 always uses SCL unless 'none')")
+    parser.add_argument('--block-rows', type=int, default=DEFAULT_BLOCK_ROWS)
+    args = parser.parse_args(argv)
+
+    bands = load_scene(args.scene, args.sensor)
+    rows, cols = bands[SENSOR_BANDS[args.sensor]['blue']].shape
+    out = np.lib.format.open_memmap(args.output, mode='w+', dtype=np.float32, shape=(len(INDEX_BANDS), rows, cols))
+    process_scene(bands, args.sensor, None if args.cloud_mask == 'none' else args.cloud_mask, out, args.block_rows)
+    out.flush()
+    valid = np.count_nonzero(~np.isnan(out[0]))
+    print(f"Computed {', '.join(INDEX_BANDS)} for {rows}x{cols} pixels ({valid} unmasked) into {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,257 @@
+# Lightweight latency and counter metrics for the prediction path
+#
+# Stages are timed with spans:
+#
+#     with metrics.span('model_load'):
+#         model = load_model()
+#
+# Each span adds its duration to the soc_stage_duration_seconds histogram of its stage. Counters track
+# remote calls and cache lookups, and everything can be rendered in the Prometheus text format
+# (prometheus_text(), or serve() for a /metrics endpoint). begin_trace()/end_trace() additionally collect
+# the spans of one script run in the current thread, which the app shows in its diagnostics panel.
+#
+# Metrics are off unless SOC_METRICS=1 is set or enable() is called. When off, span() returns a shared
+# no-op context manager and increment()/observe() return immediately, so the instrumentation can stay in
+# the hot paths.
+
+import functools
+import os
+import threading
+import time
+
+# Upper bounds in seconds, from a cached dictionary lookup up to a slow Earth Engine round trip
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+STAGE_HISTOGRAM = 'soc_stage_duration_seconds'
+REMOTE_CALLS = 'soc_remote_calls_total'
+CACHE_LOOKUPS = 'soc_cache_lookups_total'
+
+_HELP = {
+    STAGE_HISTOGRAM: 'Time spent per prediction path stage',
+    REMOTE_CALLS: 'Remote (Earth Engine) calls by call and outcome',
+    CACHE_LOOKUPS: 'Cache lookups by cache and result',
+}
+
+_enabled = os.environ.get('SOC_METRICS', '').lower() in ('1', 'true', 'yes')
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+_local = threading.local()
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ('stage', 'start')
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        trace = getattr(_local, 'trace', None)
+        if trace is not None:
+            _local.depth += 1
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        duration = time.perf_counter() - self.start
+        observe(STAGE_HISTOGRAM, duration, stage=self.stage)
+        trace = getattr(_local, 'trace', None)
+        if trace is not None:
+            _local.depth -= 1
+            trace.append({'stage': self.stage, 'depth': _local.depth, 'seconds': duration,
+                          'error': exc_info[0] is not None})
+        return False
+
+
+def enable(on=True):
+    global _enabled
+    _enabled = on
+
+
+def is_enabled():
+    return _enabled
+
+
+def span(stage):
+    return _Span(stage) if _enabled else _NULL_SPAN
+
+
+def timed(stage):
+    # Decorator form of span()
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def increment(name, value=1, **labels):
+    if not _enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, value, **labels):
+    if not _enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = {'buckets': [0] * len(DEFAULT_BUCKETS), 'count': 0, 'sum': 0.0}
+        for i, bound in enumerate(DEFAULT_BUCKETS):
+            if value <= bound:
+                histogram['buckets'][i] += 1
+                break
+        histogram['count'] += 1
+        histogram['sum'] += value
+
+
+def record_remote_call(call, status):
+    increment(REMOTE_CALLS, call=call, status=status)
+
+
+def record_cache_lookup(cache, hit):
+    increment(CACHE_LOOKUPS, cache=cache, result='hit' if hit else 'miss')
+
+
+def begin_trace():
+    # Start collecting the spans of the current thread (nested spans are recorded with their depth)
+    _local.trace = []
+    _local.depth = 0
+
+
+def end_trace():
+    # Stop collecting and return the spans in completion order
+    trace = getattr(_local, 'trace', None)
+    _local.trace = None
+    return trace or []
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+def snapshot():
+    # Plain-dict view for display: per-stage count/total/mean, counters and cache hit ratios
+    with _lock:
+        counters = dict(_counters)
+        histograms = {key: {**value, 'buckets': list(value['buckets'])} for key, value in _histograms.items()}
+
+    stages = {}
+    for (name, labels), histogram in histograms.items():
+        if name == STAGE_HISTOGRAM:
+            stage = dict(labels)['stage']
+            stages[stage] = {
+                'count': histogram['count'],
+                'total_s': histogram['sum'],
+                'mean_s': histogram['sum'] / histogram['count'],
+            }
+
+    lookups = {}
+    for (name, labels), value in counters.items():
+        if name == CACHE_LOOKUPS:
+            labels = dict(labels)
+            lookups.setdefault(labels['cache'], {'hit': 0, 'miss': 0})[labels['result']] += value
+    cache_hit_ratio = {cache: counts['hit'] / (counts['hit'] + counts['miss']) for cache, counts in lookups.items()}
+
+    return {
+        'stages': stages,
+        'counters': [
+            {'name': name, **dict(labels), 'value': value} for (name, labels), value in sorted(counters.items())
+        ],
+        'cache_hit_ratio': cache_hit_ratio,
+    }
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + '}'
+
+
+def prometheus_text():
+    # Counters, histograms and a derived soc_cache_hit_ratio gauge in the text exposition format
+    with _lock:
+        counters = sorted(_counters.items())
+        histograms = sorted((key, {**value, 'buckets': list(value['buckets'])}) for key, value in _histograms.items())
+
+    lines = []
+    seen = set()
+
+    def header(name, kind):
+        if name not in seen:
+            seen.add(name)
+            if name in _HELP:
+                lines.append(f'# HELP {name} {_HELP[name]}')
+            lines.append(f'# TYPE {name} {kind}')
+
+    for (name, labels), value in counters:
+        header(name, 'counter')
+        lines.append(f'{name}{_format_labels(labels)} {value}')
+
+    for (name, labels), histogram in histograms:
+        header(name, 'histogram')
+        cumulative = 0
+        for bound, count in zip(DEFAULT_BUCKETS, histogram['buckets']):
+            cumulative += count
+            lines.append(f'{name}_bucket{_format_labels(labels, [("le", bound)])} {cumulative}')
+        lines.append(f'{name}_bucket{_format_labels(labels, [("le", "+Inf")])} {histogram["count"]}')
+        lines.append(f'{name}_sum{_format_labels(labels)} {histogram["sum"]}')
+        lines.append(f'{name}_count{_format_labels(labels)} {histogram["count"]}')
+
+    ratios = snapshot()['cache_hit_ratio']
+    if ratios:
+        lines.append('# HELP soc_cache_hit_ratio Share of cache lookups that were hits')
+        lines.append('# TYPE soc_cache_hit_ratio gauge')
+        for cache, ratio in sorted(ratios.items()):
+            lines.append(f'soc_cache_hit_ratio{_format_labels([("cache", cache)])} {ratio}')
+    return '\n'.join(lines) + '\n'
+
+
+def serve(port=9464, host='127.0.0.1'):
+    # Serve prometheus_text() on http://host:port/metrics from a daemon thread; returns the server
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = prometheus_text().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,326 @@
+# Versioned model bundle: the flattened tree ensemble, the feature column order, the land cover
+# categories and the vegetation encodings in one directory that loads without unpickling
+#
+# Layout of the bundle directory:
+#   manifest.json             format version, feature columns, categories, defaults and the dtype and
+#                             shape of every array
+#   trees/<name>.npy          flattened tree arrays (see tree_engine.flatten_booster), memory-mapped
+#   vegetation_types.npy      vegetation type names (fixed-width unicode)
+#   vegetation_freq.npy       frequency encoding per vegetation type (float64)
+#   vegetation_mean.npy       target encoding per vegetation type (float64)
+# The manifest is written last, so a bundle without one is incomplete. Loading checks the format
+# version, the array dtypes and shapes and that the feature columns are exactly the ones the encoder
+# produces, so a bundle that does not fit the code fails at load instead of predicting garbage.
+#
+# FeatureEncoder resolves every feature column to its output position once, so raw rows go straight into
+# the model's float64 feature matrix without building a DataFrame or reordering columns. ModelBundle has
+# predict() and feature_name_ like the model and additionally encode(), so predict_frame() uses the
+# encoder whenever it is given a bundle.
+#
+# Usage (from the repository root):
+#   python streamlit/model_bundle.py export    # from ml_model/tuned_lightgbm_model.npz and the .npy encodings
+#   python streamlit/model_bundle.py verify    # compare with the separate files and time loading
+
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from tree_engine import ENGINE_PATH, TreeEnsemble
+
+BUNDLE_PATH = "ml_model/soc_model_bundle"
+FORMAT_VERSION = 1
+MANIFEST_FILE = "manifest.json"
+
+NUMERIC_COLUMNS = ["lat", "long", "elevation", "sand", "silt", "clay"]
+INDEX_COLUMNS = ["NDVI_mean", "NDMI_mean", "BSI_mean", "SOCI_mean"]
+VEGETATION_FREQ_COLUMN = "main_vegetation_type_freq_encoded"
+VEGETATION_MEAN_COLUMN = "main_vegetation_type_target_encoded"
+LAND_COVER_PREFIX = "land_cover_type_"
+REQUIRED_COLUMNS = NUMERIC_COLUMNS + ["land_cover_type", "main_vegetation_type"]
+
+# Tree arrays and their dtypes; feature_names is kept in the manifest as the feature column order
+TREE_ARRAYS = {
+    "feature": "int32",
+    "threshold": "float64",
+    "left": "int32",
+    "right": "int32",
+    "default_left": "bool",
+    "missing_type": "int8",
+    "leaf_value": "float64",
+    "roots": "int32",
+}
+
+
+class FeatureEncoder:
+    def __init__(self, feature_columns, land_cover_types, vegetation_types, vegetation_freq, vegetation_mean,
+                 index_defaults):
+        self.feature_columns = list(feature_columns)
+        self.land_cover_types = list(land_cover_types)
+        self.index_defaults = dict(index_defaults)
+        position = {column: i for i, column in enumerate(self.feature_columns)}
+        self._numeric = [(position[column], column) for column in NUMERIC_COLUMNS]
+        self._index = [(position[column], column, self.index_defaults[column]) for column in INDEX_COLUMNS]
+        self._freq_position = position[VEGETATION_FREQ_COLUMN]
+        self._mean_position = position[VEGETATION_MEAN_COLUMN]
+        self._land_cover_positions = np.array([position[LAND_COVER_PREFIX + t] for t in self.land_cover_types])
+        self._land_cover_index = pd.Index(self.land_cover_types)
+        self._vegetation_index = pd.Index([str(t) for t in vegetation_types])
+        # One extra slot for unknown types, which encode as 0 like the app
+        self._vegetation_freq = np.append(np.asarray(vegetation_freq, dtype=np.float64), 0.0)
+        self._vegetation_mean = np.append(np.asarray(vegetation_mean, dtype=np.float64), 0.0)
+        # Single records use plain dicts, which is faster than pandas for one row
+        self._land_cover_position = dict(zip(self.land_cover_types, self._land_cover_positions.tolist()))
+        self._vegetation_values = {t: (f, m) for t, f, m in zip(self._vegetation_index, self._vegetation_freq.tolist(),
+                                                               self._vegetation_mean.tolist())}
+
+    def encode(self, df):
+        # (rows, features) float64 matrix in the model's column order; same values as build_feature_frame
+        if "long" not in df.columns and "lon" in df.columns:
+            df = df.rename(columns={"lon": "long"})
+        missing = [col for col in REQUIRED_COLUMNS if col not in df.columns]
+        if missing:
+            raise ValueError(f"Input is missing required columns: {missing}")
+
+        X = np.zeros((len(df), len(self.feature_columns)))
+        for position, column in self._numeric:
+            X[:, position] = _numeric_values(df[column])
+        for position, column, default in self._index:
+            X[:, position] = _numeric_values(df[column]) if column in df.columns else default
+
+        self.encode_vegetation(X, df["main_vegetation_type"])
+
+        codes = self._land_cover_index.get_indexer(df["land_cover_type"].astype(str))
+        known = codes >= 0
+        X[np.flatnonzero(known), self._land_cover_positions[codes[known]]] = 1.0
+        return X
+
+    def encode_vegetation(self, X, vegetation):
+        # Writes the vegetation frequency and target encoding columns of X in place
+        codes = self._vegetation_index.get_indexer(pd.Series(vegetation).astype(str))
+        X[:, self._freq_position] = self._vegetation_freq[codes]
+        X[:, self._mean_position] = self._vegetation_mean[codes]
+
+    def encode_vegetation_record(self, row, vegetation_type):
+        # Same for a single (1, features) row
+        row[0, self._freq_position], row[0, self._mean_position] = self._vegetation_values.get(
+            str(vegetation_type), (0.0, 0.0))
+
+    def encode_record(self, record):
+        # One (1, features) row from a dict of raw inputs, for single-location predictions
+        if "long" not in record and "lon" in record:
+            record = {**record, "long": record["lon"]}
+        missing = [col for col in REQUIRED_COLUMNS if col not in record]
+        if missing:
+            raise ValueError(f"Input is missing required columns: {missing}")
+
+        row = [0.0] * len(self.feature_columns)
+        for position, column in self._numeric:
+            row[position] = _to_float(record[column])
+        for position, column, default in self._index:
+            row[position] = _to_float(record[column]) if column in record else default
+        row[self._freq_position], row[self._mean_position] = self._vegetation_values.get(
+            str(record["main_vegetation_type"]), (0.0, 0.0))
+        position = self._land_cover_position.get(str(record["land_cover_type"]))
+        if position is not None:
+            row[position] = 1.0
+        return np.array([row])
+
+
+def _numeric_values(series):
+    # Numeric columns are used as they are, anything else is parsed with unparseable values as NaN
+    values = series.to_numpy()
+    if values.dtype.kind in "biuf":
+        return values
+    return pd.to_numeric(series, errors="coerce").to_numpy(dtype=np.float64)
+
+
+def _to_float(value):
+    try:
+        return float(value) if value is not None else np.nan
+    except (TypeError, ValueError):
+        return np.nan
+
+
+class ModelBundle:
+    def __init__(self, path, manifest, engine, encoder, vegetation_types, vegetation_freq, vegetation_mean):
+        self.path = path
+        self.manifest = manifest
+        self.engine = engine
+        self.encoder = encoder
+        self.feature_name_ = engine.feature_name_
+        self.n_features_in_ = engine.n_features_in_
+        self.land_cover_types = encoder.land_cover_types
+        self.vegetation_types = [str(t) for t in vegetation_types]
+        # Dict views for code that still expects the separate encodings
+        self.freq_encoding = dict(zip(self.vegetation_types, vegetation_freq.tolist()))
+        self.mean_encoding = dict(zip(self.vegetation_types, vegetation_mean.tolist()))
+
+    @classmethod
+    def load(cls, path=BUNDLE_PATH, mmap=True):
+        manifest_path = os.path.join(path, MANIFEST_FILE)
+        if not os.path.exists(manifest_path):
+            raise FileNotFoundError(f"No model bundle at {path} (missing {MANIFEST_FILE})")
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if manifest.get("format_version") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported model bundle format {manifest.get('format_version')} in {path}, "
+                             f"expected {FORMAT_VERSION}")
+
+        arrays = {}
+        for name, spec in manifest["arrays"].items():
+            array = np.load(os.path.join(path, spec["file"]), mmap_mode="r" if mmap else None, allow_pickle=False)
+            if array.dtype.str != spec["dtype"] or list(array.shape) != spec["shape"]:
+                raise ValueError(f"Model bundle array {name} is {array.dtype.str} {list(array.shape)}, manifest says "
+                                 f"{spec['dtype']} {spec['shape']}")
+            arrays[name] = array
+        _validate(manifest, arrays)
+
+        feature_columns = manifest["feature_columns"]
+        engine = TreeEnsemble(**{name: arrays[name] for name in TREE_ARRAYS}, feature_names=np.array(feature_columns))
+        encoder = FeatureEncoder(feature_columns, manifest["land_cover_types"], arrays["vegetation_types"],
+                                 arrays["vegetation_freq"], arrays["vegetation_mean"], manifest["index_defaults"])
+        return cls(path, manifest, engine, encoder, arrays["vegetation_types"], arrays["vegetation_freq"],
+                   arrays["vegetation_mean"])
+
+    def encode(self, df):
+        return self.encoder.encode(df)
+
+    def predict(self, X):
+        return self.engine.predict(X)
+
+    def predict_records(self, records):
+        # Raw input dicts straight to predictions
+        if len(records) == 1:
+            return self.engine.predict(self.encoder.encode_record(records[0]))
+        return self.engine.predict(self.encoder.encode(pd.DataFrame.from_records(records)))
+
+
+def _validate(manifest, arrays):
+    # The feature columns must be exactly what FeatureEncoder produces and the trees must fit them
+    columns = manifest["feature_columns"]
+    land_cover_types = manifest["land_cover_types"]
+    expected = set(NUMERIC_COLUMNS + INDEX_COLUMNS + [VEGETATION_FREQ_COLUMN, VEGETATION_MEAN_COLUMN]
+                   + [LAND_COVER_PREFIX + t for t in land_cover_types])
+    if len(columns) != len(set(columns)) or set(columns) != expected:
+        raise ValueError(f"Model bundle feature columns {columns} do not match the encoder's columns "
+                         f"{sorted(expected)}")
+    if set(manifest["index_defaults"]) != set(INDEX_COLUMNS):
+        raise ValueError(f"Model bundle index defaults must cover {INDEX_COLUMNS}")
+
+    n_internal, n_leaves = len(arrays["feature"]), len(arrays["leaf_value"])
+    for name in ("threshold", "left", "right", "default_left", "missing_type"):
+        if len(arrays[name]) != n_internal:
+            raise ValueError(f"Model bundle tree array {name} has {len(arrays[name])} entries, expected {n_internal}")
+    if n_internal and (arrays["feature"].min() < 0 or arrays["feature"].max() >= len(columns)):
+        raise ValueError("Model bundle trees split on features outside the feature columns")
+    for name in ("left", "right", "roots"):
+        child = np.asarray(arrays[name])
+        if child.size and (child.max() >= n_internal or (~child[child < 0]).max(initial=-1) >= n_leaves):
+            raise ValueError(f"Model bundle tree array {name} points outside the tree")
+
+    n_types = len(arrays["vegetation_types"])
+    if len(arrays["vegetation_freq"]) != n_types or len(arrays["vegetation_mean"]) != n_types:
+        raise ValueError("Model bundle vegetation encodings do not match the vegetation types")
+
+
+def _save_array(path, name, array):
+    array = np.ascontiguousarray(array)
+    np.save(os.path.join(path, name), array, allow_pickle=False)
+    return {"file": name, "dtype": array.dtype.str, "shape": list(array.shape)}
+
+
+def export_bundle(tree_arrays, freq_encoding, mean_encoding, land_cover_types, index_defaults, path=BUNDLE_PATH,
+                  metadata=None):
+    # tree_arrays as returned by tree_engine.flatten_booster (or read from an exported .npz)
+    os.makedirs(os.path.join(path, "trees"), exist_ok=True)
+    manifest_path = os.path.join(path, MANIFEST_FILE)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+    arrays = {}
+    for name, dtype in TREE_ARRAYS.items():
+        arrays[name] = _save_array(path, f"trees/{name}.npy", np.asarray(tree_arrays[name], dtype=dtype))
+    vegetation_types = list(freq_encoding)
+    arrays["vegetation_types"] = _save_array(path, "vegetation_types.npy",
+                                             np.array([str(t) for t in vegetation_types]))
+    arrays["vegetation_freq"] = _save_array(
+        path, "vegetation_freq.npy", np.array([freq_encoding[t] for t in vegetation_types], dtype=np.float64))
+    arrays["vegetation_mean"] = _save_array(
+        path, "vegetation_mean.npy", np.array([mean_encoding.get(t, 0.0) for t in vegetation_types], dtype=np.float64))
+
+    manifest = {
+        "format_version": FORMAT_VERSION,
+        "feature_columns": [str(name) for name in tree_arrays["feature_names"]],
+        "land_cover_types": list(land_cover_types),
+        "index_defaults": dict(index_defaults),
+        "arrays": arrays,
+        "metadata": metadata or {},
+    }
+    loaded = {name: np.load(os.path.join(path, spec["file"]), allow_pickle=False) for name, spec in arrays.items()}
+    _validate(manifest, loaded)
+
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path)
+    return path
+
+
+def main(argv=None):
+    from batch_predict import (DEFAULT_INDEX_STATS, FREQ_ENCODING_PATH, LAND_COVER_TYPES, MEAN_ENCODING_PATH,
+                               build_feature_frame, load_encodings)
+
+    parser = argparse.ArgumentParser(description="Export or verify the versioned model bundle.")
+    parser.add_argument("--bundle", default=BUNDLE_PATH)
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export", help="Write the bundle from the exported engine and the .npy encodings")
+    export.add_argument("--engine", default=ENGINE_PATH, help="Flattened .npz model from tree_engine.py")
+    export.add_argument("--freq-encoding", default=FREQ_ENCODING_PATH)
+    export.add_argument("--mean-encoding", default=MEAN_ENCODING_PATH)
+    verify = commands.add_parser("verify", help="Compare the bundle with the separate model and encoding files")
+    verify.add_argument("--engine", default=ENGINE_PATH)
+    verify.add_argument("--feature-table", default="ml_model/feature_table_fixed.csv")
+    args = parser.parse_args(argv)
+
+    if args.command == "export":
+        with np.load(args.engine, allow_pickle=False) as engine_arrays:
+            tree_arrays = {name: engine_arrays[name] for name in engine_arrays.files}
+        freq_encoding, mean_encoding = load_encodings(args.freq_encoding, args.mean_encoding)
+        export_bundle(tree_arrays, freq_encoding, mean_encoding, LAND_COVER_TYPES, DEFAULT_INDEX_STATS, args.bundle,
+                      metadata={"source": os.path.basename(args.engine)})
+        print(f"Exported {len(tree_arrays['roots'])} trees and {len(freq_encoding)} vegetation types to {args.bundle}")
+        return
+
+    import time
+
+    start = time.perf_counter()
+    bundle = ModelBundle.load(args.bundle)
+    print(f"Loaded {args.bundle} in {time.perf_counter() - start:.4f} seconds")
+
+    engine = TreeEnsemble.load(args.engine)
+    freq_encoding, mean_encoding = load_encodings()
+    df = pd.read_csv(args.feature_table)
+    expected = build_feature_frame(df, freq_encoding, mean_encoding, engine.feature_name_)
+    encoded = bundle.encode(df)
+    print(f"Max encoding difference over {len(df)} rows: {np.nanmax(np.abs(encoded - expected.to_numpy())):.3e}, "
+          f"NaN positions equal: {(np.isnan(encoded) == expected.isna().to_numpy()).all()}")
+    max_diff = np.abs(bundle.predict(encoded) - engine.predict(expected)).max()
+    print(f"Max prediction difference: {max_diff:.3e}")
+
+    record = df.iloc[0].to_dict()
+    single = df.iloc[:1]
+    for name, fn in (("build_feature_frame", lambda: build_feature_frame(single, freq_encoding, mean_encoding,
+                                                                          engine.feature_name_)),
+                     ("bundle.encode", lambda: bundle.encode(single)),
+                     ("bundle.encode_record", lambda: bundle.encoder.encode_record(record))):
+        start = time.perf_counter()
+        for _ in range(200):
+            fn()
+        print(f"{name:>22} 1 row: {(time.perf_counter() - start) / 200 * 1e6:.1f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+# Several soil properties predicted from one feature pass
+#
+# PROPERTIES registers one model bundle per soil property: the SOC model and the models trained by
+# ml_model/train_properties.py. All of them use the same inputs, so the location features (indices,
+# climate, elevation, soil texture) are fetched and encoded once and every model scores the same
+# feature matrix. Only the vegetation target encoding differs per property; those two columns are
+# rewritten from each bundle's own encoder. Bundles may order their columns differently as long as they
+# have the same set, which is checked at load.
+#
+# MultiTargetPredictor has encode() and predict() like ModelBundle, so batch_predict.predict_frame() and
+# iter_predictions() accept it and add one <property>_predicted column per property; predict() returns
+# a DataFrame with one column per property.
+#
+# Usage (from the repository root):
+#   python streamlit/multi_target.py                     # list the available properties
+#   python streamlit/multi_target.py locations.csv       # predict all of them for a table of locations
+
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from model_bundle import BUNDLE_PATH, MANIFEST_FILE, ModelBundle
+
+PROPERTY_BUNDLE_DIR = "ml_model/property_bundles"
+
+# The first entry is the primary model: its encoder builds the shared features and its categories are
+# the app's options. It is always loaded, the other properties only if their bundle exists.
+PROPERTIES = {
+    "soc_in_percent": {"bundle": BUNDLE_PATH, "label": "Soil organic carbon", "unit": "%"},
+    "ph_h2o": {"bundle": os.path.join(PROPERTY_BUNDLE_DIR, "ph_h2o"), "label": "pH (H2O)", "unit": ""},
+    "nitrogen_g_per_kg": {"bundle": os.path.join(PROPERTY_BUNDLE_DIR, "nitrogen_g_per_kg"),
+                          "label": "Total nitrogen", "unit": "g/kg"},
+}
+PRIMARY_PROPERTY = next(iter(PROPERTIES))
+
+
+def available_properties(properties=PROPERTIES, paths=None):
+    # {property: bundle directory} of the primary property and every other property with a bundle
+    paths = {name: (paths or {}).get(name, spec["bundle"]) for name, spec in properties.items()}
+    return {name: path for name, path in paths.items()
+            if name == PRIMARY_PROPERTY or os.path.exists(os.path.join(path, MANIFEST_FILE))}
+
+
+class MultiTargetPredictor:
+    def __init__(self, bundles, properties=PROPERTIES):
+        # bundles: {property: ModelBundle}, the first one provides the shared encoder
+        self.names = list(bundles)
+        self.bundles = bundles
+        self.properties = {name: properties.get(name, {"label": name, "unit": ""}) for name in self.names}
+        primary = bundles[self.names[0]]
+        self.encoder = primary.encoder
+        self.feature_name_ = primary.feature_name_
+        self.land_cover_types = primary.land_cover_types
+        self.vegetation_types = primary.vegetation_types
+        self.freq_encoding = primary.freq_encoding
+        self.mean_encoding = primary.mean_encoding
+
+        # Per model the columns of the shared matrix in the model's order, None if it is the same order
+        self._columns = []
+        position = {column: i for i, column in enumerate(self.feature_name_)}
+        for name, bundle in bundles.items():
+            if set(bundle.feature_name_) != set(self.feature_name_):
+                raise ValueError(f"Model for {name} uses features {bundle.feature_name_}, "
+                                 f"expected the features of {self.names[0]}: {self.feature_name_}")
+            columns = np.array([position[column] for column in bundle.feature_name_])
+            self._columns.append(None if (columns == np.arange(len(columns))).all() else columns)
+
+    @classmethod
+    def load(cls, names=None, properties=PROPERTIES, paths=None):
+        # All available properties by default; explicitly requested ones must exist. paths overrides the
+        # bundle directory of single properties.
+        unknown = [name for name in names or [] if name not in properties]
+        if unknown:
+            raise ValueError(f"Unknown soil properties {unknown}, registered: {list(properties)}")
+        if names is None:
+            names = list(available_properties(properties, paths))
+        paths = {name: (paths or {}).get(name, properties[name]["bundle"]) for name in names}
+        return cls({name: ModelBundle.load(paths[name]) for name in names}, properties)
+
+    def _model_features(self, X, i):
+        # The shared matrix in model i's column order; a copy, since the vegetation columns get rewritten
+        return X.copy() if self._columns[i] is None else X[:, self._columns[i]]
+
+    def encode(self, df):
+        # One feature matrix per model, all built from a single encoding pass over the rows
+        X = self.encoder.encode(df)
+        vegetation = df["main_vegetation_type"]
+        features = [X]
+        for i, name in enumerate(self.names[1:], start=1):
+            model_X = self._model_features(X, i)
+            self.bundles[name].encoder.encode_vegetation(model_X, vegetation)
+            features.append(model_X)
+        return features
+
+    def predict(self, features):
+        # {property: predictions} as a DataFrame, one column per property
+        return pd.DataFrame({name: self.bundles[name].predict(X) for name, X in zip(self.names, features)})
+
+    def predict_record(self, record):
+        # {property: prediction} for one dict of raw inputs
+        row = self.encoder.encode_record(record)
+        predictions = {self.names[0]: float(self.bundles[self.names[0]].predict(row)[0])}
+        for i, name in enumerate(self.names[1:], start=1):
+            model_row = self._model_features(row, i)
+            self.bundles[name].encoder.encode_vegetation_record(model_row, record["main_vegetation_type"])
+            predictions[name] = float(self.bundles[name].predict(model_row)[0])
+        return predictions
+
+    def describe(self, name):
+        spec = self.properties[name]
+        return f"{spec['label']} ({spec['unit']})" if spec["unit"] else spec["label"]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Predict all registered soil properties for a table of locations.")
+    parser.add_argument("input", nargs="?", help="CSV with the batch_predict.py input columns")
+    parser.add_argument("--properties", nargs="+", help="Properties to predict (default: all available)")
+    args = parser.parse_args(argv)
+
+    predictor = MultiTargetPredictor.load(args.properties)
+    if args.input is None:
+        for name in PROPERTIES:
+            state = "loaded" if name in predictor.names else "no bundle"
+            print(f"{name:>20}  {PROPERTIES[name]['bundle']}  ({state})")
+        return
+    df = pd.read_csv(args.input)
+    predictions = predictor.predict(predictor.encode(df))
+    coordinates = df[[column for column in ("lat", "long", "lon") if column in df.columns]].reset_index(drop=True)
+    print(pd.concat([coordinates, predictions], axis=1).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
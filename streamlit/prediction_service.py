@@ -0,0 +1,488 @@
+# Headless HTTP prediction service around the app's model and encodings
+#
+#   POST /predict        one JSON location -> {"soc_in_percent_predicted": ...}
+#   POST /predict/bulk   NDJSON, one location per line -> NDJSON, the input rows with the prediction added
+#   GET  /health, GET /metrics (Prometheus text, see metrics.py)
+#
+# Locations take the batch_predict.py input columns ('lon' is accepted for 'long'). Missing sand/silt/clay
+# are filled from the SoilGrids polygons, missing index means are fetched through a gee_backend backend
+# (--backend earthengine|fake) or set to the app's placeholder values (--backend none).
+#
+# Requests that arrive within --max-wait seconds of each other are coalesced by a MicroBatcher into one
+# vectorized predict call, and concurrent fetches for the same coordinates share one backend request.
+# The batcher queue is bounded in rows and so is the number of requests being handled; beyond either
+# limit the service answers 503 with Retry-After instead of queueing without bound.
+#
+# Usage (from the repository root):
+#   python streamlit/prediction_service.py --port 8080
+#   python streamlit/prediction_service.py --backend fake --fake-latency 0.2    # fully local, for load tests
+#   python streamlit/prediction_service.py --replay cassette.sqlite --replay-latency recorded
+#   curl -d '{"lat": 52.1, "long": 10.5, "elevation": 80, "land_cover_type": "Cropland",
+#             "main_vegetation_type": "Common wheat"}' localhost:8080/predict
+
+import argparse
+import collections
+import json
+import math
+import threading
+import time
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+import metrics
+from batch_predict import BUNDLE_PATH, DEFAULT_INDEX_STATS, INDEX_COLUMNS, load_model, model_encodings, predict_frame
+from cassette_backend import add_cassette_arguments, cassette_backend
+from soil_lookup import SOILGRIDS_CSV, SoilLookup, fill_soil_texture
+
+DEFAULT_MAX_BATCH_ROWS = 4096
+DEFAULT_MAX_WAIT = 0.005
+DEFAULT_MAX_PENDING_ROWS = 50_000
+DEFAULT_MAX_CONCURRENT_REQUESTS = 64
+DEFAULT_MAX_CONCURRENT_FETCHES = 8
+DEFAULT_REQUEST_TIMEOUT = 60
+MAX_BODY_BYTES = 64 * 1024 * 1024
+RETRY_AFTER_SECONDS = 1
+# Coordinates are rounded to this many decimals (~0.1 m) to find requests for the same location
+LOCATION_DECIMALS = 6
+# Inputs that must always be finite JSON numbers
+REQUIRED_NUMBER_FIELDS = ['lat', 'long', 'elevation']
+# Inputs that must be finite JSON numbers when given (null means missing: texture and index means are filled)
+NUMBER_FIELDS = ['sand', 'silt', 'clay'] + INDEX_COLUMNS
+# Columns the service adds or fills in; everything else in a bulk row is returned as it was sent
+COMPUTED_COLUMNS = ['sand', 'silt', 'clay'] + INDEX_COLUMNS + ['soc_in_percent_predicted']
+
+
+class Overloaded(Exception):
+    pass
+
+
+class MicroBatcher:
+    # Collects submitted frames for up to max_wait seconds (or until max_batch_rows are queued) and scores
+    # them with one predict(frame) call on a worker thread. submit() raises Overloaded when more than
+    # max_pending_rows would be queued or in flight.
+
+    def __init__(self, predict, max_batch_rows=DEFAULT_MAX_BATCH_ROWS, max_wait=DEFAULT_MAX_WAIT,
+                 max_pending_rows=DEFAULT_MAX_PENDING_ROWS):
+        self.predict = predict
+        self.max_batch_rows = max_batch_rows
+        self.max_wait = max_wait
+        self.max_pending_rows = max_pending_rows
+        self._queue = collections.deque()
+        self._queued_rows = 0
+        self._pending_rows = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self.batches = 0
+        self.rows = 0
+        self._thread = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, frame):
+        future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Batcher is closed")
+            # A single frame larger than the limit is still accepted when nothing else is pending
+            if self._pending_rows and self._pending_rows + len(frame) > self.max_pending_rows:
+                metrics.increment('soc_service_rejected_total', reason='queue_full')
+                raise Overloaded(f"{self._pending_rows} rows pending")
+            self._queue.append((frame, future))
+            self._queued_rows += len(frame)
+            self._pending_rows += len(frame)
+            self._cond.notify()
+        return future
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._queue and not self._closed:
+                self._cond.wait()
+            if not self._queue:
+                return None
+            # The first request waits at most max_wait for others to join its batch
+            deadline = time.monotonic() + self.max_wait
+            while self._queued_rows < self.max_batch_rows and not self._closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            batch, rows = [], 0
+            while self._queue and (not batch or rows + len(self._queue[0][0]) <= self.max_batch_rows):
+                frame, future = self._queue.popleft()
+                batch.append((frame, future))
+                rows += len(frame)
+            self._queued_rows -= rows
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            frames = [frame for frame, _ in batch]
+            rows = sum(len(frame) for frame in frames)
+            try:
+                predictions = np.asarray(self.predict(pd.concat(frames, ignore_index=True)))
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+            else:
+                offsets = np.cumsum([0] + [len(frame) for frame in frames])
+                for (_, future), start, end in zip(batch, offsets[:-1], offsets[1:]):
+                    future.set_result(predictions[start:end])
+            finally:
+                with self._cond:
+                    self._pending_rows -= rows
+                self.batches += 1
+                self.rows += rows
+                metrics.increment('soc_service_batches_total')
+                metrics.increment('soc_service_batched_rows_total', rows)
+
+    def close(self):
+        # Scores everything already queued, then stops the worker
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+
+
+class SingleFlight:
+    # Concurrent do(key, fn) calls with the same key run fn once and all receive its result (or exception)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        if not leader:
+            metrics.increment('soc_service_coalesced_fetches_total')
+            return future.result()
+        try:
+            future.set_result(fn())
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                del self._calls[key]
+        return future.result()
+
+
+class IndexFetcher:
+    # Mean index values per location from a backend (via remote_features), deduplicated per location and
+    # optionally cached in a feature_cache.FeatureCache; without a backend, and for indices without any
+    # fetched quarter, the placeholder stats are used like in the app
+
+    def __init__(self, backend=None, feature_cache=None, max_concurrent=DEFAULT_MAX_CONCURRENT_FETCHES):
+        self.backend = backend
+        self.feature_cache = feature_cache
+        self._flight = SingleFlight()
+        self._pool = ThreadPoolExecutor(max_workers=max_concurrent) if backend is not None else None
+
+    def _fetch(self, lat, lon):
+        # (means, complete): complete is False if a quarter failed transiently, then the means are not cached
+        from remote_features import fetch_quarterly_simple_indices, has_transient_failures
+
+        df, stats = fetch_quarterly_simple_indices(lat, lon, self.backend)
+        means = {}
+        for column in INDEX_COLUMNS:
+            value = stats[column]
+            means[column] = DEFAULT_INDEX_STATS[column] if value is None or np.isnan(value) else float(value)
+        return means, not has_transient_failures(df)
+
+    def get(self, lat, lon):
+        if self.backend is None:
+            return dict(DEFAULT_INDEX_STATS)
+        key = (round(float(lat), LOCATION_DECIMALS), round(float(lon), LOCATION_DECIMALS))
+        if self.feature_cache is None:
+            return self._flight.do(key, lambda: self._fetch(*key))[0]
+        # 'index_means' entries of earlier versions held unfilled means, possibly of failed fetches
+        cache_key = self.feature_cache.make_key('index_means_filled', *key)
+        means, _ = self._flight.do(key, lambda: self.feature_cache.get_or_fetch(
+            cache_key, lambda: self._fetch(*key), cache_if=lambda result: result[1]))
+        return means
+
+    def fill(self, records):
+        # Fill missing index means in place, fetching the distinct locations in parallel. Plain dicts are
+        # used since building frames here would cost more than the rest of a single-point request.
+        missing = [record for record in records if any(record.get(column) is None for column in INDEX_COLUMNS)]
+        if not missing:
+            return records
+        locations = list(dict.fromkeys((record['lat'], record['long']) for record in missing))
+        if self._pool is None or len(locations) == 1:
+            results = [self.get(lat, lon) for lat, lon in locations]
+        else:
+            results = list(self._pool.map(lambda location: self.get(*location), locations))
+        fetched = dict(zip(locations, results))
+        for record in missing:
+            values = fetched[(record['lat'], record['long'])]
+            for column in INDEX_COLUMNS:
+                if record.get(column) is None:
+                    record[column] = values[column]
+        return records
+
+
+class PredictionService:
+    def __init__(self, model, freq_encoding, mean_encoding, soil_lookup=None, index_fetcher=None,
+                 max_batch_rows=DEFAULT_MAX_BATCH_ROWS, max_wait=DEFAULT_MAX_WAIT,
+                 max_pending_rows=DEFAULT_MAX_PENDING_ROWS, request_timeout=DEFAULT_REQUEST_TIMEOUT):
+        self.model = model
+        self.freq_encoding = freq_encoding
+        self.mean_encoding = mean_encoding
+        self.soil_lookup = soil_lookup
+        self.index_fetcher = index_fetcher or IndexFetcher()
+        self.request_timeout = request_timeout
+        self.batcher = MicroBatcher(self._predict_batch, max_batch_rows, max_wait, max_pending_rows)
+
+    def _predict_batch(self, df):
+        return predict_frame(self.model, df, self.freq_encoding, self.mean_encoding)
+
+    def prepare(self, records):
+        # Input records -> frame with everything the model needs; raises ValueError for unusable input
+        normalized = []
+        for record in records:
+            record = dict(record)
+            if 'long' not in record and 'lon' in record:
+                record['long'] = record.pop('lon')
+            for column in REQUIRED_NUMBER_FIELDS:
+                if record.get(column) is None:
+                    raise ValueError(f"Input is missing required column: {column}")
+                if not _is_number(record[column]):
+                    raise ValueError(f"{column} must be a finite number")
+                record[column] = float(record[column])
+            invalid = [column for column in NUMBER_FIELDS if record.get(column) is not None
+                       and not _is_number(record[column])]
+            if invalid:
+                raise ValueError(f"Expected a finite number (or null to have it filled in) for: {', '.join(invalid)}")
+            normalized.append(record)
+        with metrics.span('index_fetch'):
+            self.index_fetcher.fill(normalized)
+        df = pd.DataFrame.from_records(normalized)
+        if self.soil_lookup is not None:
+            with metrics.span('soil_lookup'):
+                df = fill_soil_texture(df, self.soil_lookup)
+        return df
+
+    def predict_records(self, records):
+        df = self.prepare(records)
+        if self.soil_lookup is None:
+            # Checked here so that one bad request does not fail the whole batch it would be scored in
+            missing = [column for column in ('sand', 'silt', 'clay') if column not in df.columns]
+            if missing:
+                raise ValueError(f"Input is missing required columns: {missing}")
+        for column in ('land_cover_type', 'main_vegetation_type'):
+            if column not in df.columns:
+                raise ValueError(f"Input is missing required column: {column}")
+        predictions = self.batcher.submit(df).result(self.request_timeout)
+        df['soc_in_percent_predicted'] = predictions
+        return df
+
+    def close(self):
+        self.batcher.close()
+
+
+def _json_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, pd.Timestamp):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def _is_number(value):
+    # Finite JSON numbers only: bool is an int subclass, strings and lists are rejected, and so are NaN,
+    # Infinity (which json.loads accepts) and integers too large for a float
+    if not isinstance(value, (int, float, np.integer, np.floating)) or isinstance(value, (bool, np.bool_)):
+        return False
+    try:
+        return math.isfinite(float(value))
+    except OverflowError:
+        return False
+
+
+def _response_records(records, df):
+    # The input rows as they were sent, with the prediction and the values the service filled in (NaN -> null)
+    computed = df[[column for column in COMPUTED_COLUMNS if column in df.columns]]
+    computed = computed.astype(object).where(computed.notna(), None).to_dict(orient='records')
+    responses = []
+    for record, values in zip(records, computed):
+        response = dict(record)
+        for column, value in values.items():
+            if column == 'soc_in_percent_predicted' or response.get(column) is None:
+                response[column] = value
+        responses.append(response)
+    return responses
+
+
+class PredictionHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def _send(self, status, body, content_type='application/json', headers=None):
+        body = body.encode() if isinstance(body, str) else body
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status, message, headers=None):
+        self._send(status, json.dumps({'error': message}), headers=headers)
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        if path == '/health':
+            self._send(200, json.dumps({'status': 'ok'}))
+        elif path == '/metrics':
+            self._send(200, metrics.prometheus_text(), 'text/plain; version=0.0.4; charset=utf-8')
+        else:
+            self._send_error(404, f"Unknown path {path}")
+
+    def do_POST(self):
+        path = self.path.split('?')[0]
+        if path not in ('/predict', '/predict/bulk'):
+            self._send_error(404, f"Unknown path {path}")
+            return
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_BODY_BYTES:
+            self.close_connection = True
+            self._send_error(413, f"Request body larger than {MAX_BODY_BYTES} bytes")
+            return
+        body = self.rfile.read(length)
+
+        if not self.server.request_slots.acquire(blocking=False):
+            metrics.increment('soc_service_rejected_total', reason='too_many_requests')
+            self._send_error(503, "Too many concurrent requests", {'Retry-After': str(RETRY_AFTER_SECONDS)})
+            return
+        try:
+            with metrics.span('service_request'):
+                self._handle(path, body)
+        finally:
+            self.server.request_slots.release()
+
+    def _handle(self, path, body):
+        service = self.server.service
+        try:
+            if path == '/predict':
+                record = json.loads(body)
+                if not isinstance(record, dict):
+                    raise ValueError("Expected a JSON object")
+                result = service.predict_records([record])
+                prediction = float(result['soc_in_percent_predicted'].iloc[0])
+                self._send(200, json.dumps({'soc_in_percent_predicted': prediction}))
+            else:
+                records = [json.loads(line) for line in body.decode().splitlines() if line.strip()]
+                if not records or not all(isinstance(record, dict) for record in records):
+                    raise ValueError("Expected one JSON object per line")
+                result = service.predict_records(records)
+                lines = (json.dumps(record, default=_json_default) for record in _response_records(records, result))
+                self._send(200, '\n'.join(lines) + '\n', 'application/x-ndjson')
+        except Overloaded as e:
+            self._send_error(503, f"Service overloaded: {e}", {'Retry-After': str(RETRY_AFTER_SECONDS)})
+        except TimeoutError:
+            self._send_error(504, "Prediction timed out")
+        except ValueError as e:
+            # json.JSONDecodeError is a ValueError too
+            self._send_error(400, str(e))
+        except Exception:
+            # Anything else is a bug; the client still gets a response instead of a closed connection
+            traceback.print_exc()
+            self._send_error(500, "Internal server error")
+
+
+class PredictionServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Listen backlog; the default of 5 resets connections under bursts of concurrent clients
+    request_queue_size = 128
+
+    def __init__(self, address, service, max_concurrent_requests=DEFAULT_MAX_CONCURRENT_REQUESTS, quiet=False):
+        super().__init__(address, PredictionHandler)
+        self.service = service
+        self.request_slots = threading.BoundedSemaphore(max_concurrent_requests)
+        self.quiet = quiet
+
+
+def make_backend(name, credentials_path=None, fake_latency=0.0):
+    if name == 'none':
+        return None
+    if name == 'fake':
+        from gee_backend import FakeBackend
+
+        return FakeBackend(latency=fake_latency)
+    from gee_backend import EarthEngineBackend
+    from resources import init_earth_engine
+
+    with open(credentials_path) as f:
+        init_earth_engine(f.read())
+    return EarthEngineBackend()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve SOC predictions over HTTP.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--model', default=BUNDLE_PATH,
+                        help="Model bundle directory, exported .npz model or pickled model")
+    parser.add_argument('--backend', choices=['none', 'fake', 'earthengine'], default='none',
+                        help="Where missing index means come from (none: the app's placeholder values)")
+    parser.add_argument('--credentials', help="Service account key JSON for --backend earthengine")
+    parser.add_argument('--fake-latency', type=float, default=0.0, help="Seconds per fake backend request")
+    parser.add_argument('--feature-cache', nargs='?', const='.cache/feature_cache.sqlite',
+                        help="Cache fetched index means in this SQLite file")
+    parser.add_argument('--no-soil-lookup', action='store_true', help="Require sand/silt/clay in every request")
+    parser.add_argument('--max-batch-rows', type=int, default=DEFAULT_MAX_BATCH_ROWS)
+    parser.add_argument('--max-wait', type=float, default=DEFAULT_MAX_WAIT,
+                        help="Seconds a request waits for others to join its batch")
+    parser.add_argument('--max-pending-rows', type=int, default=DEFAULT_MAX_PENDING_ROWS)
+    parser.add_argument('--max-concurrent-requests', type=int, default=DEFAULT_MAX_CONCURRENT_REQUESTS)
+    parser.add_argument('--quiet', action='store_true', help="Do not log every request")
+    add_cassette_arguments(parser)
+    args = parser.parse_args(argv)
+    if args.backend == 'earthengine' and not args.credentials and not args.replay:
+        parser.error("--backend earthengine needs --credentials")
+    if args.record and args.backend == 'none':
+        parser.error("--record needs --backend fake or earthengine")
+
+    metrics.enable()
+    feature_cache = None
+    if args.feature_cache:
+        from feature_cache import FeatureCache
+
+        feature_cache = FeatureCache(args.feature_cache)
+    model = load_model(args.model)
+    freq_encoding, mean_encoding = model_encodings(model)
+    service = PredictionService(
+        model, freq_encoding, mean_encoding,
+        soil_lookup=None if args.no_soil_lookup else SoilLookup.from_files(SOILGRIDS_CSV),
+        index_fetcher=IndexFetcher(
+            cassette_backend(args, lambda: make_backend(args.backend, args.credentials, args.fake_latency)),
+            feature_cache,
+        ),
+        max_batch_rows=args.max_batch_rows, max_wait=args.max_wait, max_pending_rows=args.max_pending_rows,
+    )
+    server = PredictionServer((args.host, args.port), service, args.max_concurrent_requests, args.quiet)
+    print(f"Serving predictions on http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+
+if __name__ == '__main__':
+    main()
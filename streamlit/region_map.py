@@ -0,0 +1,322 @@
+# Region-wide SOC maps on a regular grid, predicted tile by tile in worker processes
+#
+# The region (a lat/lon bounding box, optionally clipped to a GeoJSON polygon) is covered with square
+# cells of --resolution metres in UTM, aligned to multiples of the resolution like the SoilGrids 250 m
+# rasters. The grid is split into tiles; each worker process loads the model, the encodings and the
+# soil lookup once and then assembles the features of a whole tile and scores it in one predict call.
+#
+# Output (in the output directory):
+#   soc_map.npy        float32 (rows, cols), row 0 is the northern edge, NaN outside the region or where
+#                      features are missing; written through a memory map as tiles complete
+#   soc_map_flags.npy  uint8 (rows, cols), per predicted cell FLAG_PLACEHOLDER_INDICES and/or
+#                      FLAG_NO_SOIL_TEXTURE when those features were not available
+#   soc_map.json       grid georeference (EPSG code, origin, resolution), run parameters and finished tiles
+# Only the tiles in flight are held in memory. A re-run with the same parameters skips the tiles listed
+# in soc_map.json, so an interrupted run resumes where it stopped.
+#
+# The satellite index means are read from the precomputed feature grid (feature_grid.py build, bilinear
+# between cell centres). Cells the grid does not cover, or covers only with stale values, stay NaN unless
+# --placeholder-indices is given, which fills them with the app's placeholder values and flags them.
+# SoilGrids texture only covers a small part of Europe (about 0.06% of Germany), so cells without it are
+# predicted with the texture left missing and flagged; --require-soil leaves them NaN instead, which
+# leaves most of a map empty. Land cover and vegetation type are the same for the whole map, elevation is
+# a constant or read from a GeoTIFF (--elevation-raster, needs rasterio).
+#
+# Usage (from the repository root):
+#   python streamlit/region_map.py maps/germany --bbox 5.8 47.2 15.1 55.1 --resolution 250
+#   python streamlit/region_map.py maps/region --polygon region.geojson --land-cover-type Grassland
+
+import argparse
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+import pandas as pd
+
+from batch_predict import BUNDLE_PATH, DEFAULT_INDEX_STATS, load_model, model_encodings, predict_frame
+from feature_grid import DEFAULT_STORE as FEATURE_GRID_STORE, FeatureGrid
+from model_bundle import INDEX_COLUMNS
+from soil_lookup import SOILGRIDS_CSV, PolygonLayer, RasterLayer, SoilLookup, latlon_to_utm, utm_to_latlon
+
+MAP_FILE = 'soc_map.npy'
+FLAGS_FILE = 'soc_map_flags.npy'
+MANIFEST_FILE = 'soc_map.json'
+DEFAULT_RESOLUTION_M = 250
+DEFAULT_TILE_SIZE = 256
+DEFAULT_UTM_ZONE = 32
+DEFAULT_LAND_COVER_TYPE = 'Cropland'
+DEFAULT_VEGETATION_TYPE = 'Common wheat'
+DEFAULT_ELEVATION = 100.0
+FLAG_PLACEHOLDER_INDICES = 1
+FLAG_NO_SOIL_TEXTURE = 2
+
+
+def make_grid(bbox, resolution=DEFAULT_RESOLUTION_M, zone=DEFAULT_UTM_ZONE, tile_size=DEFAULT_TILE_SIZE):
+    # bbox is (min_lon, min_lat, max_lon, max_lat); the grid covers its projected extent
+    min_lon, min_lat, max_lon, max_lat = bbox
+    corner_lat = np.array([min_lat, min_lat, max_lat, max_lat])
+    corner_lon = np.array([min_lon, max_lon, min_lon, max_lon])
+    # The northern and southern edges bulge in UTM, so their midpoints are included as well
+    lat = np.concatenate([corner_lat, [min_lat, max_lat]])
+    lon = np.concatenate([corner_lon, [(min_lon + max_lon) / 2] * 2])
+    x, y = latlon_to_utm(lat, lon, zone)
+    origin_x = np.floor(x.min() / resolution) * resolution
+    origin_y = np.ceil(y.max() / resolution) * resolution
+    return {
+        'epsg': 32600 + zone,
+        'origin_x': float(origin_x),
+        'origin_y': float(origin_y),
+        'resolution': float(resolution),
+        'rows': int(np.ceil((origin_y - y.min()) / resolution)),
+        'cols': int(np.ceil((x.max() - origin_x) / resolution)),
+        'tile_size': int(tile_size),
+    }
+
+
+def tiles(grid):
+    size = grid['tile_size']
+    return [(row, col) for row in range(0, grid['rows'], size) for col in range(0, grid['cols'], size)]
+
+
+def cell_centers(grid, row, col):
+    # lat/lon of the cell centres of the tile starting at (row, col), shape (tile rows, tile cols)
+    size, resolution = grid['tile_size'], grid['resolution']
+    rows = np.arange(row, min(row + size, grid['rows']))
+    cols = np.arange(col, min(col + size, grid['cols']))
+    x = grid['origin_x'] + (cols + 0.5) * resolution
+    y = grid['origin_y'] - (rows + 0.5) * resolution
+    xx, yy = np.meshgrid(x, y)
+    return utm_to_latlon(xx, yy, grid['epsg'] - 32600)
+
+
+def load_region_polygon(path, zone=DEFAULT_UTM_ZONE):
+    # GeoJSON Polygon/MultiPolygon (or a Feature/FeatureCollection of them) as a PolygonLayer in UTM
+    with open(path) as f:
+        geojson = json.load(f)
+    features = geojson.get('features', [geojson])
+    geometries = [feature.get('geometry', feature) for feature in features]
+
+    edges, edge_offsets = [], [0]
+    for geometry in geometries:
+        polygons = [geometry['coordinates']] if geometry['type'] == 'Polygon' else geometry['coordinates']
+        for polygon in polygons:
+            for ring in polygon:
+                ring = np.asarray(ring, dtype=np.float64)
+                x, y = latlon_to_utm(ring[:, 1], ring[:, 0], zone)
+                edges.append(np.column_stack([x[:-1], y[:-1], x[1:], y[1:]]))
+            # All rings of a polygon form one entry, holes are handled by the even-odd rule
+            edge_offsets.append(edge_offsets[-1] + sum(len(ring) - 1 for ring in polygon))
+    properties = pd.DataFrame(index=range(len(edge_offsets) - 1))
+    return PolygonLayer(np.concatenate(edges), np.asarray(edge_offsets), properties, utm_zone=zone)
+
+
+_worker = {}
+
+
+def _init_worker(model_path, polygons_path, elevation_raster, region_polygon, zone, feature_grid):
+    # Loaded once per worker process and reused for all of its tiles
+    _worker['model'] = load_model(model_path)
+    _worker['encodings'] = model_encodings(_worker['model'])
+    _worker['soil_lookup'] = SoilLookup.from_files(polygons_path)
+    _worker['feature_grid'] = FeatureGrid.open(feature_grid) if feature_grid else None
+    _worker['elevation'] = RasterLayer(elevation_raster) if elevation_raster else None
+    _worker['region'] = load_region_polygon(region_polygon, zone) if region_polygon else None
+
+
+def predict_tile(grid, row, col, params):
+    lat, lon = cell_centers(grid, row, col)
+    shape = lat.shape
+    lat, lon = lat.ravel(), lon.ravel()
+    result = np.full(lat.size, np.nan, dtype=np.float32)
+    flags = np.zeros(lat.size, dtype=np.uint8)
+
+    inside = np.ones(lat.size, dtype=bool)
+    if _worker['region'] is not None:
+        inside = _worker['region'].locate(lat, lon) >= 0
+    features = pd.DataFrame({'lat': lat[inside], 'long': lon[inside]})
+    texture = _worker['soil_lookup'].soil_texture(features['lat'].to_numpy(), features['long'].to_numpy())
+    features[['sand', 'silt', 'clay']] = texture.to_numpy()
+    if _worker['elevation'] is not None:
+        features['elevation'] = _worker['elevation'].query(features['lat'].to_numpy(), features['long'].to_numpy())
+    else:
+        features['elevation'] = params['elevation']
+    if _worker['feature_grid'] is not None:
+        indices = _worker['feature_grid'].lookup_points(features['lat'].to_numpy(), features['long'].to_numpy(),
+                                                        INDEX_COLUMNS, bilinear=True)
+    else:
+        indices = np.full((len(features), len(INDEX_COLUMNS)), np.nan)
+    missing_indices = np.isnan(indices).any(axis=1)
+    if params['placeholder_indices']:
+        indices = np.where(np.isnan(indices), [DEFAULT_INDEX_STATS[column] for column in INDEX_COLUMNS], indices)
+    features[INDEX_COLUMNS] = indices
+    features['land_cover_type'] = params['land_cover_type']
+    features['main_vegetation_type'] = params['main_vegetation_type']
+
+    missing_texture = texture.isna().any(axis=1).to_numpy()
+    valid = ~missing_indices | params['placeholder_indices']
+    if params['require_soil']:
+        valid &= ~missing_texture
+    if valid.any():
+        freq_encoding, mean_encoding = _worker['encodings']
+        predictions = predict_frame(_worker['model'], features[valid], freq_encoding, mean_encoding)
+        scored = np.flatnonzero(inside)[valid]
+        result[scored] = predictions
+        flags[scored] = (FLAG_PLACEHOLDER_INDICES * missing_indices[valid]
+                         + FLAG_NO_SOIL_TEXTURE * missing_texture[valid])
+    return row, col, result.reshape(shape), flags.reshape(shape)
+
+
+def _write_manifest(path, manifest):
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def open_map(output_dir, grid, params):
+    # Returns (memory-mapped map, memory-mapped flags, manifest); an existing map is reused only if grid and
+    # parameters match
+    os.makedirs(output_dir, exist_ok=True)
+    map_path = os.path.join(output_dir, MAP_FILE)
+    flags_path = os.path.join(output_dir, FLAGS_FILE)
+    manifest_path = os.path.join(output_dir, MANIFEST_FILE)
+    if os.path.exists(manifest_path) and os.path.exists(map_path) and os.path.exists(flags_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if manifest['grid'] != grid or manifest['parameters'] != params:
+            raise ValueError(f"{output_dir} holds a map with a different grid or parameters, use another directory")
+        return np.load(map_path, mmap_mode='r+'), np.load(flags_path, mmap_mode='r+'), manifest
+
+    shape = (grid['rows'], grid['cols'])
+    soc_map = np.lib.format.open_memmap(map_path, mode='w+', dtype=np.float32, shape=shape)
+    soc_map[:] = np.nan
+    soc_map.flush()
+    flags = np.lib.format.open_memmap(flags_path, mode='w+', dtype=np.uint8, shape=shape)
+    flags.flush()
+    manifest = {'grid': grid, 'parameters': params, 'done_tiles': []}
+    _write_manifest(manifest_path, manifest)
+    return soc_map, flags, manifest
+
+
+def generate_map(output_dir, grid, params, workers=None, polygons_path=SOILGRIDS_CSV, log=print):
+    soc_map, flags, manifest = open_map(output_dir, grid, params)
+    manifest_path = os.path.join(output_dir, MANIFEST_FILE)
+    done = {tuple(tile) for tile in manifest['done_tiles']}
+    todo = [tile for tile in tiles(grid) if tile not in done]
+    log(f"{grid['rows']} x {grid['cols']} cells, {len(done)} of {len(done) + len(todo)} tiles already done")
+    if not todo:
+        return soc_map
+
+    workers = workers or os.cpu_count()
+    start = time.time()
+    initargs = (params['model'], polygons_path, params['elevation_raster'], params['polygon'], grid['epsg'] - 32600,
+                params['feature_grid'])
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=initargs) as pool:
+        # At most two tiles per worker are queued or in flight, so memory does not grow with the region
+        pending = set()
+        remaining = iter(todo)
+        while True:
+            for tile in remaining:
+                pending.add(pool.submit(predict_tile, grid, *tile, params))
+                if len(pending) >= 2 * workers:
+                    break
+            if not pending:
+                break
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                row, col, values, tile_flags = future.result()
+                soc_map[row:row + values.shape[0], col:col + values.shape[1]] = values
+                flags[row:row + values.shape[0], col:col + values.shape[1]] = tile_flags
+                soc_map.flush()
+                flags.flush()
+                # Recorded only after the tile is on disk
+                manifest['done_tiles'].append([row, col])
+                _write_manifest(manifest_path, manifest)
+            log(f"{len(manifest['done_tiles'])}/{len(done) + len(todo)} tiles ({time.time() - start:.1f} s)")
+    return soc_map
+
+
+def export_geotiff(output_dir, path):
+    # Writes the map as a single-band float32 GeoTIFF; needs rasterio
+    import rasterio
+    from rasterio.transform import from_origin
+
+    with open(os.path.join(output_dir, MANIFEST_FILE)) as f:
+        grid = json.load(f)['grid']
+    soc_map = np.load(os.path.join(output_dir, MAP_FILE), mmap_mode='r')
+    profile = {
+        'driver': 'GTiff', 'dtype': 'float32', 'count': 1, 'height': grid['rows'], 'width': grid['cols'],
+        'crs': f"EPSG:{grid['epsg']}", 'nodata': np.nan, 'tiled': True, 'compress': 'deflate',
+        'transform': from_origin(grid['origin_x'], grid['origin_y'], grid['resolution'], grid['resolution']),
+    }
+    with rasterio.open(path, 'w', **profile) as dataset:
+        for row in range(0, grid['rows'], grid['tile_size']):
+            block = np.asarray(soc_map[row:row + grid['tile_size']])
+            dataset.write(block, 1, window=((row, row + block.shape[0]), (0, grid['cols'])))
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Predict a SOC map for a region.")
+    parser.add_argument('output_dir', help="Directory for soc_map.npy and soc_map.json")
+    parser.add_argument('--bbox', nargs=4, type=float, metavar=('MIN_LON', 'MIN_LAT', 'MAX_LON', 'MAX_LAT'),
+                        help="Region bounding box (default: the bounds of --polygon)")
+    parser.add_argument('--polygon', help="GeoJSON polygon to clip the map to")
+    parser.add_argument('--resolution', type=float, default=DEFAULT_RESOLUTION_M, help="Cell size in metres")
+    parser.add_argument('--utm-zone', type=int, default=DEFAULT_UTM_ZONE)
+    parser.add_argument('--tile-size', type=int, default=DEFAULT_TILE_SIZE, help="Tile edge length in cells")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument('--model', default=BUNDLE_PATH)
+    parser.add_argument('--land-cover-type', default=DEFAULT_LAND_COVER_TYPE)
+    parser.add_argument('--vegetation-type', default=DEFAULT_VEGETATION_TYPE)
+    parser.add_argument('--elevation', type=float, default=DEFAULT_ELEVATION, help="Elevation used for all cells")
+    parser.add_argument('--elevation-raster', help="GeoTIFF with elevations in metres (overrides --elevation)")
+    parser.add_argument('--feature-grid', default=FEATURE_GRID_STORE,
+                        help="Precomputed feature grid to read the satellite indices from (see feature_grid.py)")
+    parser.add_argument('--placeholder-indices', action='store_true',
+                        help="Fill cells the feature grid does not cover with placeholder index values and flag "
+                             "them (default: leave them NaN)")
+    parser.add_argument('--require-soil', action='store_true',
+                        help="Leave cells without SoilGrids texture NaN (default: predict them with missing "
+                             "texture and flag them). SoilGrids covers only about 0.06%% of Germany, so this "
+                             "leaves most of a map empty")
+    parser.add_argument('--geotiff', help="Also export the finished map to this GeoTIFF (needs rasterio)")
+    args = parser.parse_args(argv)
+    if args.bbox is None and args.polygon is None:
+        parser.error("either --bbox or --polygon is required")
+    feature_grid = args.feature_grid if os.path.exists(os.path.join(args.feature_grid, 'grid.json')) else None
+    if feature_grid is None and not args.placeholder_indices:
+        parser.error(f"no feature grid at {args.feature_grid}; build one with feature_grid.py build or pass "
+                     f"--placeholder-indices")
+
+    bbox = args.bbox
+    if bbox is None:
+        region = load_region_polygon(args.polygon, args.utm_zone)
+        lat, lon = utm_to_latlon(region.edges[:, 0], region.edges[:, 1], args.utm_zone)
+        bbox = (lon.min(), lat.min(), lon.max(), lat.max())
+    grid = make_grid(bbox, args.resolution, args.utm_zone, args.tile_size)
+    params = {
+        'land_cover_type': args.land_cover_type,
+        'main_vegetation_type': args.vegetation_type,
+        'elevation': args.elevation,
+        'elevation_raster': args.elevation_raster,
+        'polygon': args.polygon,
+        'feature_grid': feature_grid,
+        'placeholder_indices': args.placeholder_indices,
+        'require_soil': args.require_soil,
+        'model': args.model,
+    }
+    soc_map = generate_map(args.output_dir, grid, params, args.workers)
+    flags = np.load(os.path.join(args.output_dir, FLAGS_FILE), mmap_mode='r')
+    print(f"Map with {int(np.isfinite(soc_map).sum())} predicted cells saved to "
+          f"{os.path.join(args.output_dir, MAP_FILE)} "
+          f"({int((flags & FLAG_PLACEHOLDER_INDICES).astype(bool).sum())} with placeholder indices, "
+          f"{int((flags & FLAG_NO_SOIL_TEXTURE).astype(bool).sum())} without soil texture)")
+    if args.geotiff:
+        print(f"GeoTIFF saved to {export_geotiff(args.output_dir, args.geotiff)}")
+
+
+if __name__ == '__main__':
+    main()
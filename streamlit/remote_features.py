@@ -0,0 +1,142 @@
+# Location features fetched from Earth Engine through a pluggable backend (see gee_backend.py)
+
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+import metrics
+from gee_backend import INDEX_BANDS, SENTINEL2_COLLECTION, RateLimitError
+from index_aggregation import aggregate_cube
+
+# Defaults for the concurrent quarterly index fetch
+MAX_CONCURRENT_REQUESTS = 8
+REQUEST_TIMEOUT = 60
+MAX_RETRIES = 4
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 30.0
+# Quarter statuses of fetches that failed but may succeed when asked again ('error: ...' included)
+TRANSIENT_STATUSES = ('rate_limited', 'timeout', 'error')
+
+
+def last_five_years():
+    # Time window for the last 5 years up to the last full month, at midnight so that repeated calls
+    # (and recorded requests, see cassette_backend.py) within a month see the same window
+    end_date = datetime.today().replace(day=1, hour=0, minute=0, second=0, microsecond=0) - timedelta(days=1)
+    start_date = end_date - timedelta(days=5*365)
+    return start_date, end_date
+
+
+def summarize_climate(series):
+    # Missing precipitation months count as 0, months without both temperature bands are skipped
+    precip = np.asarray(series['pr'], dtype=np.float64)
+    precip = np.where(np.isnan(precip), 0.0, precip)
+    temperature = (np.asarray(series['tmmn'], dtype=np.float64) + np.asarray(series['tmmx'], dtype=np.float64)) / 2
+    temperature = temperature[~np.isnan(temperature)]
+
+    # Mean and (population) std of monthly precipitation, mean temperature over the whole window
+    mean_precip = float(precip.mean()) if precip.size else 0
+    std_precip = float(precip.std()) if precip.size else 0
+    mean_temperature = float(temperature.mean()) if temperature.size else None
+    return mean_precip, std_precip, mean_temperature
+
+
+def fetch_climate_data(lat, lon, backend, start_date=None, end_date=None):
+    # One backend request returns the full monthly pr/tmmn/tmmx series, statistics are computed locally
+    if start_date is None or end_date is None:
+        start_date, end_date = last_five_years()
+    with metrics.span('climate_fetch'):
+        try:
+            series = backend.climate_series(lat, lon, start_date, end_date)
+        except Exception as e:
+            metrics.record_remote_call('climate_series', type(e).__name__)
+            raise
+    metrics.record_remote_call('climate_series', 'ok')
+    # getInfo() returns None for masked samples
+    series = {band: [np.nan if v is None else v for v in values] for band, values in series.items()}
+    return summarize_climate(series)
+
+
+def call_with_backoff(request, retries=MAX_RETRIES, backoff_base=BACKOFF_BASE, backoff_max=BACKOFF_MAX,
+                      sleep=time.sleep):
+    # Retry rate-limited and timed out requests with exponential backoff and jitter; other errors are final
+    for attempt in range(retries + 1):
+        try:
+            return request()
+        except (RateLimitError, TimeoutError):
+            if attempt == retries:
+                raise
+            delay = min(backoff_max, backoff_base * 2 ** attempt)
+            sleep(delay * random.uniform(0.5, 1.0))
+
+
+def _fetch_quarter(backend, lat, lon, start, cloud_threshold, buffer, scale, timeout, retries, backoff_base):
+    # Sample a 15 day window roughly in the middle of the quarter
+    target_date = start + pd.DateOffset(months=1, days=15)
+    window_end = target_date + timedelta(days=15)
+    row = {'date': start.strftime('%Y-%m-%d'), **{band: None for band in INDEX_BANDS}}
+    try:
+        result = call_with_backoff(
+            lambda: backend.quarter_indices(
+                lat, lon, target_date, window_end, collection=SENTINEL2_COLLECTION,
+                cloud_threshold=cloud_threshold, buffer=buffer, scale=scale, timeout=timeout
+            ),
+            retries=retries, backoff_base=backoff_base
+        )
+    except RateLimitError:
+        return {**row, 'status': 'rate_limited'}
+    except TimeoutError:
+        return {**row, 'status': 'timeout'}
+    except Exception as e:
+        return {**row, 'status': f'error: {e}'}
+    if result is None:
+        return {**row, 'status': 'no_image'}
+    return {**row, **result, 'status': 'ok'}
+
+
+def has_transient_failures(df):
+    # True if a quarter of fetch_quarterly_simple_indices() failed transiently; such results should not be
+    # cached, otherwise one quota burst pins partial statistics for the whole cache lifetime
+    return bool(df['status'].str.split(':').str[0].isin(TRANSIENT_STATUSES).any())
+
+
+def summarize_indices(df):
+    # Calculate mean, std, and trend for each index over the 5 years, ignoring missing quarters
+    cube = df[INDEX_BANDS].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=np.float64)[None]
+    mean, std, trend = (values[0] for values in aggregate_cube(cube))
+    stats = {}
+    for i, index in enumerate(INDEX_BANDS):
+        stats[f'{index}_mean'] = mean[i]
+        stats[f'{index}_std'] = std[i]
+        stats[f'{index}_trend'] = None if np.isnan(trend[i]) else float(trend[i])
+    return stats
+
+
+def fetch_quarterly_simple_indices(lat, lon, backend, cloud_threshold=80, buffer=30, scale=30,
+                                   max_concurrent=MAX_CONCURRENT_REQUESTS, timeout=REQUEST_TIMEOUT,
+                                   retries=MAX_RETRIES, backoff_base=BACKOFF_BASE, start_date=None, end_date=None):
+    # All quarters are requested in parallel (at most max_concurrent at a time), so latency is about
+    # the slowest round trip instead of the sum of all of them. Quarters that could not be fetched
+    # keep NaN indices and a status other than 'ok' ('no_image', 'timeout', 'rate_limited', 'error: ...').
+    if start_date is None or end_date is None:
+        start_date, end_date = last_five_years()
+    date_ranges = pd.date_range(start=start_date, end=end_date, freq='QS')  # Retrieve data quarterly
+
+    def fetch(start):
+        with metrics.span('index_fetch_quarter'):
+            row = _fetch_quarter(backend, lat, lon, start, cloud_threshold, buffer, scale, timeout, retries,
+                                 backoff_base)
+        metrics.record_remote_call('quarter_indices', row['status'].split(':')[0])
+        return row
+
+    with metrics.span('index_fetch'):
+        with ThreadPoolExecutor(max_workers=max(1, min(max_concurrent, len(date_ranges)))) as pool:
+            rows = list(pool.map(fetch, date_ranges))
+
+    df = pd.DataFrame(rows, columns=['date'] + INDEX_BANDS + ['status'])
+    df[INDEX_BANDS] = df[INDEX_BANDS].astype('float64')
+    df['missing'] = df['status'] != 'ok'
+    return df, summarize_indices(df)
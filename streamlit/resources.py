@@ -0,0 +1,122 @@
+# Process-wide cache for the model, the multi-target predictor, the vegetation encodings, the soil lookup,
+# the feature grid and the Earth Engine session and backend
+#
+# Streamlit re-executes the app script on every widget interaction, but imported modules stay
+# loaded for the lifetime of the server process. Keeping the loaded resources here means they
+# are read once per process and shared by all sessions. Cached files are re-read automatically
+# when their modification time or size changes, and invalidate() drops entries explicitly.
+# Loads are timed as load_<kind> stages and lookups counted as the 'resources' cache (see metrics.py).
+
+import json
+import os
+import threading
+
+import metrics
+from batch_predict import BUNDLE_PATH, FREQ_ENCODING_PATH, MEAN_ENCODING_PATH, load_model, load_encodings
+from model_bundle import MANIFEST_FILE
+from multi_target import MultiTargetPredictor, available_properties
+from soil_lookup import SOILGRIDS_CSV, SoilLookup
+
+_lock = threading.RLock()
+_cache = {}
+
+
+def _file_signature(path):
+    stat = os.stat(path)
+    return (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+
+def _get_or_load(name, signature, loader):
+    # The lock is held while loading so concurrent sessions never load the same resource twice
+    with _lock:
+        entry = _cache.get(name)
+        hit = entry is not None and entry[0] == signature
+        metrics.record_cache_lookup('resources', hit)
+        if hit:
+            return entry[1]
+        with metrics.span(f'load_{name[0]}'):
+            value = loader()
+        _cache[name] = (signature, value)
+        return value
+
+
+def get_model(path=BUNDLE_PATH):
+    # A bundle is rewritten manifest last, so the manifest signature covers the whole directory
+    signature_path = os.path.join(path, MANIFEST_FILE) if os.path.isdir(path) else path
+    return _get_or_load(("model", path), _file_signature(signature_path), lambda: load_model(path))
+
+
+def get_predictor():
+    # All soil properties with a trained bundle; a new or retrained bundle changes the signature
+    paths = available_properties()
+    signature = tuple((name, _file_signature(os.path.join(path, MANIFEST_FILE))) for name, path in paths.items())
+    return _get_or_load(("predictor",), signature, lambda: MultiTargetPredictor.load(list(paths)))
+
+
+def get_encodings(freq_path=FREQ_ENCODING_PATH, mean_path=MEAN_ENCODING_PATH):
+    signature = (_file_signature(freq_path), _file_signature(mean_path))
+    return _get_or_load(("encodings", freq_path, mean_path), signature, lambda: load_encodings(freq_path, mean_path))
+
+
+def get_soil_lookup(polygons_path=SOILGRIDS_CSV):
+    return _get_or_load(("soil_lookup", polygons_path), _file_signature(polygons_path),
+                        lambda: SoilLookup.from_files(polygons_path))
+
+
+def get_feature_grid(path=None):
+    # Memory-mapped feature grid (see feature_grid.py), None if it has not been built
+    from feature_grid import DEFAULT_STORE, FeatureGrid
+
+    path = path or DEFAULT_STORE
+    grid_file = os.path.join(path, "grid.json")
+    if not os.path.exists(grid_file):
+        return None
+    return _get_or_load(("feature_grid", path), _file_signature(grid_file), lambda: FeatureGrid.open(path))
+
+
+def init_earth_engine(credentials_json):
+    # Initialize Earth Engine once per service account; the key is passed in memory instead of a temp file
+    credentials = json.loads(credentials_json) if isinstance(credentials_json, str) else credentials_json
+    client_email = credentials["client_email"]
+
+    def _initialize():
+        import ee
+
+        ee_credentials = ee.ServiceAccountCredentials(client_email, key_data=json.dumps(credentials))
+        ee.Initialize(ee_credentials)
+        return ee_credentials
+
+    return _get_or_load(("earth_engine", client_email), client_email, _initialize)
+
+
+def get_gee_backend(credentials_json=None):
+    # The Earth Engine backend of the apps. With SOC_GEE_REPLAY=<cassette> requests are served from a
+    # recording without credentials (SOC_GEE_REPLAY_LATENCY: seconds or 'recorded'), with
+    # SOC_GEE_RECORD=<cassette> the live backend is recorded into it (see cassette_backend.py)
+    from cassette_backend import RecordingBackend, ReplayBackend, replay_latency
+    from gee_backend import EarthEngineBackend
+
+    replay = os.environ.get("SOC_GEE_REPLAY")
+    if replay:
+        latency = os.environ.get("SOC_GEE_REPLAY_LATENCY")
+        return _get_or_load(("gee_backend", replay), _file_signature(replay),
+                            lambda: ReplayBackend(replay, latency=replay_latency(latency) if latency else None))
+    init_earth_engine(credentials_json)
+    record = os.environ.get("SOC_GEE_RECORD")
+    if record:
+        return _get_or_load(("gee_backend", record), record, lambda: RecordingBackend(EarthEngineBackend(), record))
+    return _get_or_load(("gee_backend",), None, EarthEngineBackend)
+
+
+def start_metrics_server(port):
+    # Prometheus /metrics endpoint, started once per process however often the app script reruns
+    return _get_or_load(("metrics_server", port), port, lambda: metrics.serve(port))
+
+
+def invalidate(kind=None):
+    # Drop all cached resources, or only those of one kind ('model', 'predictor', 'encodings', 'soil_lookup',
+    # 'feature_grid', 'earth_engine', 'gee_backend')
+    with _lock:
+        for name in list(_cache):
+            if kind is None or name[0] == kind:
+                del _cache[name]
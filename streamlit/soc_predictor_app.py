@@ -1,10 +1,32 @@
+import os
+
 import streamlit as st
 import pandas as pd
 import numpy as np
-import ee
-import pickle
 from datetime import datetime, timedelta
-import json
+
+import metrics
+from batch_predict import (
+    DEFAULT_INDEX_STATS,
+    INDEX_COLUMNS,
+    iter_predictions,
+    model_encodings,
+)
+from feature_cache import FeatureCache
+from gee_backend import SENTINEL2_COLLECTION
+from remote_features import (
+    fetch_quarterly_simple_indices as fetch_live_indices,
+    has_transient_failures,
+    last_five_years,
+)
+from resources import (
+    get_feature_grid,
+    get_gee_backend,
+    get_predictor,
+    get_soil_lookup,
+    start_metrics_server,
+)
+from soil_lookup import MODEL_TEXTURE_FRACTIONS
 
 # Streamlit Page Configuration
 st.set_page_config(
@@ -49,76 +71,159 @@ st.markdown("""
 # App Title
 st.title("🌾 Soil Organic Carbon Predictor")
 
-# Input Section
-st.header("Input Details")
-lat = st.number_input("Latitude", format="%.6f", value=54.8599)
-lon = st.number_input("Longitude", format="%.6f", value=8.4114)
-elevation = st.number_input("Elevation (meters)", format="%.1f", value=50.0, help="Enter elevation if known.")
-sand = st.number_input("Sand (%)", min_value=0, max_value=100, step=1)
-silt = st.number_input("Silt (%)", min_value=0, max_value=100, step=1)
-clay = st.number_input("Clay (%)", min_value=0, max_value=100, step=1)
-
-# Validate Soil Composition
-if sand + silt + clay != 100:
-    st.warning("⚠️ Sand, silt, and clay percentages must total 100%.")
+# Per-stage timings of this script run (only collected with SOC_METRICS=1, see metrics.py)
+metrics.begin_trace()
+if metrics.is_enabled() and os.environ.get("SOC_METRICS_PORT"):
+    start_metrics_server(int(os.environ["SOC_METRICS_PORT"]))
+
+# Load the model bundles of all trained soil properties (cached once per process, reloaded only when a
+# bundle changes); the SOC bundle carries the vegetation encodings and the land cover categories
+predictor = get_predictor()
+freq_encoding, mean_encoding = model_encodings(predictor)
+
+# SoilGrids polygons for automatic soil texture (indexed once per process)
+soil_lookup = get_soil_lookup()
+
+main_vegetation_type_values = predictor.vegetation_types
+land_cover_type_values = predictor.land_cover_types
+
+mode = st.radio("Prediction Mode", options=["Single location", "Batch file upload"], horizontal=True)
+
+if mode == "Single location":
+    # Input Section
+    st.header("Input Details")
+    lat = st.number_input("Latitude", format="%.6f", value=54.8599)
+    lon = st.number_input("Longitude", format="%.6f", value=8.4114)
+    elevation = st.number_input("Elevation (meters)", format="%.1f", value=50.0, help="Enter elevation if known.")
+
+    # Prefill soil texture from SoilGrids where the location is covered. The inputs below are the actual
+    # fractions; the lookup returns them as the model's texture inputs, which were trained on other fractions
+    # than their names say (see soil_lookup.MODEL_TEXTURE_FRACTIONS)
+    with metrics.span("soil_lookup"):
+        texture = soil_lookup.soil_texture(lat, lon).iloc[0]
+    if texture.notna().all():
+        st.info("Soil texture prefilled from SoilGrids (0-30 cm), adjust if you have measurements.")
+        texture = {MODEL_TEXTURE_FRACTIONS[column]: int(round(value)) for column, value in texture.items()}
+    else:
+        texture = {"sand": 0, "silt": 0, "clay": 0}
+    sand = st.number_input("Sand (%)", min_value=0, max_value=100, step=1, value=texture["sand"])
+    silt = st.number_input("Silt (%)", min_value=0, max_value=100, step=1, value=texture["silt"])
+    clay = st.number_input("Clay (%)", min_value=0, max_value=100, step=1, value=texture["clay"])
+
+    # Validate Soil Composition
+    if sand + silt + clay != 100:
+        st.warning("⚠️ Sand, silt, and clay percentages must total 100%.")
+    else:
+        st.success("Valid soil composition!")
+
+    # Dropdown Inputs for Vegetation and Land Cover
+    st.header("Land Cover Details")
+    selected_land_cover_type = st.selectbox("Select Land Cover Type", options=land_cover_type_values)
+    selected_main_vegetation_type = st.selectbox("Select Main Vegetation Type", options=main_vegetation_type_values)
 else:
-    st.success("Valid soil composition!")
-
-# Load Encoding Files
-freq_encoding = np.load("streamlit/main_vegetation_type_freq_encoding.npy", allow_pickle=True).item()
-mean_encoding = np.load("streamlit/main_vegetation_type_mean_encoding.npy", allow_pickle=True).item()
-
-# Dropdown Inputs for Vegetation and Land Cover
-st.header("Land Cover Details")
-main_vegetation_type_values = list(freq_encoding.keys())
-land_cover_type_values = ["Cropland", "Grassland", "Woodland", "Bareland", "Shrubland"]
-
-selected_land_cover_type = st.selectbox("Select Land Cover Type", options=land_cover_type_values)
-selected_main_vegetation_type = st.selectbox("Select Main Vegetation Type", options=main_vegetation_type_values)
-
-# Earth Engine Initialization
-GEE_CREDENTIALS = json.loads(st.secrets["GEE_CREDENTIALS_JSON"])
-with open("temp-gee-key.json", "w") as key_file:
-    json.dump(GEE_CREDENTIALS, key_file)
-EE_CREDENTIALS = ee.ServiceAccountCredentials(GEE_CREDENTIALS["client_email"], "temp-gee-key.json")
-ee.Initialize(EE_CREDENTIALS)
-
-# Load Model
-with open("ml_model/tuned_lightgbm_model.pkl", "rb") as model_file:
-    model = pickle.load(model_file)
+    # Batch Input Section
+    st.header("Batch Input")
+    st.markdown(
+        "Upload a CSV or Parquet file with the columns `lat`, `long`, `elevation`, `sand`, `silt`, `clay`, "
+        "`land_cover_type` and `main_vegetation_type`. Missing `sand`, `silt` and `clay` values are filled "
+        "from SoilGrids where available. These columns are the model's texture inputs as in the training "
+        "table: `sand` is silt %, `silt` is clay % and `clay` is sand %."
+    )
+    uploaded_file = st.file_uploader("Locations file", type=["csv", "parquet"])
+
+# Earth Engine Initialization (once per process; SOC_GEE_REPLAY serves recorded requests instead)
+gee_backend = get_gee_backend(None if os.environ.get("SOC_GEE_REPLAY") else st.secrets["GEE_CREDENTIALS_JSON"])
+
+# Precomputed index features (None until streamlit/feature_grid.py has been run)
+feature_grid = get_feature_grid()
+
+# Local cache for live index fetches, shared by all sessions and app processes
+feature_cache = FeatureCache()
+
+def cached_live_indices(lat, lon, cloud_threshold=80):
+    start_date, end_date = last_five_years()
+    key = feature_cache.make_key(
+        "quarterly_indices", lat, lon,
+        start=start_date.strftime("%Y-%m-%d"), end=end_date.strftime("%Y-%m-%d"),
+        collection=SENTINEL2_COLLECTION, cloud_threshold=cloud_threshold, buffer=30, scale=30
+    )
+    # Results with rate-limited, timed out or failed quarters are used but not cached, so they are fetched again
+    return feature_cache.get_or_fetch(key, lambda: fetch_live_indices(lat, lon, gee_backend, cloud_threshold),
+                                      cache_if=lambda result: not has_transient_failures(result[0]))
 
 # Function to Fetch Indices
 def fetch_quarterly_simple_indices(lat, lon):
-    # Example simplified data for testing
-    return {"NDVI_mean": 0.5, "NDMI_mean": 0.3, "BSI_mean": -0.2, "SOCI_mean": 0.1}
+    # Read the precomputed grid where it covers the location with fresh values, fetch live (through the
+    # feature cache) otherwise; indices that are still unavailable keep the placeholder values
+    stats = feature_grid.lookup(lat, lon, bilinear=True) if feature_grid is not None else None
+    source = "feature grid"
+    if stats is None:
+        with metrics.span("index_fetch_live"):
+            _, stats = cached_live_indices(lat, lon)
+        source = "Earth Engine"
+    indices = {column: stats.get(column) for column in INDEX_COLUMNS}
+    missing = [column for column, value in indices.items() if value is None or np.isnan(value)]
+    for column in missing:
+        indices[column] = DEFAULT_INDEX_STATS[column]
+    if len(missing) == len(INDEX_COLUMNS):
+        source = "placeholder values"
+    return indices, source
 
 # Prediction Button
-if st.button("Fetch Data and Predict"):
+if mode == "Single location" and st.button("Fetch Data and Predict"):
     # Fetch indices
-    stats = fetch_quarterly_simple_indices(lat, lon)
+    with metrics.span("index_fetch"):
+        stats, index_source = fetch_quarterly_simple_indices(lat, lon)
 
     # Prepare model input
     model_input_data = {
         "lat": lat,
         "long": lon,
         "elevation": elevation,
-        "sand": sand,
-        "silt": silt,
-        "clay": clay,
+        **{column: {"sand": sand, "silt": silt, "clay": clay}[fraction]
+           for column, fraction in MODEL_TEXTURE_FRACTIONS.items()},
+        "land_cover_type": selected_land_cover_type,
+        "main_vegetation_type": selected_main_vegetation_type,
         **stats,
     }
 
-    # Add encodings for vegetation type
-    model_input_data["main_vegetation_type_freq_encoded"] = freq_encoding.get(selected_main_vegetation_type, 0)
-    model_input_data["main_vegetation_type_target_encoded"] = mean_encoding.get(selected_main_vegetation_type, 0)
-
-    # One-hot encode land cover type
-    for cover_type in land_cover_type_values:
-        model_input_data[f"land_cover_type_{cover_type}"] = int(selected_land_cover_type == cover_type)
-
-    # Convert to DataFrame for prediction
-    input_df = pd.DataFrame([model_input_data])
-
-    # Perform prediction
-    prediction = model.predict(input_df)[0]
-    st.success(f"Predicted relative SOC topsoil content (0-20cm depth): {prediction:.2f}%")
+    # Encode the inputs once and score every soil property model on them
+    with metrics.span("predict"):
+        predictions = predictor.predict_record(model_input_data)
+    st.success(f"Predicted relative SOC topsoil content (0-20cm depth): {predictions.pop('soc_in_percent'):.2f}%")
+    for name, value in predictions.items():
+        st.info(f"Predicted {predictor.describe(name)} (0-20cm depth): {value:.2f}")
+    st.caption(f"Satellite indices: {index_source}")
+
+# Batch Prediction Button
+if mode == "Batch file upload" and uploaded_file is not None and st.button("Predict File"):
+    try:
+        with metrics.span("batch_predict"):
+            predictions = pd.concat(
+                iter_predictions(uploaded_file, predictor, freq_encoding, mean_encoding, soil_lookup=soil_lookup),
+                ignore_index=True,
+            )
+    except ValueError as e:
+        st.error(f"Could not score the uploaded file: {e}")
+    else:
+        st.success(f"Predicted {', '.join(predictor.names)} for {len(predictions)} locations.")
+        st.dataframe(predictions.head(100))
+        st.download_button(
+            label="Download predictions as CSV",
+            data=predictions.to_csv(index=False),
+            file_name="soc_predictions.csv",
+            mime="text/csv",
+        )
+
+# Diagnostics Panel
+trace = metrics.end_trace()
+if metrics.is_enabled():
+    with st.expander("Diagnostics"):
+        st.markdown("**This run**")
+        st.dataframe(pd.DataFrame(trace, columns=["stage", "depth", "seconds", "error"]))
+        snapshot = metrics.snapshot()
+        st.markdown("**Since process start**")
+        st.dataframe(pd.DataFrame.from_dict(snapshot["stages"], orient="index"))
+        st.write("Cache hit ratio:", snapshot["cache_hit_ratio"])
+        st.dataframe(pd.DataFrame(snapshot["counters"]))
+        st.code(metrics.prometheus_text(), language="text")
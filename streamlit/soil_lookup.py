@@ -0,0 +1,348 @@
+# Soil property lookup for field locations (sand/silt/clay for the model inputs)
+#
+# Two sources are supported:
+#   - the SoilGrids polygons in data/soilgrids/soilgrids_germany.csv (hex EWKB in UTM zone 32N), decoded
+#     once into flat edge arrays and indexed with a Sort-Tile-Recursive packed R-tree
+#   - local GeoTIFF layers (e.g. the soilgrids-isric_Germany_*_combined.tif exports), read block by block
+#     with an LRU cache of decoded tiles; needs rasterio, which is only imported when a raster is opened
+# Queries take arrays of lat/lon and are answered in a few vectorized passes: the R-tree is descended one
+# level at a time for all points together, followed by an even-odd point-in-polygon test on the candidates.
+# The repo has no pyproj/shapely dependency, so the UTM projection and the WKB decoding are done here.
+#
+# Usage (from the repository root):
+#   python streamlit/soil_lookup.py    # compare the lookup with the feature table where SoilGrids covers it
+
+import argparse
+import struct
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+SOILGRIDS_CSV = "data/soilgrids/soilgrids_germany.csv"
+FEATURE_TABLE = "ml_model/feature_table_fixed.csv"
+# The model's texture inputs are not the fractions their names say: the feature table read
+# lucas_soil_types.csv (lat, long, silt%, clay%, sand%) by position, so the trained "sand" is silt %, "silt"
+# is clay % and "clay" is sand % (see data/lucas_db/python_scripts/build_feature_table.py). The lookup fills
+# every input with the fraction it was trained on. Model input -> soil fraction:
+MODEL_TEXTURE_FRACTIONS = {"sand": "silt", "silt": "clay", "clay": "sand"}
+# Model input -> SoilGrids column (0-30 cm average)
+TEXTURE_COLUMNS = {column: f"{fraction}_0_30cm" for column, fraction in MODEL_TEXTURE_FRACTIONS.items()}
+# SoilGrids stores texture fractions in g/kg
+GKG_PER_PERCENT = 10
+STR_NODE_CAPACITY = 16
+DEFAULT_TILE_CACHE_SIZE = 64
+
+_WGS84_A = 6378137.0
+_WGS84_F = 1 / 298.257223563
+_UTM_K0 = 0.9996
+_UTM_FALSE_EASTING = 500000.0
+_WKB_SRID_FLAG = 0x20000000
+_WKB_POLYGON = 3
+
+
+def latlon_to_utm(lat, lon, zone=32):
+    # Transverse Mercator (Krueger series to third order in n, millimetre accuracy within a zone and
+    # well below the 250 m SoilGrids resolution several degrees outside of it), northern hemisphere
+    lat = np.radians(np.asarray(lat, dtype=np.float64))
+    dlon = np.radians(np.asarray(lon, dtype=np.float64) - (zone * 6 - 183))
+    n = _WGS84_F / (2 - _WGS84_F)
+    radius = _WGS84_A / (1 + n) * (1 + n ** 2 / 4 + n ** 4 / 64)
+    alpha = [n / 2 - 2 * n ** 2 / 3 + 5 * n ** 3 / 16, 13 * n ** 2 / 48 - 3 * n ** 3 / 5, 61 * n ** 3 / 240]
+
+    e = 2 * np.sqrt(n) / (1 + n)
+    t = np.sinh(np.arctanh(np.sin(lat)) - e * np.arctanh(e * np.sin(lat)))
+    xi = np.arctan2(t, np.cos(dlon))
+    eta = np.arctanh(np.sin(dlon) / np.sqrt(1 + t ** 2))
+    easting = eta + sum(a * np.cos(2 * j * xi) * np.sinh(2 * j * eta) for j, a in enumerate(alpha, 1))
+    northing = xi + sum(a * np.sin(2 * j * xi) * np.cosh(2 * j * eta) for j, a in enumerate(alpha, 1))
+    return _UTM_FALSE_EASTING + _UTM_K0 * radius * easting, _UTM_K0 * radius * northing
+
+
+def utm_to_latlon(easting, northing, zone=32):
+    # Inverse of latlon_to_utm (same series, same accuracy)
+    n = _WGS84_F / (2 - _WGS84_F)
+    radius = _WGS84_A / (1 + n) * (1 + n ** 2 / 4 + n ** 4 / 64)
+    beta = [n / 2 - 2 * n ** 2 / 3 + 37 * n ** 3 / 96, n ** 2 / 48 + n ** 3 / 15, 17 * n ** 3 / 480]
+    delta = [2 * n - 2 * n ** 2 / 3 - 2 * n ** 3, 7 * n ** 2 / 3 - 8 * n ** 3 / 5, 56 * n ** 3 / 15]
+
+    xi = np.asarray(northing, dtype=np.float64) / (_UTM_K0 * radius)
+    eta = (np.asarray(easting, dtype=np.float64) - _UTM_FALSE_EASTING) / (_UTM_K0 * radius)
+    xi_ = xi - sum(b * np.sin(2 * j * xi) * np.cosh(2 * j * eta) for j, b in enumerate(beta, 1))
+    eta_ = eta - sum(b * np.cos(2 * j * xi) * np.sinh(2 * j * eta) for j, b in enumerate(beta, 1))
+    chi = np.arcsin(np.sin(xi_) / np.cosh(eta_))
+    lat = chi + sum(d * np.sin(2 * j * chi) for j, d in enumerate(delta, 1))
+    lon = np.arctan2(np.sinh(eta_), np.cos(xi_))
+    return np.degrees(lat), np.degrees(lon) + (zone * 6 - 183)
+
+
+def decode_ewkb_polygons(hex_geometries):
+    # Returns (srid, edges, edge_offsets): edges is an (E, 4) array of x0, y0, x1, y1 for all rings of all
+    # polygons, polygon i owns edges[edge_offsets[i]:edge_offsets[i + 1]]
+    srid = None
+    edges = []
+    offsets = [0]
+    for hex_geometry in hex_geometries:
+        data = bytes.fromhex(hex_geometry)
+        order = "<" if data[0] == 1 else ">"
+        geometry_type, = struct.unpack_from(order + "I", data, 1)
+        position = 5
+        if geometry_type & _WKB_SRID_FLAG:
+            srid, = struct.unpack_from(order + "I", data, position)
+            position += 4
+        if geometry_type & 0xFF != _WKB_POLYGON:
+            raise ValueError(f"Unsupported WKB geometry type {geometry_type:#x}")
+        n_rings, = struct.unpack_from(order + "I", data, position)
+        position += 4
+        for _ in range(n_rings):
+            n_points, = struct.unpack_from(order + "I", data, position)
+            position += 4
+            ring = np.frombuffer(data, dtype=order + "f8", count=2 * n_points, offset=position).reshape(-1, 2)
+            position += 16 * n_points
+            edges.append(np.hstack([ring[:-1], ring[1:]]))
+        offsets.append(offsets[-1] + sum(len(ring) for ring in edges[len(edges) - n_rings:]))
+    return srid, np.vstack(edges), np.asarray(offsets, dtype=np.int64)
+
+
+def _edge_bounds(edges, edge_offsets):
+    starts = edge_offsets[:-1]
+    xs, ys = edges[:, [0, 2]], edges[:, [1, 3]]
+    return np.column_stack([
+        np.minimum.reduceat(xs.min(axis=1), starts), np.minimum.reduceat(ys.min(axis=1), starts),
+        np.maximum.reduceat(xs.max(axis=1), starts), np.maximum.reduceat(ys.max(axis=1), starts),
+    ])
+
+
+def _ranges(starts, counts):
+    # Concatenation of range(start, start + count) for every pair, without a Python loop
+    total = counts.sum()
+    return np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(starts, counts)
+
+
+class STRTree:
+    # Packed R-tree over bounding boxes (min_x, min_y, max_x, max_y); every level is stored as
+    # (children in CSR form, node boxes), leaves point at item ids
+
+    def __init__(self, boxes, capacity=STR_NODE_CAPACITY):
+        self.boxes = np.asarray(boxes, dtype=np.float64)
+        self.levels = []
+        ids, level_boxes = np.arange(len(self.boxes)), self.boxes
+        while True:
+            children, offsets, node_boxes = self._pack(ids, level_boxes, capacity)
+            self.levels.append((children, offsets, node_boxes))
+            if len(node_boxes) == 1:
+                break
+            ids, level_boxes = np.arange(len(node_boxes)), node_boxes
+        self.levels.reverse()
+
+    @staticmethod
+    def _pack(ids, boxes, capacity):
+        n_nodes = -(-len(ids) // capacity)
+        slice_size = capacity * int(np.ceil(np.sqrt(n_nodes)))
+        centers = (boxes[:, :2] + boxes[:, 2:]) / 2
+        # Sort by x into vertical slices, then by y within each slice
+        by_x = np.argsort(centers[:, 0], kind="stable")
+        slices = np.arange(len(ids)) // slice_size
+        order = by_x[np.lexsort((centers[by_x, 1], slices))]
+        offsets = np.arange(0, len(ids) + capacity, capacity).clip(max=len(ids))
+        offsets = np.unique(offsets)
+        sorted_boxes = boxes[order]
+        node_boxes = np.column_stack([
+            np.minimum.reduceat(sorted_boxes[:, 0], offsets[:-1]), np.minimum.reduceat(sorted_boxes[:, 1], offsets[:-1]),
+            np.maximum.reduceat(sorted_boxes[:, 2], offsets[:-1]), np.maximum.reduceat(sorted_boxes[:, 3], offsets[:-1]),
+        ])
+        return ids[order], offsets, node_boxes
+
+    def query_points(self, x, y):
+        # Returns (point, item) index pairs for every item box that contains the point
+        x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+        points = np.arange(len(x))
+        nodes = np.zeros(len(x), dtype=np.int64)
+        for children, offsets, node_boxes in self.levels:
+            box = node_boxes[nodes]
+            keep = (box[:, 0] <= x[points]) & (x[points] <= box[:, 2]) & (box[:, 1] <= y[points]) & (y[points] <= box[:, 3])
+            points, nodes = points[keep], nodes[keep]
+            counts = offsets[nodes + 1] - offsets[nodes]
+            points, nodes = np.repeat(points, counts), children[_ranges(offsets[nodes], counts)]
+        box = self.boxes[nodes]
+        keep = (box[:, 0] <= x[points]) & (x[points] <= box[:, 2]) & (box[:, 1] <= y[points]) & (y[points] <= box[:, 3])
+        return points[keep], nodes[keep]
+
+
+class PolygonLayer:
+    def __init__(self, edges, edge_offsets, properties, utm_zone=32):
+        self.edges = edges
+        self.edge_offsets = edge_offsets
+        self.properties = properties.reset_index(drop=True)
+        self.utm_zone = utm_zone
+        self._property_arrays = {}
+        self.tree = STRTree(_edge_bounds(edges, edge_offsets))
+
+    @classmethod
+    def from_csv(cls, path=SOILGRIDS_CSV, geometry_column="geom"):
+        df = pd.read_csv(path)
+        srid, edges, edge_offsets = decode_ewkb_polygons(df[geometry_column])
+        if srid is not None and not 32601 <= srid <= 32660:
+            raise ValueError(f"Expected polygons in a northern UTM zone, got EPSG:{srid}")
+        return cls(edges, edge_offsets, df.drop(columns=geometry_column), utm_zone=(srid or 32632) - 32600)
+
+    def locate(self, lat, lon):
+        # Index of the polygon containing each point, -1 outside of all polygons
+        x, y = latlon_to_utm(lat, lon, self.utm_zone)
+        x, y = np.atleast_1d(x), np.atleast_1d(y)
+        points, polygons = self.tree.query_points(x, y)
+
+        # Even-odd rule over all rings of the candidate polygons
+        counts = self.edge_offsets[polygons + 1] - self.edge_offsets[polygons]
+        pair = np.repeat(np.arange(len(points)), counts)
+        x0, y0, x1, y1 = self.edges[_ranges(self.edge_offsets[polygons], counts)].T
+        px, py = x[points][pair], y[points][pair]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            crosses = ((y0 > py) != (y1 > py)) & (px < (x1 - x0) * (py - y0) / (y1 - y0) + x0)
+        inside = np.bincount(pair, weights=crosses, minlength=len(points)) % 2 == 1
+
+        # Points on a shared border take the lowest polygon id
+        result = np.full(len(x), np.iinfo(np.int64).max)
+        np.minimum.at(result, points[inside], polygons[inside])
+        result[result == np.iinfo(np.int64).max] = -1
+        return result
+
+    def query(self, lat, lon, columns):
+        columns = tuple(columns)
+        if columns not in self._property_arrays:
+            self._property_arrays[columns] = self.properties[list(columns)].to_numpy(dtype=np.float64)
+        located = self.locate(lat, lon)
+        values = self._property_arrays[columns][located.clip(min=0)]
+        values[located < 0] = np.nan
+        return values
+
+
+class RasterLayer:
+    # One band of a GeoTIFF, read in whole blocks that stay in an LRU cache
+
+    def __init__(self, path, band=1, tile_cache_size=DEFAULT_TILE_CACHE_SIZE):
+        import rasterio
+
+        self.dataset = rasterio.open(path)
+        self.band = band
+        self.tile_cache_size = tile_cache_size
+        self.block_height, self.block_width = self.dataset.block_shapes[band - 1]
+        self._tiles = OrderedDict()
+
+    def _tile(self, tile_row, tile_col):
+        key = (tile_row, tile_col)
+        tile = self._tiles.get(key)
+        if tile is not None:
+            self._tiles.move_to_end(key)
+            return tile
+
+        from rasterio.windows import Window
+
+        row_off, col_off = tile_row * self.block_height, tile_col * self.block_width
+        window = Window(col_off, row_off, min(self.block_width, self.dataset.width - col_off),
+                        min(self.block_height, self.dataset.height - row_off))
+        tile = self.dataset.read(self.band, window=window, masked=True).astype(np.float64).filled(np.nan)
+        self._tiles[key] = tile
+        if len(self._tiles) > self.tile_cache_size:
+            self._tiles.popitem(last=False)
+        return tile
+
+    def query(self, lat, lon):
+        from rasterio.warp import transform
+
+        xs, ys = transform("EPSG:4326", self.dataset.crs, np.atleast_1d(lon).tolist(), np.atleast_1d(lat).tolist())
+        cols, rows = ~self.dataset.transform * (np.asarray(xs), np.asarray(ys))
+        rows, cols = np.floor(rows).astype(np.int64), np.floor(cols).astype(np.int64)
+        values = np.full(len(rows), np.nan)
+        inside = (rows >= 0) & (rows < self.dataset.height) & (cols >= 0) & (cols < self.dataset.width)
+
+        # One cache lookup per distinct tile instead of per point
+        tile_ids = (rows // self.block_height) * (self.dataset.width // self.block_width + 1) + cols // self.block_width
+        for tile_id in np.unique(tile_ids[inside]):
+            selected = inside & (tile_ids == tile_id)
+            tile_row, tile_col = rows[selected][0] // self.block_height, cols[selected][0] // self.block_width
+            tile = self._tile(tile_row, tile_col)
+            values[selected] = tile[rows[selected] - tile_row * self.block_height,
+                                    cols[selected] - tile_col * self.block_width]
+        return values
+
+
+class SoilLookup:
+    # Polygons answer first, raster layers (soil fraction "sand"/"silt"/"clay" -> RasterLayer, values in
+    # g/kg) fill the gaps
+
+    def __init__(self, polygons=None, rasters=None):
+        self.polygons = polygons
+        self.rasters = rasters or {}
+
+    @classmethod
+    def from_files(cls, polygons_path=SOILGRIDS_CSV, raster_paths=None):
+        rasters = {column: RasterLayer(path) for column, path in (raster_paths or {}).items()}
+        return cls(PolygonLayer.from_csv(polygons_path) if polygons_path else None, rasters)
+
+    def soil_texture(self, lat, lon):
+        # The model's sand/silt/clay inputs in percent for every point (see MODEL_TEXTURE_FRACTIONS), NaN
+        # where no source covers it
+        lat, lon = np.atleast_1d(lat), np.atleast_1d(lon)
+        values = np.full((len(lat), len(TEXTURE_COLUMNS)), np.nan)
+        if self.polygons is not None:
+            values = self.polygons.query(lat, lon, TEXTURE_COLUMNS.values())
+        for i, column in enumerate(TEXTURE_COLUMNS):
+            missing = np.isnan(values[:, i])
+            fraction = MODEL_TEXTURE_FRACTIONS[column]
+            if fraction in self.rasters and missing.any():
+                values[missing, i] = self.rasters[fraction].query(lat[missing], lon[missing])
+        return pd.DataFrame(values / GKG_PER_PERCENT, columns=list(TEXTURE_COLUMNS))
+
+
+def fill_soil_texture(df, lookup, lat_column="lat", lon_column="long"):
+    # Fill missing sand/silt/clay columns or values from the lookup; given values are kept
+    if lon_column not in df.columns and "lon" in df.columns:
+        lon_column = "lon"
+    columns = list(TEXTURE_COLUMNS)
+    todo = np.zeros(len(df), dtype=bool)
+    for column in columns:
+        todo |= df[column].isna().to_numpy() if column in df.columns else True
+    if not todo.any():
+        return df
+
+    df = df.copy()
+    texture = lookup.soil_texture(df[lat_column].to_numpy()[todo], df[lon_column].to_numpy()[todo])
+    for column in columns:
+        current = df[column] if column in df.columns else pd.Series(np.nan, index=df.index)
+        filled = current.to_numpy(dtype=np.float64, copy=True)
+        filled[todo] = np.where(np.isnan(filled[todo]), texture[column].to_numpy(), filled[todo])
+        df[column] = filled
+    return df
+
+
+def compare_with_feature_table(lookup, feature_table=FEATURE_TABLE):
+    # Feature table rows the lookup covers, with the trained texture inputs next to the looked up ones
+    # (lookup_<column>). Rows with texture outside 0-100 % (nodata in the LUCAS file) are skipped.
+    table = pd.read_csv(feature_table, usecols=["lat", "long"] + list(TEXTURE_COLUMNS))
+    table = table[table[list(TEXTURE_COLUMNS)].apply(lambda values: values.between(0, 100)).all(axis=1)]
+    texture = lookup.soil_texture(table["lat"].to_numpy(), table["long"].to_numpy())
+    covered = texture.notna().all(axis=1).to_numpy()
+    return pd.concat([table[covered].reset_index(drop=True),
+                      texture[covered].add_prefix("lookup_").reset_index(drop=True)], axis=1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Compare the soil texture lookup with the texture the model was trained on.")
+    parser.add_argument("--polygons", default=SOILGRIDS_CSV)
+    parser.add_argument("--feature-table", default=FEATURE_TABLE)
+    args = parser.parse_args(argv)
+
+    comparison = compare_with_feature_table(SoilLookup.from_files(args.polygons), args.feature_table)
+    if comparison.empty:
+        print("No feature table location is covered by the lookup")
+        return
+    print(comparison.to_string(index=False))
+    for column in TEXTURE_COLUMNS:
+        error = (comparison[f"lookup_{column}"] - comparison[column]).abs().mean()
+        print(f"{column} ({MODEL_TEXTURE_FRACTIONS[column]} %): mean absolute difference {error:.1f} points")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+# Chunked, schema-typed ingestion of the LUCAS and BZE source tables with a Parquet cache
+#
+# Every source has an explicit column schema (SOURCES). Files are read in chunks of raw strings and each
+# column is converted with vectorized string kernels:
+#   float64/Int32/Int64  decimal commas become dots, then pd.to_numeric; unparseable values are NaN and
+#                        counted in the report
+#   censored             like float64, but values with a detection-limit qualifier ('<0.0', '< LOD',
+#                        '<  LOD', '>200') are NaN and flagged in <column>_censored (-1 below the limit,
+#                        1 above it, 0 measured), as the SQL import and build_feature_table treated them
+#   category/string      whitespace stripped
+#   date:<format>        parsed with the given format
+# Chunks are appended to a Parquet file, so memory stays bounded by the chunk size. The file is cached
+# under the SHA-256 of the source file and the schema, so unchanged inputs are read back from Parquet
+# instead of being parsed again, and a changed file or schema gets a new cache entry.
+#
+# The BZE workbooks (.xlsx) use the same schemas as their CSV exports and are streamed row by row with
+# openpyxl in read-only mode. They parse to the same tables as the CSV exports, except that the exports
+# replaced the commas in the Soil_climate_zone names with dots ('Ost-Westfalen. Lippe.'); the workbooks
+# keep the original names.
+#
+# Usage (from the repository root):
+#   python streamlit/source_ingestion.py                 # all sources
+#   python streamlit/source_ingestion.py bze_site --path data/bze/SITE.xlsx
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_CACHE_DIR = '.cache/ingestion'
+DEFAULT_CHUNK_SIZE = 50_000
+NA_VALUES = ['', 'NA', '---']
+
+LUCAS_CSV = 'data/lucas_db/csv_datasets/LUCAS-SOIL-2018.csv'
+BZE_DIR = 'data/bze'
+
+_LUCAS_CATEGORIES = ['Depth', 'NUTS_0', 'NUTS_1', 'NUTS_2', 'NUTS_3', 'LC', 'LU', 'LC0_Desc', 'LC1_Desc', 'LU1_Desc']
+_BZE_LAB_MEASUREMENTS = [
+    'gS', 'mS', 'fS', 'gU', 'mU', 'fU', 'Sand', 'Silt', 'Clay', 'pH_H2O', 'EC_H2O', 'pH_CaCl2', 'TC', 'TOC', 'TIC',
+    'TN', 'TS', 'BD_FS', 'FSS', 'Water content', 'Stone density', 'BD_bulk', 'Rock fragment fraction',
+    'Mn_Ox', 'Fe_Ox', 'Al_Ox', 'Mn_Di', 'Fe_Di', 'Al_Di',
+]
+
+SOURCES = {
+    'lucas_2018': {
+        'path': LUCAS_CSV,
+        'sep': ',',
+        'columns': {
+            'POINTID': 'Int64',
+            'pH_CaCl2': 'float64', 'pH_H2O': 'float64', 'EC': 'float64',
+            'OC': 'censored', 'CaCO3': 'censored', 'P': 'censored', 'N': 'censored', 'K': 'censored',
+            'OC (20-30 cm)': 'censored', 'CaCO3 (20-30 cm)': 'censored',
+            'Ox_Al': 'float64', 'Ox_Fe': 'float64',
+            'TH_LAT': 'float64', 'TH_LONG': 'float64',
+            'SURVEY_DATE': 'date:%d-%m-%y',
+            'Elev': 'Int32',
+            **{column: 'category' for column in _LUCAS_CATEGORIES},
+        },
+    },
+    'bze_site': {
+        'path': os.path.join(BZE_DIR, 'site.csv'),
+        'sep': ';',
+        'columns': {
+            'PointID': 'Int64', 'County': 'category', 'Sampling_month': 'Int32', 'Sampling_year': 'Int32',
+            'xcoord': 'float64', 'ycoord': 'float64', 'Soil_climate_zone': 'category', 'Land use': 'category',
+            'BZE_peat': 'Int32', 'Main soil type': 'category', 'Specific soil subtype': 'category',
+            'Groundwater class': 'category', 'Groundwater level': 'censored', 'Thickness of fen or bog': 'float64',
+            'Thickness of peat': 'float64', 'Slope': 'category', 'Exposition': 'category', 'Curvature': 'category',
+            'Type of relief': 'category', 'Position in relief': 'category', 'CS_0_30': 'float64',
+            'CS_30_100': 'float64',
+        },
+    },
+    'bze_laboratory': {
+        'path': os.path.join(BZE_DIR, 'laboratory_data.csv'),
+        'sep': ';',
+        'columns': {
+            'PointID': 'Int64', 'County': 'category', 'Layer upper limit': 'float64',
+            'Layer lower limit': 'float64', 'Horizon lower limit': 'float64', 'Soil texture class': 'category',
+            **{column: 'censored' for column in _BZE_LAB_MEASUREMENTS},
+        },
+    },
+    'bze_horizon': {
+        'path': os.path.join(BZE_DIR, 'horizon_data.csv'),
+        'sep': ';',
+        'columns': {
+            'PointID': 'Int64', 'HorizontID': 'Int32', 'Upper limit': 'float64', 'Lower limit': 'float64',
+            'Horizon symbol': 'string', 'Soil texture class': 'category', 'Soil colour': 'category',
+            'Stones': 'Int32', 'Carbonate class': 'category', 'Organic matter content class': 'category',
+            'Rooting intensity': 'category',
+        },
+    },
+}
+
+_QUALIFIER_RE = r'^\s*([<>])\s*(.*)$'
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def schema_hash(schema):
+    # Everything that changes the parsed output except the input file itself
+    spec = {'columns': schema['columns'], 'sep': schema.get('sep', ','), 'na_values': NA_VALUES}
+    return hashlib.sha256(json.dumps(spec, sort_keys=True).encode()).hexdigest()
+
+
+def _to_number(values, report, column):
+    # Decimal commas to dots, then one vectorized parse; values that still do not parse become NaN
+    cleaned = values.str.strip().str.replace(',', '.', regex=False)
+    numbers = pd.to_numeric(cleaned, errors='coerce')
+    invalid = int((numbers.isna() & cleaned.notna()).sum())
+    if invalid:
+        report['unparseable'][column] = report['unparseable'].get(column, 0) + invalid
+    return numbers
+
+
+def normalize_chunk(raw, schema, report):
+    # raw holds strings (NA for missing); returns the typed chunk in schema order plus the censoring flags
+    missing = [column for column in schema['columns'] if column not in raw.columns]
+    if missing:
+        raise ValueError(f"Source is missing schema columns: {missing}")
+
+    columns = {}
+    for column, dtype in schema['columns'].items():
+        values = raw[column]
+        if dtype == 'censored':
+            qualifier = values.str.extract(_QUALIFIER_RE)[0]
+            censored = qualifier.map({'<': -1, '>': 1}).fillna(0).astype('int8')
+            columns[column] = _to_number(values.where(censored == 0), report, column).astype('float64')
+            columns[f'{column}_censored'] = censored
+            report['censored'][column] = report['censored'].get(column, 0) + int((censored != 0).sum())
+        elif dtype in ('float64', 'Int32', 'Int64'):
+            numbers = _to_number(values, report, column)
+            if dtype != 'float64':
+                # Integer columns exported as floats ('2.0') are fine, fractional values are not
+                fractional = numbers.notna() & (numbers != np.floor(numbers))
+                if fractional.any():
+                    raise ValueError(f"Column {column} has non-integer values such as {values[fractional].iloc[0]!r}")
+            columns[column] = numbers.astype(dtype)
+        elif dtype in ('category', 'string'):
+            columns[column] = values.str.strip().astype('string')
+        elif dtype.startswith('date:'):
+            columns[column] = pd.to_datetime(values.str.strip(), format=dtype[len('date:'):], errors='coerce')
+        else:
+            raise ValueError(f"Unknown dtype {dtype!r} for column {column}")
+    return pd.DataFrame(columns, index=raw.index)
+
+
+def _arrow_schema(schema):
+    import pyarrow as pa
+
+    types = {'float64': pa.float64(), 'Int32': pa.int32(), 'Int64': pa.int64(), 'string': pa.string(),
+             'category': pa.string()}
+    fields = []
+    for column, dtype in schema['columns'].items():
+        if dtype == 'censored':
+            fields += [pa.field(column, pa.float64()), pa.field(f'{column}_censored', pa.int8())]
+        elif dtype.startswith('date:'):
+            fields.append(pa.field(column, pa.timestamp('ns')))
+        else:
+            fields.append(pa.field(column, types[dtype]))
+    return pa.schema(fields)
+
+
+def iter_raw_chunks(path, sep=',', chunk_size=DEFAULT_CHUNK_SIZE):
+    # The source as string chunks; nothing is converted by the reader
+    if str(path).lower().endswith('.xlsx'):
+        yield from _iter_xlsx_chunks(path, chunk_size)
+        return
+    yield from pd.read_csv(path, sep=sep, dtype='string', keep_default_na=False, na_values=NA_VALUES,
+                           chunksize=chunk_size)
+
+
+def _iter_xlsx_chunks(path, chunk_size):
+    # Streams the first worksheet without loading the workbook into memory
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = [str(name).strip() for name in next(rows)]
+        batch = []
+        for row in rows:
+            batch.append(['' if value is None else str(value) for value in row])
+            if len(batch) == chunk_size:
+                yield _xlsx_frame(batch, header)
+                batch = []
+        if batch:
+            yield _xlsx_frame(batch, header)
+    finally:
+        workbook.close()
+
+
+def _xlsx_frame(batch, header):
+    frame = pd.DataFrame(batch, columns=header, dtype='string')
+    return frame.where(~frame.isin(NA_VALUES))
+
+
+def ingest(source, path=None, cache_dir=DEFAULT_CACHE_DIR, chunk_size=DEFAULT_CHUNK_SIZE, force=False):
+    # Returns (Parquet path, report); the Parquet file is reused while file and schema are unchanged
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = SOURCES[source]
+    path = path or schema['path']
+    key = f"{source}-{file_hash(path)[:16]}-{schema_hash(schema)[:8]}"
+    cache_path = os.path.join(cache_dir, f'{key}.parquet')
+    report_path = os.path.join(cache_dir, f'{key}.json')
+    if not force and os.path.exists(cache_path) and os.path.exists(report_path):
+        with open(report_path) as f:
+            return cache_path, {**json.load(f), 'cached': True}
+
+    os.makedirs(cache_dir, exist_ok=True)
+    report = {'source': source, 'path': path, 'rows': 0, 'censored': {}, 'unparseable': {}}
+    arrow_schema = _arrow_schema(schema)
+    tmp_path = f'{cache_path}.tmp'
+    with pq.ParquetWriter(tmp_path, arrow_schema) as writer:
+        for raw in iter_raw_chunks(path, schema.get('sep', ','), chunk_size):
+            chunk = normalize_chunk(raw, schema, report)
+            writer.write_table(pa.Table.from_pandas(chunk, schema=arrow_schema, preserve_index=False))
+            report['rows'] += len(chunk)
+    os.replace(tmp_path, cache_path)
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    # Older entries of the same source belong to previous file versions
+    for stale in glob.glob(os.path.join(cache_dir, f'{source}-*')):
+        if not stale.startswith(os.path.join(cache_dir, key)):
+            os.remove(stale)
+    return cache_path, {**report, 'cached': False}
+
+
+def load_source(source, path=None, columns=None, cache_dir=DEFAULT_CACHE_DIR):
+    # Typed DataFrame of a source, parsed only if the file or its schema changed since the last call
+    cache_path, _ = ingest(source, path, cache_dir)
+    df = pd.read_parquet(cache_path, columns=columns)
+    for column, dtype in SOURCES[source]['columns'].items():
+        if dtype == 'category' and column in df.columns:
+            df[column] = df[column].astype('category')
+    return df
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Parse the LUCAS and BZE source tables into cached Parquet files.")
+    parser.add_argument('sources', nargs='*', help=f"Sources to ingest: {', '.join(SOURCES)} (default: all)")
+    parser.add_argument('--path', help="Read the (single) source from this CSV or .xlsx file instead")
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR)
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument('--force', action='store_true', help="Parse even if a cached copy exists")
+    args = parser.parse_args(argv)
+
+    sources = args.sources or list(SOURCES)
+    unknown = [source for source in sources if source not in SOURCES]
+    if unknown:
+        parser.error(f"unknown sources: {unknown}")
+    if args.path and len(sources) != 1:
+        parser.error("--path needs exactly one source")
+    for source in sources:
+        cache_path, report = ingest(source, args.path, args.cache_dir, args.chunk_size, args.force)
+        status = 'cached' if report['cached'] else 'parsed'
+        print(f"{source}: {report['rows']} rows {status} -> {cache_path}")
+        for kind in ('censored', 'unparseable'):
+            counts = {column: count for column, count in report[kind].items() if count}
+            if counts:
+                print(f"  {kind}: {counts}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+# Nearest-neighbour joins on lat/long with a distance tolerance
+#
+# The SQL pipeline joined tables on ROUND(lat, 5) = ROUND(t.lat, 5), which cannot use an index and
+# misses pairs whose sources round or print coordinates differently. Here the right-hand table is put
+# into a KD-tree on 3D unit-sphere coordinates and every left row takes its nearest right row, if it
+# lies within the tolerance. All rows are queried in one vectorized call.
+
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+EARTH_RADIUS_M = 6_371_000
+DEFAULT_TOLERANCE_M = 10.0
+
+
+def _to_xyz(lat, lon):
+    # Chord length on the sphere is the great-circle distance to well below a millimetre at these scales
+    lat = np.radians(np.asarray(lat, dtype=np.float64))
+    lon = np.radians(np.asarray(lon, dtype=np.float64))
+    return EARTH_RADIUS_M * np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+
+class SpatialIndex:
+    def __init__(self, lat, lon):
+        self._tree = cKDTree(_to_xyz(lat, lon))
+
+    def query(self, lat, lon, tolerance_m=DEFAULT_TOLERANCE_M):
+        # Returns (positions, distances, ambiguous): the position of the nearest indexed point (-1 when
+        # none is within the tolerance), its distance in m and whether a second point is within it too
+        k = min(2, self._tree.n)
+        distances, positions = self._tree.query(
+            _to_xyz(lat, lon), k=k, distance_upper_bound=tolerance_m
+        )
+        distances, positions = distances.reshape(len(distances), -1), positions.reshape(len(positions), -1)
+        matched = np.isfinite(distances[:, 0])
+        ambiguous = np.isfinite(distances[:, 1]) if k > 1 else np.zeros(len(distances), dtype=bool)
+        return np.where(matched, positions[:, 0], -1), distances[:, 0], ambiguous
+
+
+def spatial_join(left, right, columns, tolerance_m=DEFAULT_TOLERANCE_M, lat='lat', lon='long', right_lat=None,
+                 right_lon=None):
+    # LEFT JOIN of right[columns] onto left by nearest location; returns (joined frame, match report)
+    right_lat = right_lat or lat
+    right_lon = right_lon or lon
+    index = SpatialIndex(right[right_lat].to_numpy(), right[right_lon].to_numpy())
+    positions, distances, ambiguous = index.query(left[lat].to_numpy(), left[lon].to_numpy(), tolerance_m)
+    matched = positions >= 0
+
+    joined = left.copy()
+    for column in columns:
+        values = right[column].iloc[np.where(matched, positions, 0)].to_numpy() if len(right) else None
+        joined[column] = pd.Series(values, index=left.index).where(matched) if values is not None else np.nan
+
+    report = {
+        'rows': len(left),
+        'matched': int(matched.sum()),
+        'match_rate': float(matched.mean()) if len(left) else 0.0,
+        'ambiguous': int(ambiguous.sum()),
+        'reused': int(len(positions[matched]) - len(np.unique(positions[matched]))),
+        'max_distance_m': float(distances[matched].max()) if matched.any() else None,
+    }
+    return joined, report
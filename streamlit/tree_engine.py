@@ -0,0 +1,315 @@
+# Flattened tree-ensemble inference for the tuned LightGBM model using NumPy only
+#
+# export_model() flattens the booster's trees into contiguous node arrays and stores them in an
+# .npz file. TreeEnsemble loads those arrays and evaluates every tree over a batch at once, so
+# predictions need neither lightgbm nor scikit-learn at runtime. TreeEnsemble exposes the same
+# predict() and feature_name_ as the LGBMRegressor, so it can be used wherever the model is.
+#
+# Usage (from the repository root):
+#   python streamlit/tree_engine.py    # export ml_model/tuned_lightgbm_model.pkl and verify it
+
+import numpy as np
+
+ENGINE_PATH = "ml_model/tuned_lightgbm_model.npz"
+
+
+# LightGBM missing value handling per split
+MISSING_NONE, MISSING_ZERO, MISSING_NAN = 0, 1, 2
+_MISSING_TYPES = {"None": MISSING_NONE, "Zero": MISSING_ZERO, "NaN": MISSING_NAN}
+_ZERO_THRESHOLD = 1e-35
+
+# Rows per evaluation block; bitvector masks of a block (rows x trees x 8 bytes) should stay in cache
+_BITVECTOR_BLOCK_SIZE = 256
+_TRAVERSAL_BLOCK_SIZE = 4096
+_MAX_BITVECTOR_LEAVES = 64
+
+# Bits set per byte value, for NumPy < 2.0 which has no np.bitwise_count
+_BYTE_POPCOUNT = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
+
+
+def _popcount(values):
+    # Set bits of every uint64
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values)
+    values = np.ascontiguousarray(values)
+    return _BYTE_POPCOUNT[values.view(np.uint8)].reshape(values.shape + (8,)).sum(axis=-1, dtype=np.uint8)
+
+
+def flatten_booster(booster):
+    # Internal nodes of all trees are stored back to back; a negative child c points to leaf ~c
+    dump = booster.dump_model()
+    if dump["num_tree_per_iteration"] != 1 or dump["average_output"]:
+        raise ValueError("Only single-output gradient boosting regressors can be flattened")
+
+    feature, threshold, left, right, default_left, missing_type = [], [], [], [], [], []
+    leaf_value, roots = [], []
+
+    def add_node(node):
+        if "leaf_value" in node:
+            leaf_value.append(node["leaf_value"])
+            return ~(len(leaf_value) - 1)
+        if node["decision_type"] != "<=":
+            raise ValueError("Categorical splits are not supported")
+        index = len(feature)
+        feature.append(node["split_feature"])
+        threshold.append(node["threshold"])
+        default_left.append(node["default_left"])
+        missing_type.append(_MISSING_TYPES[node["missing_type"]])
+        left.append(0)
+        right.append(0)
+        left[index] = add_node(node["left_child"])
+        right[index] = add_node(node["right_child"])
+        return index
+
+    for tree in dump["tree_info"]:
+        roots.append(add_node(tree["tree_structure"]))
+
+    return {
+        "feature": np.asarray(feature, dtype=np.int32),
+        "threshold": np.asarray(threshold, dtype=np.float64),
+        "left": np.asarray(left, dtype=np.int32),
+        "right": np.asarray(right, dtype=np.int32),
+        "default_left": np.asarray(default_left, dtype=bool),
+        "missing_type": np.asarray(missing_type, dtype=np.int8),
+        "leaf_value": np.asarray(leaf_value, dtype=np.float64),
+        "roots": np.asarray(roots, dtype=np.int32),
+        "feature_names": np.asarray(dump["feature_names"]),
+    }
+
+
+def export_model(model, path=ENGINE_PATH):
+    booster = model.booster_ if hasattr(model, "booster_") else model
+    arrays = flatten_booster(booster)
+    np.savez(path, **arrays)
+    return path
+
+
+class TreeEnsemble:
+    def __init__(self, feature, threshold, left, right, default_left, missing_type, leaf_value, roots,
+                 feature_names):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.default_left = default_left
+        self.missing_type = missing_type
+        self.leaf_value = leaf_value
+        self.roots = roots
+        self.feature_name_ = [str(name) for name in feature_names]
+        self.n_features_in_ = len(self.feature_name_)
+
+        # Trees that are a single leaf contribute a constant to every prediction
+        leaf_roots = roots < 0
+        self._constant = float(leaf_value[~roots[leaf_roots]].sum())
+        self._split_roots = roots[~leaf_roots].astype(np.intp)
+
+        # Models with at most 64 leaves per tree and no missing value splits use the bitvector path
+        n_leaves_per_tree = np.diff(np.append(self._split_roots, len(feature))) + 1
+        self._use_bitvectors = bool(
+            (missing_type == MISSING_NONE).all() and (n_leaves_per_tree <= _MAX_BITVECTOR_LEAVES).all()
+        )
+        if self._use_bitvectors:
+            self._build_bitvectors()
+        else:
+            self._build_traversal()
+
+    @classmethod
+    def load(cls, path=ENGINE_PATH):
+        with np.load(path, allow_pickle=False) as arrays:
+            return cls(**{name: arrays[name] for name in arrays.files})
+
+    def _build_bitvectors(self):
+        # Bitvector evaluation (QuickScorer): bit j of a tree's mask stands for its j-th leaf from the left.
+        # Every split that evaluates false (x > threshold) rules out the leaves of its left subtree, and
+        # the exit leaf is the leftmost leaf that survives all false splits of the tree.
+        feature, threshold = self.feature, self.threshold
+        left, right = self.left.tolist(), self.right.tolist()
+        n_internal = len(feature)
+
+        # Global leaf id range covered by each node's subtree and by its left subtree (children come
+        # after their parent in the flattened preorder layout)
+        subtree_start, subtree_end, left_end = [0] * n_internal, [0] * n_internal, [0] * n_internal
+        for node in range(n_internal - 1, -1, -1):
+            child = left[node]
+            subtree_start[node] = ~child if child < 0 else subtree_start[child]
+            left_end[node] = ~child + 1 if child < 0 else subtree_end[child]
+            child = right[node]
+            subtree_end[node] = ~child + 1 if child < 0 else subtree_end[child]
+
+        n_trees = len(self._split_roots)
+        tree_of_node = np.searchsorted(self._split_roots, np.arange(n_internal), side="right") - 1
+        tree_first_leaf = np.asarray(subtree_start, dtype=np.int64)[self._split_roots]
+        tree_n_leaves = np.asarray(subtree_end, dtype=np.int64)[self._split_roots] - tree_first_leaf
+
+        first = np.asarray(subtree_start, dtype=np.uint64) - tree_first_leaf[tree_of_node].astype(np.uint64)
+        width = np.asarray(left_end, dtype=np.uint64) - np.asarray(subtree_start, dtype=np.uint64)
+        node_mask = ~(((np.uint64(1) << width) - np.uint64(1)) << first)
+
+        # Per feature: sorted unique thresholds, and for every threshold bin the AND of the masks of
+        # all splits that are false in that bin, one column per tree
+        self._bins = []
+        all_ones = np.iinfo(np.uint64).max
+        for f in range(self.n_features_in_):
+            nodes = np.flatnonzero(feature == f)
+            if nodes.size == 0:
+                continue
+            thresholds = np.unique(threshold[nodes])
+            table = np.full((len(thresholds) + 1, n_trees), all_ones, dtype=np.uint64)
+            split_bin = np.searchsorted(thresholds, threshold[nodes]) + 1
+            np.bitwise_and.at(table, (split_bin, tree_of_node[nodes]), node_mask[nodes])
+            table = np.bitwise_and.accumulate(table, axis=0)
+            self._bins.append((f, thresholds, table))
+
+        # Leaf values padded to 64 per tree, so that tree * 64 + leaf indexes them
+        self._leaf_table = np.zeros((n_trees, _MAX_BITVECTOR_LEAVES))
+        leaf_index = np.arange(_MAX_BITVECTOR_LEAVES)
+        valid = leaf_index[None, :] < tree_n_leaves[:, None]
+        self._leaf_table[valid] = self.leaf_value[(tree_first_leaf[:, None] + leaf_index[None, :])[valid]]
+        self._leaf_table = self._leaf_table.ravel()
+        self._tree_offsets = np.arange(n_trees, dtype=np.int64) * _MAX_BITVECTOR_LEAVES
+
+    def _predict_block_bitvectors(self, X):
+        # Splits without missing value handling read NaN as zero, like LightGBM
+        X = np.where(np.isnan(X), 0.0, X)
+        masks = None
+        for f, thresholds, table in self._bins:
+            codes = np.searchsorted(thresholds, X[:, f], side="left")
+            if masks is None:
+                masks = table.take(codes, axis=0)
+            else:
+                masks &= table.take(codes, axis=0)
+
+        out = np.full(len(X), self._constant)
+        if masks is None:
+            return out
+        # Index of the lowest set bit: popcount((m & -m) - 1)
+        lowest = masks & (~masks + np.uint64(1))
+        lowest -= np.uint64(1)
+        leaf = _popcount(lowest).astype(np.int64)
+        leaf += self._tree_offsets
+        out += self._leaf_table.take(leaf).sum(axis=1)
+        return out
+
+    def _build_traversal(self):
+        # Node ids are doubled so that _child[node + go_left] is the next node without an extra
+        # multiply. Leaves get ids after the internal nodes and loop onto themselves (feature 0,
+        # threshold +inf), so finished (tree, row) pairs can stay in the batch until the next compaction.
+        feature, leaf_value = self.feature, self.leaf_value
+        n_internal, n_leaves = len(feature), len(leaf_value)
+        n_nodes = n_internal + n_leaves
+        to_node = lambda child: 2 * np.where(child < 0, n_internal + ~child, child)
+        leaf_ids = 2 * np.arange(n_internal, n_nodes)
+        self._has_zero_splits = bool((self.missing_type == MISSING_ZERO).any())
+        self._first_leaf = 2 * n_internal
+        self._node_feature = np.repeat(np.concatenate([feature, np.zeros(n_leaves, dtype=np.int32)]), 2).astype(np.intp)
+        self._node_threshold = np.repeat(np.concatenate([self.threshold, np.full(n_leaves, np.inf)]), 2)
+        self._node_default_left = np.repeat(np.concatenate([self.default_left, np.ones(n_leaves, dtype=bool)]), 2)
+        self._node_missing_type = np.repeat(np.concatenate([self.missing_type, np.zeros(n_leaves, dtype=np.int8)]), 2)
+        self._node_value = np.repeat(np.concatenate([np.zeros(n_internal), leaf_value]), 2)
+        self._child = np.empty(2 * n_nodes, dtype=np.intp)
+        self._child[0:2 * n_internal:2] = to_node(self.right)
+        self._child[1:2 * n_internal:2] = to_node(self.left)
+        self._child[2 * n_internal::2] = leaf_ids
+        self._child[2 * n_internal + 1::2] = leaf_ids
+
+    def _predict_block_traversal(self, X):
+        n_rows, n_features = X.shape
+        n_trees = len(self._split_roots)
+        out = np.full(n_rows, self._constant)
+        flat = X.ravel()
+        feature, threshold, child = self._node_feature, self._node_threshold, self._child
+        # LightGBM reads NaN as zero on splits that do not track missing values, so NaN inputs always
+        # need the slower missing value path
+        has_missing = self._has_zero_splits or bool(np.isnan(flat).any())
+
+        # Every (tree, row) pair walks down its tree one level per step. Pairs that reached a leaf
+        # are dropped once they make up a quarter of the batch, and at the end.
+        offsets = np.tile(np.arange(0, n_rows * n_features, n_features, dtype=np.intp), n_trees)
+        nodes = np.repeat(2 * self._split_roots, n_rows)
+        while nodes.size:
+            index = feature.take(nodes)
+            index += offsets
+            values = flat.take(index)
+            go_left = values <= threshold.take(nodes)
+            if has_missing:
+                go_left = self._apply_missing(nodes, values, go_left)
+            nodes += go_left
+            nodes = child.take(nodes)
+
+            at_leaf = nodes >= self._first_leaf
+            n_done = np.count_nonzero(at_leaf)
+            if 4 * n_done >= nodes.size:
+                rows = offsets[at_leaf] // n_features
+                out += np.bincount(rows, weights=self._node_value.take(nodes[at_leaf]), minlength=n_rows)
+                keep = ~at_leaf
+                offsets = offsets[keep]
+                nodes = nodes[keep]
+        return out
+
+    def _apply_missing(self, nodes, values, go_left):
+        # Mirrors LightGBM: NaN counts as zero unless the split tracks NaN, missing goes the default way
+        missing_type = self._node_missing_type.take(nodes)
+        threshold = self._node_threshold.take(nodes)
+        nan_as_zero = np.isnan(values) & (missing_type != MISSING_NAN)
+        values = np.where(nan_as_zero, 0.0, values)
+        go_left = np.where(nan_as_zero, values <= threshold, go_left)
+        is_missing = ((missing_type == MISSING_ZERO) & (np.abs(values) <= _ZERO_THRESHOLD)) | (
+            (missing_type == MISSING_NAN) & np.isnan(values)
+        )
+        return np.where(is_missing, self._node_default_left.take(nodes), go_left)
+
+    def _as_matrix(self, X):
+        if hasattr(X, "columns"):
+            # Column selection is the slowest part of single-row predictions, so skip it when possible
+            if list(X.columns) != self.feature_name_:
+                X = X[self.feature_name_]
+            X = X.to_numpy(dtype=np.float64)
+        X = np.asarray(X, dtype=np.float64)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        if X.shape[1] != self.n_features_in_:
+            raise ValueError(f"Expected {self.n_features_in_} features, got {X.shape[1]}")
+        return np.ascontiguousarray(X)
+
+    def predict(self, X):
+        X = self._as_matrix(X)
+        if self._use_bitvectors:
+            predict_block, block_size = self._predict_block_bitvectors, _BITVECTOR_BLOCK_SIZE
+        else:
+            predict_block, block_size = self._predict_block_traversal, _TRAVERSAL_BLOCK_SIZE
+        if len(X) <= block_size:
+            return predict_block(X)
+        return np.concatenate([predict_block(X[i:i + block_size]) for i in range(0, len(X), block_size)])
+
+
+def main():
+    import pickle
+    import time
+
+    import pandas as pd
+
+    from batch_predict import MODEL_PATH, build_feature_frame, load_encodings
+
+    with open(MODEL_PATH, "rb") as model_file:
+        model = pickle.load(model_file)
+    export_model(model, ENGINE_PATH)
+    engine = TreeEnsemble.load(ENGINE_PATH)
+    print(f"Exported {len(engine.roots)} trees ({len(engine.feature)} splits) to {ENGINE_PATH}")
+
+    # Verify against the wrapper on the training feature table
+    freq_encoding, mean_encoding = load_encodings()
+    df = pd.read_csv("ml_model/feature_table_fixed.csv").dropna(subset=["land_cover_type", "main_vegetation_type"])
+    features = build_feature_frame(df, freq_encoding, mean_encoding, model.feature_name_)
+    max_diff = np.abs(engine.predict(features) - model.predict(features)).max()
+    print(f"Max absolute difference to model.predict over {len(features)} rows: {max_diff:.3e}")
+
+    for n_rows in (1, 100_000):
+        batch = features.sample(n_rows, replace=True, random_state=42)
+        for name, predictor in (("lightgbm", model), ("tree_engine", engine)):
+            start_time = time.perf_counter()
+            predictor.predict(batch)
+            print(f"{name:>12} {n_rows:>7} rows: {time.perf_counter() - start_time:.4f} seconds")
+
+
+if __name__ == "__main__":
+    main()